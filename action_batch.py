@@ -0,0 +1,112 @@
+'''
+Columnar container for exchange actions.
+
+An ActionBatch keeps every action as one row across NumPy columns: time (epoch ms),
+amount, price, basePrice, fee and feeAssetPrice as numbers, and asset, symbol, feeAsset,
+description and kind as categorical codes into small lookup tables. Holdings code works
+on whole columns of a batch built from one chunk of the slotted actions at a time.
+'''
+
+import numpy as np
+import pandas as pd
+
+from tools import toEpochMs
+
+NUMERIC_COLUMNS = ['amount', 'price', 'basePrice', 'fee', 'feeAssetPrice']
+CATEGORICAL_COLUMNS = ['asset', 'symbol', 'feeAsset', 'description', 'kind']
+
+
+class ActionBatch(object):
+
+    def __init__(self, time, numeric, codes, categories) -> None:
+        '''
+        time: int64 array of epoch ms
+        numeric: dict of column -> float64 array (NaN where an action has no such field)
+        codes: dict of column -> int32 array of indices into categories[column] (-1 for missing)
+        categories: dict of column -> list of str
+        '''
+        self.time = time
+        self.numeric = numeric
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def fromActions(cls, actions):
+        n = len(actions)
+        time = toEpochMs([action.time for action in actions]) if n else np.empty(0, dtype=np.int64)
+
+        numeric = {}
+        for column in NUMERIC_COLUMNS:
+            # Missing and unresolved (None) fields both become NaN
+            numeric[column] = np.array([getattr(action, column, np.nan) for action in actions], dtype=np.float64)
+
+        codes, categories = {}, {}
+        for column in CATEGORICAL_COLUMNS:
+            if column == 'kind':
+                values = [type(action).__name__ for action in actions]
+            else:
+                values = [getattr(action, column, None) for action in actions]
+            column_codes, column_categories = pd.factorize(pd.Series(values, dtype=object))
+            codes[column] = column_codes.astype(np.int32)
+            categories[column] = list(column_categories)
+
+        return cls(time, numeric, codes, categories)
+
+    def __len__(self):
+        return len(self.time)
+
+    def netAmountsByDay(self):
+        ''' (first UTC day, daily net amount matrix [day x asset], asset names) '''
+        day_ms = 24 * 60 * 60 * 1000
+        days = self.time // day_ms
+        first_day = int(days.min())
+        n_days = int(days.max()) - first_day + 1
+
+        # Actions without an asset (code -1) would otherwise be added into the last asset's column
+        known = self.codes['asset'] >= 0
+        if not known.all():
+            print('WARNING: {} action(s) without an asset left out of the daily movements'.format(int((~known).sum())))
+
+        movements = np.zeros((n_days, len(self.categories['asset'])))
+        np.add.at(movements, (days[known] - first_day, self.codes['asset'][known]), self.numeric['amount'][known])
+        return first_day, movements, self.categories['asset']
+
+
+class DailyMovements(object):
+    '''
+    Running daily net amount per asset, fed one ActionBatch at a time. Its size depends on
+    the number of days and assets, not on how many actions went through it.
+    '''
+
+    def __init__(self) -> None:
+        self.first_day = None
+        self.movements = np.zeros((0, 0))
+        self.assets = []
+        self.asset_index = {}
+
+    def add(self, batch):
+        if len(batch) == 0:
+            return
+
+        first_day, movements, assets = batch.netAmountsByDay()
+        for asset in assets:
+            if asset not in self.asset_index:
+                self.asset_index[asset] = len(self.assets)
+                self.assets.append(asset)
+
+        if self.first_day == None:
+            start, end = first_day, first_day + len(movements)
+        else:
+            start = min(self.first_day, first_day)
+            end = max(self.first_day + len(self.movements), first_day + len(movements))
+
+        grown = np.zeros((end - start, len(self.assets)))
+        if self.first_day != None:
+            offset = self.first_day - start
+            grown[offset:offset + len(self.movements), :self.movements.shape[1]] = self.movements
+
+        offset = first_day - start
+        grown[offset:offset + len(movements), [self.asset_index[asset] for asset in assets]] += movements
+
+        self.first_day = start
+        self.movements = grown
@@ -0,0 +1,50 @@
+'''
+asyncio facade over Exchange.
+
+Every blocking Exchange call runs on a worker thread so independent streams (the seven
+history endpoints, holdings and prices) progress concurrently on one event loop. The
+threads share the exchange's client and therefore its pooled HTTP session and rate
+limiter. The blocking Exchange API is unchanged.
+'''
+
+import asyncio
+
+class AsyncExchange(object):
+
+    def __init__(self, exchange, max_concurrency=8) -> None:
+        self.exchange = exchange
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def _run(self, method, *args):
+        if self._semaphore == None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await asyncio.to_thread(getattr(self.exchange, method), *args)
+
+    async def getCurrentHoldings(self):
+        return await self._run('getCurrentHoldings')
+
+    async def getPriceSnapshot(self):
+        return await self._run('getPriceSnapshot')
+
+    async def getTrades(self, start_date, end_date, assets, cursors=None):
+        return await self._run('getTrades', start_date, end_date, assets, cursors)
+
+    async def getDeposits(self, start_date, end_date):
+        return await self._run('getDeposits', start_date, end_date)
+
+    async def getWithdrawals(self, start_date, end_date):
+        return await self._run('getWithdrawals', start_date, end_date)
+
+    async def getFiatTransactions(self, start_date, end_date):
+        return await self._run('getFiatTransactions', start_date, end_date)
+
+    async def getAccountDust(self, start_date, end_date):
+        return await self._run('getAccountDust', start_date, end_date)
+
+    async def getAccountDividends(self, start_date, end_date):
+        return await self._run('getAccountDividends', start_date, end_date)
+
+    async def getAccountConversions(self, start_date, end_date):
+        return await self._run('getAccountConversions', start_date, end_date)
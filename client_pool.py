@@ -0,0 +1,44 @@
+'''
+Process-wide pool of python-binance clients keyed by API key.
+
+Building a Client opens a new requests session (and TCP/TLS connection) and pings the
+exchange. Pooling the clients means repeated portfolio updates in one process reuse warm
+keep-alive connections. Each pooled session is sized for the concurrent fetchers and asks
+for compressed responses.
+'''
+
+import threading
+
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = 16
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def configureSession(session, pool_size=POOL_SIZE):
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+def getClient(public_key, secret_key, pool_size=POOL_SIZE):
+    key = (public_key, secret_key)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key, None)
+        if client == None:
+            from binance.client import Client
+            client = Client(public_key, secret_key)
+            configureSession(client.session, pool_size)
+            _CLIENTS[key] = client
+        return client
+
+
+def closeClients():
+    with _CLIENTS_LOCK:
+        for client in _CLIENTS.values():
+            client.session.close()
+        _CLIENTS.clear()
@@ -1,41 +1,22 @@
 
-import json
-from binance.client import Client
-import time
 import copy
 
-from tools import gen_date_pairs, stringToTimeStamp
+from tools import fetchDateWindows, stringToTimeStamp
 from exchange_actions import *
 from global_vars import EXCHANGE_CODES
-
-class BinanceSymbol():
-    def __init__(self, symbol, q_curr, b_curr):
-        self.symbol = symbol
-        self.q_curr = q_curr
-        self.b_curr = b_curr
-        pass
-    
-    @classmethod
-    def fromSymbol(cls, symbol, base_coins):
-        ob = cls.__new__(cls)
-        ob.symbol = symbol
-
-        for base in base_coins:
-            symbol_split = symbol.split(base)
-            if len(symbol_split) > 1 and symbol_split[0] != '':
-                ob.b_curr = base
-                ob.q_curr = symbol_split[0]
-
-        return ob
+from symbol_registry import BinanceSymbol, SymbolRegistry, getSymbolRegistry
+from price_snapshot import getPriceSnapshot
+from rate_limiter import RateLimitedClient
+from client_pool import getClient
 
 class Exchange(object):
 
-    def __init__(self, code, pkey, skey, is_default) -> None:
+    def __init__(self, code, pkey, skey, is_default, client=None, limiter=None) -> None:
         self.code = code
         self.exchange_name = {v:k for k, v in EXCHANGE_CODES.items()}[code]
         
         if code == 'e0001':
-            self.exchange = BinanceExchange(pkey, skey)   
+            self.exchange = BinanceExchange(pkey, skey, client, limiter)   
             self.public_key = pkey
             self.secret_key = skey         
             self.is_default = is_default
@@ -47,8 +28,8 @@ class Exchange(object):
         return cls(exchange_setup['code'], exchange_setup['public_key'], exchange_setup['secret_key'], exchange_setup['is_default'])
     
     @classmethod
-    def from_mongo(cls, mongo_exchange):
-        return cls(mongo_exchange.exchange_code, mongo_exchange.exchange_pkey, mongo_exchange.exchange_skey, False)
+    def from_mongo(cls, mongo_exchange, client=None, limiter=None):
+        return cls(mongo_exchange.exchange_code, mongo_exchange.exchange_pkey, mongo_exchange.exchange_skey, False, client, limiter)
 
     def toDict(self):
         outdict = copy.deepcopy(self.__dict__)
@@ -58,75 +39,83 @@ class Exchange(object):
     def getCurrentHoldings(self):
         return self.exchange.getCurrentHoldings()
     
-    def getCurrentPriceForAssets(self, assets, base_currency):
-        assets = [asset if asset != 'BUSD' else 'USDT' for asset in assets ]
-        symbols = [asset + base_currency for asset in assets if asset != base_currency]
-        prices = self.exchange.getCurrentPrice(symbols)
-        out_dict = {k.split(base_currency)[0]: v for k,v in prices.items()}
-        out_dict.update({base_currency: 1.0})
-        return out_dict
-
-    def getTrades(self, start_date, end_date, assets):
-        exchange_trades = self.exchange.getTrades(assets, start_date, end_date)
-        trades = [TradeAction(trade).toDict() for trade in exchange_trades]
+    def getPriceSnapshot(self):
+        return self.exchange.getPriceSnapshot()
+
+    def getCurrentPriceForAssets(self, assets, base_currency, snapshot=None):
+        snapshot = snapshot if snapshot != None else self.getPriceSnapshot()
+        return snapshot.getPricesForAssets(assets, base_currency)
+
+    def getTrades(self, start_date, end_date, assets, cursors=None):
+        exchange_trades = self.exchange.getTrades(assets, start_date, end_date, cursors)
+        exchange_trades = rekeyRecords(exchange_trades, 'trades', self.code)
+        trades = enrichPrices([TradeAction(trade, re_key=False, resolve_prices=False) for trade in exchange_trades])
+        trades = [trade.toDict() for trade in trades]
         return trades
     
     def getDeposits(self, start_date, end_date):
         exchange_deposits = self.exchange.getDeposits(start_date, end_date)
-        deposits = [DepositAction(deposit).toDict() for deposit in exchange_deposits]
+        exchange_deposits = rekeyRecords(exchange_deposits, 'deposits', self.code)
+        deposits = [DepositAction(deposit, re_key=False).toDict() for deposit in exchange_deposits]
         return deposits
 
     def getWithdrawals(self, start_date, end_date):
         exchange_withdrawals = self.exchange.getWithdrawals(start_date, end_date)
-        withdrawals = [WithdrawlAction(withdrawal).toDict() for withdrawal in exchange_withdrawals]
+        exchange_withdrawals = rekeyRecords(exchange_withdrawals, 'withdrawals', self.code)
+        withdrawals = enrichPrices([WithdrawlAction(withdrawal, re_key=False, resolve_prices=False) for withdrawal in exchange_withdrawals])
+        withdrawals = [withdrawal.toDict() for withdrawal in withdrawals]
         return withdrawals
 
     def getFiatTransactions(self, start_date, end_date):
         exchange_fiat_transactions = self.exchange.getFiatTransactions(start_date, end_date)
-        fiat_transactions = [FiatDepositAction(fiat).toDict() for fiat in exchange_fiat_transactions]
+        exchange_fiat_transactions = rekeyRecords(exchange_fiat_transactions, 'fiat', self.code)
+        fiat_transactions = [FiatDepositAction(fiat, re_key=False).toDict() for fiat in exchange_fiat_transactions]
         return fiat_transactions
 
     def getAccountDust(self, start_date, end_date):
         exchange_dust = self.exchange.getAccountDust(start_date, end_date)
-        dust = [DustSweepAction(dust).toDict() for dust in exchange_dust]
+        exchange_dust = rekeyRecords(exchange_dust, 'dust', self.code)
+        dust = enrichPrices([DustSweepAction(dust, re_key=False, resolve_prices=False) for dust in exchange_dust])
+        dust = [d.toDict() for d in dust]
         return dust
 
     def getAccountDividends(self, start_date, end_date):
         exchange_dividends = self.exchange.getAccountDividends(start_date, end_date)
-        dividends = [DividendAction(dividend).toDict() for dividend in exchange_dividends]
+        exchange_dividends = rekeyRecords(exchange_dividends, 'dividends', self.code)
+        dividends = [DividendAction(dividend, re_key=False).toDict() for dividend in exchange_dividends]
         return dividends
     
     def getAccountConversions(self, start_date, end_date):
         exchange_conversions = self.exchange.getAccountConversions(start_date, end_date)
-        conversions = [ConversionAction(conversion).toDict() for conversion in exchange_conversions]
+        exchange_conversions = rekeyRecords(exchange_conversions, 'conversions', self.code, keep=['fromAsset'])
+        conversions = [ConversionAction(conversion, re_key=False).toDict() for conversion in exchange_conversions]
         return conversions
 
 class BinanceExchange(object):
 
-    def __init__(self, public_key, secret_key) -> None:
-        self.client = Client(public_key, secret_key)
-        self.valid_symbols = [ticker['symbol'] for ticker in self.client.get_all_tickers()]
+    def __init__(self, public_key, secret_key, client=None, limiter=None) -> None:
+        '''
+        client: optional stand-in for binance.client.Client (see fake_binance_client.py)
+        '''
+        if client == None:
+            self.client = RateLimitedClient(getClient(public_key, secret_key), limiter)
+            self.registry = getSymbolRegistry(self.client)
+        else:
+            # Injected clients serve their own symbols, they must not use or overwrite the shared cache
+            self.client = RateLimitedClient(client, limiter)
+            self.registry = SymbolRegistry.fromClient(self.client)
+        self.snapshot_key = EXCHANGE_CODES['Binance'] if client == None else id(client)
         self.base_symbols = [
             'AUD', 'BIDR', 'BRL', 'EUR', 'GBP', 'RUB', 'TRY', 'TUSD', 'USDC',
             'DAI', 'IDRT', 'UAH', 'NGN', 'VAI', 'USDP', 'BUSD', 'BNB',
             'BTC', 'USDT', 'BNB', 'ETH', 'TRX', 'XRP', 'DOGE', 'BVND']
+        self.base_symbols_set = set(self.base_symbols)
 
     def getTradingSymbols(self, quote_coins):
-        # TODO(ion): Speed this up by removing the reverse symbols careful with the priority of bases
-        symbols = []
-        
         if quote_coins:
-            for q_coin in quote_coins:
-                for b_coin in self.base_symbols:
-                    if q_coin == b_coin:
-                        continue
-                    else:
-                        symbol = BinanceSymbol(q_coin + b_coin, q_coin, b_coin)
-                        symbols.append(symbol)
-            return [symbol for symbol in symbols if symbol.symbol in self.valid_symbols]
-        
+            return [symbol for q_coin in quote_coins for symbol in self.registry.getPairsForAsset(q_coin) if symbol.b_curr in self.base_symbols_set]
         else:
-            return [BinanceSymbol.fromSymbol(symbol, self.base_symbols) for symbol in self.valid_symbols]
+            return self.registry.allSymbols()
         
     
     def getCurrentHoldings(self):
@@ -139,85 +128,70 @@ class BinanceExchange(object):
 
         return holdings
     
-    def getCurrentPrice(self, symbols) -> dict:
-        prices = {}
-        for symbol in symbols:
-            if symbol in self.valid_symbols:
-                prices[symbol] = float(self.client.get_avg_price(symbol=symbol)['price'])
-            else:
-                print('Warning symbol {} not valid - skipping!')
-                continue
-
-        return prices
-    
-    def getTrades(self, assets, start_date, end_date):
-        
+    def getPriceSnapshot(self):
+        return getPriceSnapshot(self.snapshot_key, self.client)
+
+    def getTrades(self, assets, start_date, end_date, cursors=None):
+        '''
+        Pages each symbol's trades forward with fromId from its cursor (the last trade id
+        already stored). cursors: dict of symbol -> last trade id, advanced in place
+        '''
+        cursors = {} if cursors == None else cursors
         my_symbols = self.getTradingSymbols(assets)
         start_date = stringToTimeStamp(start_date)
         end_date = stringToTimeStamp(end_date)
+        limit = 1000
         out_trades = []
         
         for symbol in my_symbols:
-            trades = self.client.get_my_trades(symbol=symbol.symbol)
-            time.sleep(0.5)
-            if trades:
+            from_id = cursors.get(symbol.symbol, -1) + 1
+
+            while True:
+                trades = self.client.get_my_trades(symbol=symbol.symbol, fromId=from_id, limit=limit)
+
                 for trade in trades:
-                    trade.update({'coin': symbol.q_curr})
-                    if trade['time'] > start_date and trade['time'] <= end_date:
+                    if trade['time'] > end_date:
+                        break
+                    if trade['time'] > start_date:
+                        trade.update({'coin': symbol.q_curr})
                         out_trades.append(trade)
-        
-        # with open('file.json') as infile:
-        #     out_trades = json.load(infile)
+                    cursors[symbol.symbol] = trade['id']
+                else:
+                    if len(trades) == limit:
+                        from_id = trades[-1]['id'] + 1
+                        continue
+                break
 
         return out_trades
     
     def getDeposits(self, start_date, end_date):
         
-        request_dates = gen_date_pairs(start_date, end_date, out_type='timestamp')
-        
-        deposits = []
-        for i_date, j_date in request_dates:
-            deposit = self.client.get_deposit_history(startTime=i_date, endTime=j_date)
-            if deposit:
-                deposits.extend(deposit)
+        def fetch(i_date, j_date):
+            return self.client.get_deposit_history(startTime=i_date, endTime=j_date)
 
-        return deposits
+        return fetchDateWindows(fetch, start_date, end_date, time_key='insertTime')
     
     def getWithdrawals(self, start_date, end_date):
 
-        date_pairs = gen_date_pairs(start_date, end_date, out_type='timestamp')
-
-        withdrawals = []
-
-        for i_date, j_date in date_pairs:
+        def fetch(i_date, j_date):
             order = {'startTime':i_date, 'endTime': j_date}
-            withdrawl = self.client.get_withdraw_history(**order)
-            
-            if withdrawl:
-                withdrawals.extend(withdrawl)
+            return self.client.get_withdraw_history(**order)
         
-        return withdrawals
+        return fetchDateWindows(fetch, start_date, end_date, time_key='applyTime')
     
     def getFiatTransactions(self, start_date, end_date):
         
-        date_pairs = gen_date_pairs(start_date, end_date, out_type='timestamp')
-
-        fiat_transactions = []
-
-        for i_date, j_date in date_pairs:
-            fiat_transaction = self.client.get_fiat_deposit_withdraw_history(transactionType=0, beginTime=i_date, endTime=j_date)
-            if fiat_transaction['total'] > 0:
-                for data in fiat_transaction['data']:
-                    if data['status'] == 'Successful':
-                        fiat_transactions.append(data)
-            
-            fiat_transaction = self.client.get_fiat_deposit_withdraw_history(transactionType=1, beginTime=i_date, endTime=j_date)
-            if fiat_transaction['total'] > 0:
-                for data in fiat_transaction['data']:
-                    if data['status'] == 'Successful':
-                        fiat_transactions.append(data)
+        def fetch(i_date, j_date):
+            fiat_transactions = []
+            for transaction_type in [0, 1]:
+                fiat_transaction = self.client.get_fiat_deposit_withdraw_history(transactionType=transaction_type, beginTime=i_date, endTime=j_date)
+                if fiat_transaction['total'] > 0:
+                    for data in fiat_transaction['data']:
+                        if data['status'] == 'Successful':
+                            fiat_transactions.append(data)
+            return fiat_transactions
         
-        return fiat_transactions
+        return fetchDateWindows(fetch, start_date, end_date, time_key='createTime')
     
     def getAccountDust(self, start_date, end_date):
 
@@ -243,13 +217,8 @@ class BinanceExchange(object):
 
     def getAccountConversions(self, start_date, end_date):
         
-        date_pairs = gen_date_pairs(start_date, end_date, freq=30, out_type='timestamp')
-
-        conversion_activities = []
-        for i_date, j_date in date_pairs:
+        def fetch(i_date, j_date):
             conversions = self.client.get_conversion_history(startTime=i_date, endTime=j_date)
-
-            if conversions['list']:
-                conversion_activities.extend(conversions['list'])
+            return conversions['list']
         
-        return conversion_activities
\ No newline at end of file
+        return fetchDateWindows(fetch, start_date, end_date, freq=30, time_key='createTime')
@@ -1,76 +1,158 @@
-import datetime as dt
+import numpy as np
+import pandas as pd
 
-from tools import stringToDate, dateToString, stringToTimeStamp, toTimeStamp, timestampToString, dbRead
+from tools import timestampToString, asTimeStamp, toEpochMs
 from global_vars import *
+from price_oracle import getPriceOracle
 
 def re_key_input(dictionary):
     out_dict = {BINANCE_KEY_MAP[exchange_key]: dictionary[exchange_key] for exchange_key in BINANCE_KEY_MAP.keys() if dictionary.get(exchange_key, None) != None}
     return out_dict
 
-def getPriceAtTime(symbol, time):
-    db_name = 'hourly_market_data.csv'
-    headers = ['close', 'symbol']
-
-    time = stringToDate(time)
-    start_date = dateToString(time.replace(minute=0, second=0))
-    end_date = dateToString(time.replace(minute=0, second=0) + dt.timedelta(hours=1))
-    time = toTimeStamp(time)
-
-    prices = dbRead(MARKET_DATA_PATH / db_name, start_date=start_date, end_date=end_date, headers=headers, filters=[{'symbol': symbol}])
-    timestamps = [stringToTimeStamp(time) for time in prices.dates]
+class KeyMapPlan(object):
+    '''
+    Column renames for one endpoint, compiled once from the keys its records carry.
+    When several exchange keys map to the same key the last non-null one in key map order
+    wins, as in re_key_input.
+    '''
+
+    def __init__(self, key_map, keys, keep=()):
+        self.sources = {}
+        for exchange_key, key in key_map.items():
+            if exchange_key in keys:
+                self.sources.setdefault(key, []).append(exchange_key)
+        self.keep = [key for key in keep if key in keys]
+
+    def apply(self, frame):
+        out = pd.DataFrame(index=frame.index)
+        for key, exchange_keys in self.sources.items():
+            column = frame[exchange_keys[-1]]
+            for exchange_key in reversed(exchange_keys[:-1]):
+                column = column.combine_first(frame[exchange_key])
+            out[key] = column
+        for key in self.keep:
+            out[key] = frame[key]
+        return out
+
+_KEY_MAP_PLANS = {}
+
+def rekeyRecords(records, endpoint, exchange_code='e0001', keep=()):
+    '''
+    Re-key a whole batch of API records with the endpoint's compiled plan
+    keep: exchange keys copied through unchanged next to the mapped ones
+    '''
+    if not records:
+        return []
+
+    frame = pd.DataFrame.from_records(records)
+    plan_key = (exchange_code, endpoint, tuple(frame.columns), tuple(keep))
+    plan = _KEY_MAP_PLANS.get(plan_key, None)
+    if plan == None:
+        plan = KeyMapPlan(KEY_MAPS[exchange_code], set(frame.columns), keep)
+        _KEY_MAP_PLANS[plan_key] = plan
+
+    out = plan.apply(frame)
+    # Times leave as UTC epoch ms, string times (withdrawal applyTime) are parsed for the whole column at once
+    if 'time' in out.columns and not pd.api.types.is_numeric_dtype(out['time']):
+        out['time'] = toEpochMs(out['time'].values)
+
+    out = out.astype(object)
+    return out.where(out.notna(), None).to_dict('records')
 
-    estimated_price = prices.data[0]['close'] + (time - timestamps[0])*(prices.data[1]['close'] - prices.data[0]['close'])/(timestamps[1] - timestamps[0])
+def getPriceAtTime(symbol, time):
+    price = getPriceOracle().price_at(symbol, time)
+    if np.isnan(price):
+        raise Exception('No hourly market data for {} at {}'.format(symbol, timestampToString(time)))
+    return price
+
+def enrichPrices(actions):
+    '''
+    Second construction phase for actions built with resolve_prices=False: every missing
+    (symbol, time) price is collected, deduplicated and resolved in one batched lookup.
+    Prices the market data does not cover are reported and left as None, so they are stored
+    empty and looked up again the next time the action is read.
+    '''
+    requests = [(action, attr, symbol) for action in actions for attr, symbol in action.getPriceRequests()]
+    if not requests:
+        return actions
+
+    pairs = list(set((symbol, action.time) for action, _, symbol in requests))
+    prices = getPriceOracle().prices_at([symbol for symbol, _ in pairs], [time for _, time in pairs])
+    resolved = dict(zip(pairs, prices))
+
+    unresolved = sorted(pair for pair, price in resolved.items() if np.isnan(price))
+    if unresolved:
+        listed = ', '.join('{} at {}'.format(symbol, timestampToString(time)) for symbol, time in unresolved[:10])
+        more = '' if len(unresolved) <= 10 else ' and {} more'.format(len(unresolved) - 10)
+        print('WARNING: No hourly market data for {} price(s), left unresolved: {}{}'.format(len(unresolved), listed, more))
+
+    for action, attr, symbol in requests:
+        price = resolved[(symbol, action.time)]
+        if not np.isnan(price):
+            setattr(action, attr, float(price))
 
-    return estimated_price
+    return actions
 
-def getAdditionalInformation(actions):
+# Action type -> the fee legs, opposite legs and rewards implied by one such action
+DERIVATIONS = {
+    'TradeAction': lambda action: [FeeAction(action.feeAsset, action.fee, action.time, 'trading fees'), action.getOppositeLegAction()],
+    'FiatDepositAction': lambda action: [FeeAction(action.feeAsset, action.fee, action.time, 'fiat deposit fee')],
+    'WithdrawlAction': lambda action: [FeeAction(action.feeAsset, action.fee, action.time, 'withdrawl fees')],
+    'DustSweepAction': lambda action: [FeeAction(action.feeAsset, action.fee, action.time, 'dust exchange fee'), action.getTransferAction()],
+    'ConversionAction': lambda action: [action.getOppositeLegAction()],
+}
+
+def withDerivedActions(actions):
+    '''
+    Lazily yields every action followed by the actions derived from it, so any iterable
+    (including another generator) can be streamed through without building a list
+    '''
     for action in actions:
-        if type(action) == TradeAction:
-            trade_fee_action = FeeAction(action.feeAsset, action.fee, action.time, 'trading fees')
-            trade_base_action = action.getOppositeLegAction()
-            actions.extend([trade_fee_action, trade_base_action])
-        elif type(action) == FiatDepositAction:
-            fiat_fee_action = FeeAction(action.feeAsset, action.fee, action.time, 'fiat deposit fee')
-            actions.append(fiat_fee_action)
-        elif type(action) == WithdrawlAction:
-            withdrawl_fee_action = FeeAction(action.feeAsset, action.fee, action.time, 'withdrawl fees')
-            actions.append(withdrawl_fee_action)
-        elif type(action) == DustSweepAction:
-            dust_transfer_action = action.getTransferAction()
-            dust_fee_action = FeeAction(action.feeAsset, action.fee, action.time, 'dust exchange fee')
-            actions.extend([dust_fee_action, dust_transfer_action])
-        elif type(action) == ConversionAction:
-            conversion_base_action = action.getOppositeLegAction()
-            actions.append(conversion_base_action)
-    return actions
+        yield action
+        derive = DERIVATIONS.get(type(action).__name__, None)
+        if derive != None:
+            yield from derive(action)
 
 class ExchangeAccountAction():
+    __slots__ = ('asset', 'amount', 'time', 'description')
 
     def __init__(self, asset, amount, time, description):
 
         self.asset = asset
         self.amount = float(amount)
+        # UTC epoch ms, formatted only by toBaseDict / toDict
         self.time = time
         self.description = description
         
         pass
 
     def toBaseDict(self):
-        return {'asset': self.asset, 'amount': self.amount, 'time': self.time, 'description': self.description}
+        return {'asset': self.asset, 'amount': self.amount, 'time': timestampToString(self.time), 'description': self.description}
+
+    def getPriceRequests(self):
+        ''' (attribute, symbol) pairs of prices left unresolved by the constructor '''
+        return []
 
     def toDict(self):
-        return self.__dict__
+        # Subclass fields first, then the base fields - the order the attributes are set in
+        out_dict = {}
+        for cls in type(self).__mro__:
+            for field in getattr(cls, '__slots__', ()):
+                if hasattr(self, field):
+                    out_dict[field] = getattr(self, field) if field != 'time' else timestampToString(self.time)
+        return out_dict
     
 class TradeAction(ExchangeAccountAction):
+    __slots__ = ('type', 'symbol', 'price', 'base', 'basePrice', 'fee', 'feeAsset', 'id', 'feeAssetPrice')
 
-    def __init__(self, trade_details, re_key=True):
+    def __init__(self, trade_details, re_key=True, resolve_prices=True):
         
         if re_key:
             trade_details = re_key_input(trade_details)
 
         asset = trade_details['asset']
         amount = float(trade_details['amount'])
-        time = timestampToString(trade_details['time']) if isinstance(trade_details['time'], int) else trade_details['time']
+        time = asTimeStamp(trade_details['time'])
         description = 'trading activity'
 
         if trade_details.get('isBuyer', None) != None:
@@ -87,7 +169,10 @@ class TradeAction(ExchangeAccountAction):
         
         base_price = trade_details.get('basePrice', None)
         if base_price == None:
-            self.basePrice = getPriceAtTime(self.base + BASECURR, time) if self.base != BASECURR else 1.0
+            if self.base == BASECURR:
+                self.basePrice = 1.0
+            else:
+                self.basePrice = getPriceAtTime(self.base + BASECURR, time) if resolve_prices else None
         else:
             self.basePrice = base_price
         
@@ -103,16 +188,25 @@ class TradeAction(ExchangeAccountAction):
             elif feeSymbol == self.symbol:
                 self.feeAssetPrice = self.price
             else:
-                self.feeAssetPrice = getPriceAtTime(feeSymbol, time)
+                self.feeAssetPrice = getPriceAtTime(feeSymbol, time) if resolve_prices else None
         else:
             self.feeAssetPrice = fee_asset_price
         
         super().__init__(asset, amount, time, description)
 
+    def getPriceRequests(self):
+        requests = []
+        if self.basePrice == None:
+            requests.append(('basePrice', self.base + BASECURR))
+        if self.feeAssetPrice == None:
+            requests.append(('feeAssetPrice', self.feeAsset + BASECURR))
+        return requests
+
     def getOppositeLegAction(self):
         return ExchangeAccountAction(self.base, -1 * (self.price * self.amount), self.time, 'trading activity')
 
 class DepositAction(ExchangeAccountAction):
+    __slots__ = ('network', 'address', 'status', 'id')
 
     def __init__(self, deposit_details, re_key=True):
 
@@ -121,7 +215,7 @@ class DepositAction(ExchangeAccountAction):
         
         asset = deposit_details['asset']
         amount = float(deposit_details['amount'])
-        time = timestampToString(deposit_details['time']) if isinstance(deposit_details['time'], int) else deposit_details['time']
+        time = asTimeStamp(deposit_details['time'])
         description = 'deposit activity'
 
         self.network = deposit_details['network']
@@ -132,15 +226,16 @@ class DepositAction(ExchangeAccountAction):
         super().__init__(asset, amount, time, description)
         
 class WithdrawlAction(ExchangeAccountAction):
+    __slots__ = ('network', 'address', 'status', 'fee', 'feeAsset', 'feeAssetPrice', 'id')
 
-    def __init__(self, withdraw_details, re_key=True):
+    def __init__(self, withdraw_details, re_key=True, resolve_prices=True):
 
         if re_key:
             withdraw_details = re_key_input(withdraw_details)            
 
         asset = withdraw_details['asset']
         amount = float(withdraw_details['amount']) * -1 if float(withdraw_details['amount']) > 0 else float(withdraw_details['amount'])
-        time = withdraw_details['time']
+        time = asTimeStamp(withdraw_details['time'])
         description = 'withdrawal activity'
 
         self.network = withdraw_details['network']
@@ -151,7 +246,10 @@ class WithdrawlAction(ExchangeAccountAction):
 
         fee_asset_price = withdraw_details.get('feeAssetPrice', None)
         if fee_asset_price == None:
-            self.feeAssetPrice = getPriceAtTime(self.feeAsset + BASECURR, time) if self.feeAsset != BASECURR else self.price
+            if self.feeAsset == BASECURR:
+                self.feeAssetPrice = 1.0
+            else:
+                self.feeAssetPrice = getPriceAtTime(self.feeAsset + BASECURR, time) if resolve_prices else None
         else:
             self.feeAssetPrice = fee_asset_price
 
@@ -159,16 +257,20 @@ class WithdrawlAction(ExchangeAccountAction):
 
         super().__init__(asset, amount, time, description)
 
+    def getPriceRequests(self):
+        return [('feeAssetPrice', self.feeAsset + BASECURR)] if self.feeAssetPrice == None else []
+
 class DustSweepAction(ExchangeAccountAction):
+    __slots__ = ('fee', 'feeAsset', 'feeAssetPrice', 'transferedAmount', 'transferedAsset', 'id')
 
-    def __init__(self, dust_details, re_key=True):
+    def __init__(self, dust_details, re_key=True, resolve_prices=True):
 
         if re_key:
             dust_details = re_key_input(dust_details)
         
         asset = dust_details['asset']
         amount = float(dust_details['amount']) * -1 if float(dust_details['amount']) > 0 else float(dust_details['amount'])
-        time = timestampToString(dust_details['time']) if isinstance(dust_details['time'], int) else dust_details['time']
+        time = asTimeStamp(dust_details['time'])
         description = 'dust sweep activity'
 
         self.fee = float(dust_details['fee'])
@@ -177,7 +279,10 @@ class DustSweepAction(ExchangeAccountAction):
         fee_asset_price = dust_details.get('feeAssetPrice', None)
 
         if fee_asset_price == None:
-            self.feeAssetPrice = getPriceAtTime(self.feeAsset + BASECURR, time) if self.feeAsset != BASECURR else 1
+            if self.feeAsset == BASECURR:
+                self.feeAssetPrice = 1.0
+            else:
+                self.feeAssetPrice = getPriceAtTime(self.feeAsset + BASECURR, time) if resolve_prices else None
         else:
             self.feeAssetPrice = fee_asset_price
 
@@ -187,10 +292,14 @@ class DustSweepAction(ExchangeAccountAction):
 
         super().__init__(asset, amount, time, description)
 
+    def getPriceRequests(self):
+        return [('feeAssetPrice', self.feeAsset + BASECURR)] if self.feeAssetPrice == None else []
+
     def getTransferAction(self):
         return ExchangeAccountAction(self.transferedAsset, self.transferedAmount, self.time, 'dust exchange reward')
 
 class FiatDepositAction(ExchangeAccountAction):
+    __slots__ = ('fee', 'feeAsset', 'id')
 
     def __init__(self, fdeposit_details, re_key=True):
         
@@ -199,7 +308,7 @@ class FiatDepositAction(ExchangeAccountAction):
 
         asset = fdeposit_details['asset']
         amount = float(fdeposit_details['amount'])
-        time = timestampToString(fdeposit_details['time']) if isinstance(fdeposit_details['time'], int) else fdeposit_details['time']
+        time = asTimeStamp(fdeposit_details['time'])
         description = 'fiat deposit activity'
 
         self.fee = float(fdeposit_details['fee'])
@@ -209,6 +318,7 @@ class FiatDepositAction(ExchangeAccountAction):
         super().__init__(asset, amount, time, description)
 
 class DividendAction(ExchangeAccountAction):
+    __slots__ = ()
 
     def __init__(self, dividend_details, re_key=True):
 
@@ -217,12 +327,13 @@ class DividendAction(ExchangeAccountAction):
 
         asset = dividend_details['asset']
         amount = float(dividend_details['amount'])
-        time = timestampToString(dividend_details['time']) if isinstance(dividend_details['time'], int) else dividend_details['time']
+        time = asTimeStamp(dividend_details['time'])
         description = 'dividend payment'
 
         super().__init__(asset, amount, time, description)
 
 class ConversionAction(ExchangeAccountAction):
+    __slots__ = ('base', 'price')
     
     def __init__(self, conversion_details, re_key=True):
 
@@ -233,7 +344,7 @@ class ConversionAction(ExchangeAccountAction):
 
         asset = conversion_details['asset']
         amount = float(conversion_details['amount'])
-        time = timestampToString(conversion_details['time']) if isinstance(conversion_details['time'], int) else conversion_details['time']
+        time = asTimeStamp(conversion_details['time'])
         description = 'conversion action'
 
         self.base = fromAsset
@@ -245,6 +356,7 @@ class ConversionAction(ExchangeAccountAction):
         return ExchangeAccountAction(self.base, -1 * (self.price / self.amount), self.time, 'conversion activity')
 
 class FeeAction(ExchangeAccountAction):
+    __slots__ = ()
 
     def __init__(self, asset, amount, time, description):
 
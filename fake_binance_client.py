@@ -0,0 +1,353 @@
+'''
+Offline stand-ins for binance.client.Client.
+
+All fakes answer from an in-memory account dataset with the same query semantics as the
+live endpoints (time windows, fromId paging, symbol filters), so the sync pipeline can be
+run and timed without a network:
+
+    RecordingClient - proxies a live client and saves every response into a fixture file
+    ReplayClient    - serves a recorded fixture file
+    SyntheticClient - generates an account with N symbols and M trades
+
+Fakes can inject latency, cap page sizes and raise rate-limit errors every Nth call.
+
+    python fake_binance_client.py [n_symbols] [m_trades]
+
+benchmarks the Exchange download methods, a full history sync and a portfolio update
+against a synthetic account.
+'''
+
+import copy
+import datetime as dt
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from tools import atomicWrite
+
+ENDPOINTS = ['trades', 'deposits', 'withdrawals', 'fiat', 'dust', 'dividends', 'conversions']
+
+
+def emptyDataset():
+    return {
+        'exchange_info': {'symbols': []},
+        'tickers': [],
+        'balances': [],
+        'trades': {},
+        'deposits': [],
+        'withdrawals': [],
+        'fiat': {'0': [], '1': []},
+        'dust': [],
+        'dividends': [],
+        'conversions': []
+    }
+
+def applyTimeToTimestamp(apply_time):
+    return int(dt.datetime.strptime(apply_time, '%Y-%m-%d %H:%M:%S').replace(tzinfo=dt.timezone.utc).timestamp() * 1000)
+
+def inWindow(ts, start, end):
+    return (start == None or ts >= start) and (end == None or ts <= end)
+
+
+class FakeBinanceAPIException(Exception):
+
+    def __init__(self, status_code, message, retry_after=1) -> None:
+        super().__init__('APIError(code={}): {}'.format(status_code, message))
+        self.status_code = status_code
+        self.message = message
+        self.response = FakeResponse({'Retry-After': str(retry_after)})
+
+
+class FakeResponse(object):
+
+    def __init__(self, headers) -> None:
+        self.headers = headers
+
+
+class FakeClient(object):
+    ''' Endpoint implementations over self.data, shared by the replay and synthetic clients '''
+
+    def __init__(self, data, latency=0.0, page_limit=None, rate_limit_every=0) -> None:
+        self.data = data
+        self.latency = latency
+        self.page_limit = page_limit
+        self.rate_limit_every = rate_limit_every
+        self.calls = {}
+        self.response = None
+
+    def _respond(self, method, result, weight=1):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        total_calls = sum(self.calls.values())
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.rate_limit_every and total_calls % self.rate_limit_every == 0:
+            raise FakeBinanceAPIException(429, 'Too many requests')
+
+        self.response = FakeResponse({'x-mbx-used-weight-1m': str(weight)})
+        return copy.deepcopy(result)
+
+    def _page(self, records, limit=None):
+        limits = [l for l in [limit, self.page_limit] if l != None]
+        return records[:min(limits)] if limits else records
+
+    def get_exchange_info(self):
+        return self._respond('get_exchange_info', self.data['exchange_info'])
+
+    def get_all_tickers(self):
+        return self._respond('get_all_tickers', self.data['tickers'])
+
+    def get_avg_price(self, symbol):
+        price = next((t['price'] for t in self.data['tickers'] if t['symbol'] == symbol), '0')
+        return self._respond('get_avg_price', {'mins': 5, 'price': price})
+
+    def get_account(self):
+        return self._respond('get_account', {'balances': self.data['balances']})
+
+    def get_my_trades(self, symbol, fromId=None, limit=500, startTime=None, endTime=None):
+        trades = sorted(self.data['trades'].get(symbol, []), key=lambda t: t['id'])
+        if fromId != None:
+            trades = [t for t in trades if t['id'] >= fromId]
+        else:
+            trades = [t for t in trades if inWindow(t['time'], startTime, endTime)][-limit:]
+        return self._respond('get_my_trades', self._page(trades, limit))
+
+    def get_deposit_history(self, startTime=None, endTime=None):
+        deposits = [d for d in self.data['deposits'] if inWindow(d['insertTime'], startTime, endTime)]
+        return self._respond('get_deposit_history', self._page(deposits))
+
+    def get_withdraw_history(self, startTime=None, endTime=None):
+        withdrawals = [w for w in self.data['withdrawals'] if inWindow(applyTimeToTimestamp(w['applyTime']), startTime, endTime)]
+        return self._respond('get_withdraw_history', self._page(withdrawals))
+
+    def get_fiat_deposit_withdraw_history(self, transactionType, beginTime=None, endTime=None):
+        fiat = [f for f in self.data['fiat'][str(transactionType)] if inWindow(f['createTime'], beginTime, endTime)]
+        fiat = self._page(fiat)
+        return self._respond('get_fiat_deposit_withdraw_history', {'total': len(fiat), 'data': fiat})
+
+    def get_dust_log(self, startTime=None, endTime=None):
+        dust = [d for d in self.data['dust'] if inWindow(d['operateTime'], startTime, endTime)]
+        dust = self._page(dust)
+        return self._respond('get_dust_log', {'total': len(dust), 'userAssetDribblets': dust})
+
+    def get_asset_dividend_history(self, startTime=None, endTime=None):
+        dividends = [d for d in self.data['dividends'] if inWindow(d['divTime'], startTime, endTime)]
+        dividends = self._page(dividends)
+        return self._respond('get_asset_dividend_history', {'total': len(dividends), 'rows': dividends})
+
+    def get_conversion_history(self, startTime=None, endTime=None):
+        conversions = [c for c in self.data['conversions'] if inWindow(c['createTime'], startTime, endTime)]
+        return self._respond('get_conversion_history', {'list': self._page(conversions)})
+
+
+class ReplayClient(FakeClient):
+
+    def __init__(self, fixture_path, **kwargs) -> None:
+        with open(fixture_path) as infile:
+            data = json.load(infile)
+        super().__init__(data, **kwargs)
+
+
+class RecordingClient(object):
+    ''' Proxies a live client and merges every response into a replayable fixture file '''
+
+    def __init__(self, client, fixture_path) -> None:
+        self._client = client
+        self.fixture_path = Path(fixture_path)
+        # Syncs call the client from several threads, merges and saves are serialized
+        self._lock = threading.Lock()
+        self.data = emptyDataset()
+        if self.fixture_path.exists():
+            with open(self.fixture_path) as infile:
+                self.data = json.load(infile)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def recorded(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            self._record(name, kwargs, result)
+            return result
+
+        return recorded
+
+    def _merge(self, records, new_records, key):
+        known = set(key(r) for r in records)
+        records.extend(r for r in new_records if key(r) not in known)
+
+    def _record(self, method, params, result):
+        with self._lock:
+            if self._merge_result(method, params, result):
+                self.save()
+
+    def _merge_result(self, method, params, result):
+        data = self.data
+        if method == 'get_exchange_info':
+            data['exchange_info'] = {'symbols': [{k: s[k] for k in ['symbol', 'baseAsset', 'quoteAsset']} for s in result['symbols']]}
+        elif method == 'get_all_tickers':
+            data['tickers'] = result
+        elif method == 'get_account':
+            data['balances'] = result['balances']
+        elif method == 'get_my_trades':
+            self._merge(data['trades'].setdefault(params['symbol'], []), result, lambda r: r['id'])
+        elif method == 'get_deposit_history':
+            self._merge(data['deposits'], result, lambda r: r['txId'])
+        elif method == 'get_withdraw_history':
+            self._merge(data['withdrawals'], result, lambda r: r['id'])
+        elif method == 'get_fiat_deposit_withdraw_history':
+            self._merge(data['fiat'][str(params['transactionType'])], result.get('data', []), lambda r: r['orderNo'])
+        elif method == 'get_dust_log':
+            self._merge(data['dust'], result.get('userAssetDribblets', []), lambda r: r['transId'])
+        elif method == 'get_asset_dividend_history':
+            self._merge(data['dividends'], result.get('rows', []), lambda r: (r['asset'], r['divTime']))
+        elif method == 'get_conversion_history':
+            self._merge(data['conversions'], result.get('list', []), lambda r: r['quoteId'])
+        else:
+            return False
+        return True
+
+    def save(self):
+        self.fixture_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomicWrite(self.fixture_path) as outfile:
+            json.dump(self.data, outfile)
+
+
+class SyntheticClient(FakeClient):
+    ''' Deterministic synthetic account with n_symbols coins traded against USDT and m_trades trades '''
+
+    def __init__(self, n_symbols=10, m_trades=1000, seed=0, start_date='2020-01-01 00:00:00', **kwargs) -> None:
+        super().__init__(self.generate(n_symbols, m_trades, seed, start_date), **kwargs)
+
+    @staticmethod
+    def generate(n_symbols, m_trades, seed, start_date):
+        rng = random.Random(seed)
+        data = emptyDataset()
+        start = applyTimeToTimestamp(start_date)
+        hour = 60 * 60 * 1000
+
+        coins = ['SYN{}'.format(i) for i in range(n_symbols)]
+        prices = {coin: rng.uniform(0.1, 1000.0) for coin in coins}
+        holdings = {coin: 0.0 for coin in coins}
+
+        for coin in coins:
+            data['exchange_info']['symbols'].append({'symbol': coin + 'USDT', 'baseAsset': coin, 'quoteAsset': 'USDT'})
+            data['trades'][coin + 'USDT'] = []
+
+        usdt = 1000.0 * m_trades
+        data['deposits'].append({'coin': 'USDT', 'amount': str(usdt), 'insertTime': start, 'network': 'TRX',
+                                 'address': 'synthetic', 'status': 1, 'txId': 'dep0'})
+
+        for i in range(m_trades):
+            coin = rng.choice(coins)
+            prices[coin] *= rng.uniform(0.98, 1.02)
+            qty = round(rng.uniform(0.01, 1.0), 6)
+            is_buyer = holdings[coin] < qty or rng.random() < 0.6
+            holdings[coin] += qty if is_buyer else -qty
+            usdt += -qty * prices[coin] if is_buyer else qty * prices[coin]
+
+            data['trades'][coin + 'USDT'].append({
+                'symbol': coin + 'USDT', 'id': i, 'orderId': i, 'price': str(prices[coin]), 'qty': str(qty),
+                'quoteQty': str(qty * prices[coin]), 'commission': str(qty * 0.001), 'commissionAsset': coin,
+                'time': start + (i + 1) * hour, 'isBuyer': is_buyer, 'isMaker': False, 'isBestMatch': True
+            })
+
+        data['tickers'] = [{'symbol': coin + 'USDT', 'price': str(prices[coin])} for coin in coins]
+        data['balances'] = [{'asset': coin, 'free': str(amount), 'locked': '0'} for coin, amount in holdings.items() if amount > 0]
+        data['balances'].append({'asset': 'USDT', 'free': str(usdt), 'locked': '0'})
+        return data
+
+
+class BenchmarkPortfolio(object):
+    ''' In-memory stand-in for the stored portfolio document Portfolio reads and saves '''
+
+    def __init__(self, currency='USDT') -> None:
+        self.portfolio_currency = currency
+        self.current_holdings = {}
+        self.portfolio_nav = 0.0
+        self.last_update_date = ''
+        self.current_assets = []
+        self.current_allocation = {}
+        self.exchanges = [BenchmarkExchangeSetup()]
+
+    def save(self):
+        return
+
+
+class BenchmarkExchangeSetup(object):
+
+    def __init__(self) -> None:
+        self.exchange_code = 'e0001'
+        self.exchange_pkey = 'fake'
+        self.exchange_skey = 'fake'
+
+
+def timeStreams(streams):
+    timings = {}
+    for name, stream in streams:
+        t0 = time.perf_counter()
+        result = stream()
+        timings[name] = time.perf_counter() - t0
+        records = '-' if result == None else len(result)
+        print('{:<24} {:>8} records {:>9.3f}s'.format(name, records, timings[name]))
+    return timings
+
+
+def benchmark(client, start_date='2017-01-01 00:00:00'):
+    '''
+    Time every Exchange download stream, a full loadAllDataFromExchange sync into a
+    temporary user directory and a Portfolio update against a fake client
+    '''
+    from exchange import Exchange
+    from portfolio import Portfolio
+    from rate_limiter import RateLimiter
+    from tools import createJsonDescriptors
+    from global_vars import USER_DATA_PATH
+    from update_user_data import loadAllDataFromExchange
+
+    end_date = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    work_dir = Path(tempfile.mkdtemp())
+    limiter = RateLimiter(capacity=10**9, state_path=work_dir / 'rate_limit.json')
+    exchange = Exchange('e0001', 'fake', 'fake', True, client=client, limiter=limiter)
+    assets = [s['baseAsset'] for s in client.data['exchange_info']['symbols']]
+
+    streams = [
+        ('holdings', lambda: exchange.getCurrentHoldings()),
+        ('prices', lambda: exchange.getCurrentPriceForAssets(assets, 'USDT')),
+        ('trades', lambda: exchange.getTrades(start_date, end_date, assets)),
+        ('deposits', lambda: exchange.getDeposits(start_date, end_date)),
+        ('withdrawals', lambda: exchange.getWithdrawals(start_date, end_date)),
+        ('fiat', lambda: exchange.getFiatTransactions(start_date, end_date)),
+        ('dust', lambda: exchange.getAccountDust(start_date, end_date)),
+        ('dividends', lambda: exchange.getAccountDividends(start_date, end_date)),
+        ('conversions', lambda: exchange.getAccountConversions(start_date, end_date)),
+        ('loadAllDataFromExchange', lambda: loadAllDataFromExchange('benchmark', exchange)),
+        ('Portfolio.update', lambda: Portfolio(BenchmarkPortfolio(), client=client, limiter=limiter).update()),
+    ]
+
+    # User tables live under the relative data/ directory, the sync writes into the temp one
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        user_dir = USER_DATA_PATH / 'benchmark' / 'historical_data'
+        user_dir.mkdir(parents=True)
+        createJsonDescriptors(user_dir)
+        timings = timeStreams(streams)
+    finally:
+        os.chdir(cwd)
+
+    print('{:<24} {:>26.3f}s'.format('total', sum(timings.values())))
+    return timings
+
+
+if __name__ == '__main__':
+    import sys
+    n_symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    m_trades = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    benchmark(SyntheticClient(n_symbols, m_trades))
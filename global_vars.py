@@ -4,6 +4,8 @@ BASECURR = 'USDT'
 USER_DATA_PATH = Path('data/user_data')
 MARKET_DATA_PATH = Path('data/market_data')
 SETUP_DIR = Path('data/app_setup.json')
+# 'csv' or 'sqlite', see storage.py
+STORAGE_BACKEND = 'csv'
 
 EXCHANGE_CODES = {
     'Binance': 'e0001',
@@ -44,4 +46,9 @@ BINANCE_KEY_MAP = {
     'fromAmount':             'amount_sold',
     'ratio':                  'price',
     'toAsset':                'asset'
-    }
\ No newline at end of file
+    }
+
+# Exchange code -> API key map used to re-key that exchange's responses
+KEY_MAPS = {
+    'e0001': BINANCE_KEY_MAP
+}
@@ -1,8 +1,14 @@
 
-from tools import dbRead, HistoricalDataPackage
+from tools import dbRead, getDBInfo, HistoricalDataPackage, epochMsToStrings
+from market_store import getMarketStore
+from global_vars import BASECURR
 
 from pathlib import Path
 
+# Column types handed to the reader so it does not have to infer them
+TRADE_DTYPES = {'symbol': str, 'price': 'float64', 'base': str, 'basePrice': 'float64', 'fee': 'float64', 'feeAsset': str,
+                'id': 'int64', 'feeAssetPrice': 'float64', 'asset': str, 'amount': 'float64', 'description': str, 'type': str}
+
 class HistoricalDataManager(object):
     ''' 
         Database accessor only - will not update data
@@ -12,39 +18,50 @@ class HistoricalDataManager(object):
         self.user_id = user_id
         self.base_currency = base_currency
         self.historical_data_dir = Path('data/user_data/' + self.user_id + '/historical_data/')
-        self.historical_market_data_dir = Path('data/market_data/')
 
     def getHistoricalHoldings(self, start_date, end_date, asset=None):
-        historical_holdings = dbRead(self.historical_data_dir / 'historical_holdings.csv', start_date, end_date, asset)
+        db = self.historical_data_dir / 'historical_holdings.csv'
+        headers = [] if asset == None else (asset if isinstance(asset, list) else [asset])
+        # Every column but time is an asset's holding
+        assets = headers or getDBInfo(db)['headers']
+        dtypes = {column: 'float64' for column in assets if column != 'time'}
+        historical_holdings = dbRead(db, start_date, end_date, headers=headers, dtypes=dtypes)
         
         return historical_holdings
     
     def getHistoricalMarketData(self, start_date, end_date, freq, asset=None):
+        ''' Closes in the reporting currency for the given assets at hourly, daily or weekly frequency '''
         
-        if freq == 'daily':
-            db_dir = self.historical_market_data_dir / 'daily_close.csv'
-        elif freq == 'hourly':
-            db_dir = self.historical_data_dir / 'hourly_close.csv'
-        else:
+        if freq not in ['hourly', 'daily', 'weekly']:
             print('ERROR: Market data frequency {} not supported!'.format(freq))
             return HistoricalDataPackage([], {}, [])
+
+        store = getMarketStore(freq)
+        assets = asset
+        if assets == None:
+            assets = [symbol[:-len(BASECURR)] for symbol in store.symbols() if symbol.endswith(BASECURR)]
+
+        symbols = {a: a + BASECURR for a in assets if a != BASECURR}
+        closes = store.readFrame(symbols.values(), start_date, end_date, column='close')
+        closes = closes.rename({v: k for k, v in symbols.items()}, axis=1)
+        if BASECURR in assets:
+            closes[BASECURR] = 1.0
         
-        historical_market_data = dbRead(db_dir, start_date, end_date, asset, fill_values=1)
+        if self.base_currency != BASECURR:
+            fx_symbol = self.base_currency + BASECURR
+            fx_translation = store.readFrame([fx_symbol], start_date, end_date, column='close')[fx_symbol]
+            closes = closes.div(fx_translation.reindex(closes.index).ffill(), axis=0)
         
-        if self.base_currency != 'USDT':
-            fx_translation = dbRead(self.historical_market_data_dir, start_date, end_date, asset=self.base_currency, fill_values=1)
-            historical_market_data = historical_market_data * fx_translation
+        closes = closes.ffill().fillna(1)
+        dates = epochMsToStrings(closes.index.values)
+        dates = dates if freq == 'hourly' else [date[:10] for date in dates]
         
-        return historical_market_data
+        return HistoricalDataPackage(dates, closes.to_dict('records'), list(closes.columns))
 
     def getHistoricalTrades(self, start_date, end_date, asset=None):
         db_dir = self.historical_data_dir / 'historical_trades.csv'
-        historical_trades = dbRead(db_dir, start_date, end_date)
-        
-        if asset != None:
-            for i,trade in enumerate(historical_trades.data[:]):
-                if trade['asset'] != asset:
-                    historical_trades.data.pop(i)
+        filters = [] if asset == None else [{'asset': asset}]
+        historical_trades = dbRead(db_dir, start_date, end_date, filters=filters, dtypes=TRADE_DTYPES)
 
         return historical_trades
 
@@ -0,0 +1,159 @@
+'''
+Declarative registry of the user history streams and the scheduler that syncs them.
+
+Each HistoryStream declares its table, the Exchange method that fetches it, the action
+class its records are parsed into and the table schema. The scheduler runs every
+(exchange, stream) pair concurrently and checkpoints each one as soon as it finishes:
+only rows whose natural key is new are written and only that exchange's entry in the
+stream's descriptor is updated, so other exchanges' watermarks are kept.
+'''
+
+import asyncio
+import datetime as dt
+import heapq
+
+from async_exchange import AsyncExchange
+from exchange_actions import *
+from global_vars import USER_DATA_PATH, EXCHANGE_CODES
+from tools import getDBInfo, updateDBInfo, upsertRowsToDB, compactDB, dbReadChunks
+
+FIRST_SYNC_DATE = '2017-01-01 00:00:00'
+
+
+class HistoryStream(object):
+
+    def __init__(self, name, fetcher, action_class, headers, key_columns, deferred_prices=False) -> None:
+        '''
+        key_columns: columns that (with the exchange code) identify a record, used to skip
+        records a previous or overlapping sync already stored
+        '''
+        self.name = name
+        self.fetcher = fetcher
+        self.action_class = action_class
+        self.headers = headers
+        self.key_columns = key_columns
+        self.deferred_prices = deferred_prices
+
+    def db(self, user):
+        return USER_DATA_PATH / (user + '/historical_data/' + self.name)
+
+    def descriptor(self):
+        return {'headers': self.headers}
+
+    def buildActions(self, records):
+        ''' Actions for stored records, prices are left for a batched enrichPrices pass '''
+        if self.deferred_prices:
+            return [self.action_class(record, re_key=False, resolve_prices=False) for record in records]
+        return [self.action_class(record, re_key=False) for record in records]
+
+    def iterActions(self, user, start_date, end_date, chunk_size=10000):
+        '''
+        Stored actions in [start_date, end_date], read, built and priced one chunk at a time.
+        Empty cells are read as None, so prices left unresolved when the rows were synced are
+        looked up again.
+        '''
+        for records in dbReadChunks(self.db(user), start_date, end_date, combine_dates=True, fill_values=None, chunk_size=chunk_size, epoch_times=True):
+            yield from enrichPrices(self.buildActions(records))
+
+    def newExchangeState(self):
+        return {'last_update_date': ''}
+
+    async def fetch(self, exchange, state, start_date, end_date):
+        return await getattr(exchange, self.fetcher)(start_date, end_date)
+
+    def checkpoint(self, state, records, end_date):
+        return {'last_update_date': end_date}
+
+
+class TradeHistoryStream(HistoryStream):
+    ''' Trades are paged per symbol from fromId cursors over the assets the account has held '''
+
+    def newExchangeState(self):
+        return {'last_update_date': '', 'assets_traded': [], 'trade_cursors': {}}
+
+    async def fetch(self, exchange, state, start_date, end_date):
+        assets_traded = state.setdefault('assets_traded', [])
+        # TODO(): User may have created an account but not traded which will force an update here and will take very long! must fix!
+        if state['last_update_date'] != '':
+            holdings = await exchange.getCurrentHoldings()
+            assets_traded.extend(asset for asset in holdings.keys() if asset not in assets_traded)
+
+        return await exchange.getTrades(start_date, end_date, assets_traded, state.setdefault('trade_cursors', {}))
+
+    def checkpoint(self, state, records, end_date):
+        assets_traded = state['assets_traded'] or list(set([trade['asset'] for trade in records]))
+        return {'last_update_date': end_date, 'assets_traded': assets_traded, 'trade_cursors': state['trade_cursors']}
+
+
+HISTORY_STREAMS = [
+    TradeHistoryStream('historical_trades', 'getTrades', TradeAction,
+                       ["time","symbol","price","base","basePrice","fee","feeAsset","id","feeAssetPrice",
+                        "asset","amount","description","type"], ['symbol', 'id'], deferred_prices=True),
+    HistoryStream('historical_deposits', 'getDeposits', DepositAction,
+                  ["time","network","address","status","id","asset","amount","description"], ['id']),
+    HistoryStream('historical_withdrawals', 'getWithdrawals', WithdrawlAction,
+                  ["time","network","address","status","fee","feeAsset","feeAssetPrice","id","asset",
+                   "amount","description"], ['id'], deferred_prices=True),
+    HistoryStream('historical_fiat_movements', 'getFiatTransactions', FiatDepositAction,
+                  ["time","fee","feeAsset","feeAssetPrice","id","asset","amount","description"], ['id']),
+    HistoryStream('historical_dust_activities', 'getAccountDust', DustSweepAction,
+                  ["time","fee","feeAsset","feeAssetPrice","transferedAmount","transferedAsset","id",
+                   "asset","amount","description"], ['id', 'asset'], deferred_prices=True),
+    HistoryStream('historical_dividends', 'getAccountDividends', DividendAction,
+                  ["time","asset","amount","description"], ['time', 'asset', 'amount']),
+    HistoryStream('historical_conversions', 'getAccountConversions', ConversionAction,
+                  ['time', 'price', 'asset', 'base', 'amount', 'description'], ['time', 'asset', 'base', 'amount']),
+]
+
+
+def iterUserActions(user, start_date, end_date, streams=HISTORY_STREAMS, chunk_size=10000):
+    '''
+    Lazy pipeline over a user's stored history: the time-sorted stream tables are merged in
+    time order and each action is followed by its derived fee and opposite-leg actions.
+    At most one chunk per stream is held in memory.
+    '''
+    merged = heapq.merge(*[stream.iterActions(user, start_date, end_date, chunk_size) for stream in streams],
+                         key=lambda action: action.time)
+    return withDerivedActions(merged)
+
+
+def writeCheckpoint(user, stream, exchange_code, state, records, end_date):
+    db = stream.db(user)
+
+    # Overlapping windows and re-runs hand back records we already have, only new keys are written
+    upsertRowsToDB(db, records, stream.headers, stream.key_columns, exchange_code)
+
+    db_info = getDBInfo(db)
+    db_info[exchange_code] = stream.checkpoint(state, records, end_date)
+    updateDBInfo(db, db_info)
+
+
+def compactUserHistory(user, streams=HISTORY_STREAMS):
+    ''' Dedupes a user's existing history tables and rebuilds their key indexes '''
+    for stream in streams:
+        db = stream.db(user)
+        exchange_codes = [code for code in getDBInfo(db).keys() if code in EXCHANGE_CODES.values()]
+        removed = compactDB(db, stream.headers, stream.key_columns, exchange_codes)
+        print('Compacted {} for user {}: {} duplicate rows removed'.format(stream.name, user, removed))
+
+
+async def syncStreams(user, exchanges, streams=HISTORY_STREAMS):
+    end_date = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    async_exchanges = {exchange.code: AsyncExchange(exchange) for exchange in exchanges}
+
+    async def syncOne(exchange, stream):
+        state = getDBInfo(stream.db(user)).get(exchange.code, stream.newExchangeState())
+        start_date = state['last_update_date'] or FIRST_SYNC_DATE
+        try:
+            records = await stream.fetch(async_exchanges[exchange.code], state, start_date, end_date)
+        except Exception as e:
+            print('ERROR {}: Syncing {} from {} for user {}'.format(e, stream.name, exchange.exchange_name, user))
+            return
+        writeCheckpoint(user, stream, exchange.code, state, records, end_date)
+
+    await asyncio.gather(*[syncOne(exchange, stream) for exchange in exchanges for stream in streams])
+
+
+def syncUserHistory(user, exchanges, streams=HISTORY_STREAMS):
+    asyncio.run(syncStreams(user, exchanges, streams))
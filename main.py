@@ -22,18 +22,12 @@ This will avoid us from having to load this information
 '''
 
 import datetime as dt
-from re import L
 import time
 from infrastructure.switchlang import switch
-from colorama import Fore
-from passlib.hash import pbkdf2_sha256
 
-import data.mongo_setup as mongo_setup
-import services.data_service as svc
-import infrastructure.state as state
-from update_user_data_new import loadAllDataFromExchange
-from portfolio import Portfolio
-from tools import printProgressBar
+# Portfolio pulls in the exchange clients and pandas, and the Mongo models, passlib and
+# colorama are only needed once a command runs, so they are imported by the commands that
+# need them to keep startup fast.
 
 def show_commands():
     print('What action would you like to take:')
@@ -62,14 +56,25 @@ def print_header():
     print()
 
 def config_mongo():
+    import data.mongo_setup as mongo_setup
     mongo_setup.global_init()
 
 def main():
+    from client_pool import closeClients
+
     print_header()
     config_mongo()
-    user_loop()
+    try:
+        user_loop()
+    finally:
+        # Pooled exchange sessions are closed however the loop ends (exit raises KeyboardInterrupt)
+        closeClients()
 
 def create_account():
+    from passlib.hash import pbkdf2_sha256
+    import services.data_service as svc
+    import infrastructure.state as state
+
     print('============= Register =============')
     username = input('Input your username: ')
     email = input('Input your email address: ').strip().lower()
@@ -85,6 +90,10 @@ def create_account():
     home_page()
 
 def login():
+    from passlib.hash import pbkdf2_sha256
+    import services.data_service as svc
+    import infrastructure.state as state
+
     print('============= Login =============')
     email = input('Enter your email address? ').strip().lower()
     password = input('Enter your password: ')
@@ -102,6 +111,9 @@ def login():
     home_page()
 
 def create_portfolio():
+    import services.data_service as svc
+    import infrastructure.state as state
+
     print('============= Create a Portfolio =============')
 
     if not state.active_user:
@@ -118,6 +130,9 @@ def create_portfolio():
     print('Successfully added Portfolio: {} to your account'.format(portfolio.portfolio_name))
 
 def edit_portfolio():
+    import services.data_service as svc
+    import infrastructure.state as state
+
     print('============= Edit a Portfolio =============')
 
     if not state.active_user:
@@ -149,6 +164,10 @@ def edit_portfolio():
         edit_portfolio()
 
 def update_user():
+    from portfolio import Portfolio
+    from tools import printProgressBar
+    import services.data_service as svc
+    import infrastructure.state as state
 
     if not state.active_user:
         print("You must login to continue")
@@ -166,6 +185,9 @@ def update_user():
     print('User data updated successfully!')
 
 def add_exchange():
+    import services.data_service as svc
+    import infrastructure.state as state
+
     print('============= Add Exchange =============')
     if not state.active_user:
         print("You must login to continue")
@@ -177,6 +199,9 @@ def add_exchange():
         setup_exchange(portfolio)
 
 def setup_exchange(portfolio):
+    import services.data_service as svc
+    import infrastructure.state as state
+
     if not state.active_user:
         print("You must login to add an exchange")
         return
@@ -193,6 +218,9 @@ def setup_exchange(portfolio):
     print("Successfully added: {} Exchange to your portfolio: {}!".format(exchange.exchange_name, portfolio.portfolio_name))
 
 def view_portfolios():
+    from portfolio import Portfolio
+    import services.data_service as svc
+    import infrastructure.state as state
 
     if not state.active_user:
         print("You must login to view your porfolios")
@@ -261,6 +289,7 @@ def user_loop():
             s.default(unknown_command)
 
 def home_page():
+    import infrastructure.state as state
     user = state.active_user
     print("Welcome {}!".format(user.user_name))
     show_commands()
@@ -269,6 +298,7 @@ def unknown_command():
     print("Sorry command not found.")
 
 def exit_app():
+    import infrastructure.state as state
     user = state.active_user
     print()
     if user:
@@ -277,6 +307,8 @@ def exit_app():
     raise KeyboardInterrupt()
 
 def get_action():
+    from colorama import Fore
+    import infrastructure.state as state
     text = '> '
     if state.active_user:
         text = '{}> '.format(state.active_user.user_name)
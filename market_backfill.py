@@ -0,0 +1,139 @@
+'''
+Concurrent OHLCV backfill engine.
+
+Symbols are paged concurrently on one event loop against an async ccxt-like exchange
+(anything exposing `async fetch_ohlcv(symbol, timeframe, since, limit)`). By default all
+requests draw from the machine-wide RateLimiter, the weight budget the user syncs draw
+from too. Each symbol pages forward independently from its own starting point and every
+page is handed to the sink as soon as it arrives (candle time as epoch ms). Pages of one
+symbol arrive in time order, so the sink can append to that symbol's partition and
+checkpoint its watermark page by page.
+'''
+
+import asyncio
+import time
+
+from tools import timestampToString
+from rate_limiter import getRateLimiter
+
+OHLCV_HEADERS = ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']
+TIMEFRAME_MS = {'1m': 60 * 1000, '1h': 60 * 60 * 1000, '1d': 24 * 60 * 60 * 1000}
+
+
+class RateBudget(object):
+    ''' In-process async token bucket, for backfills that should not draw from the shared limiter '''
+
+    def __init__(self, weight_per_minute=1200, burst=None) -> None:
+        self.rate = weight_per_minute / 60.0
+        self.capacity = burst if burst != None else weight_per_minute / 10.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, weight=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+
+class SharedRateBudget(object):
+    ''' Async view of a RateLimiter, its blocking acquire runs off the event loop '''
+
+    def __init__(self, limiter=None) -> None:
+        self.limiter = limiter if limiter != None else getRateLimiter()
+
+    async def acquire(self, weight=1):
+        await asyncio.to_thread(self.limiter.acquire, weight)
+
+
+class CannedExchange(object):
+    ''' Local fake exchange serving canned candles, used to exercise the engine offline '''
+
+    def __init__(self, candles, page_limit=1000, latency=0.0) -> None:
+        self.candles = {symbol: sorted(rows) for symbol, rows in candles.items()}
+        self.page_limit = page_limit
+        self.latency = latency
+        self.calls = 0
+
+    async def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        limit = min(limit or self.page_limit, self.page_limit)
+        rows = [list(row) for row in self.candles.get(symbol, []) if since == None or row[0] >= since]
+        return rows[:limit]
+
+    async def close(self):
+        return
+
+
+class BackfillEngine(object):
+
+    def __init__(self, exchange, budget=None, timeframe='1h', limit=1000, max_concurrency=16, request_weight=2, on_progress=None) -> None:
+        self.exchange = exchange
+        self.budget = budget if budget != None else SharedRateBudget()
+        self.timeframe = timeframe
+        self.step = TIMEFRAME_MS[timeframe]
+        self.limit = limit
+        self.request_weight = request_weight
+        self.on_progress = on_progress
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetchSymbol(self, symbol, since, until, sink):
+        ''' Page symbol forward from since until the exchange runs out of candles or until is reached '''
+        total = max(until - since, 1)
+        start = since
+        last_time = None
+
+        while since < until:
+            async with self._semaphore:
+                await self.budget.acquire(self.request_weight)
+                try:
+                    page = await self.exchange.fetch_ohlcv(symbol=symbol, timeframe=self.timeframe, since=since, limit=self.limit)
+                except Exception as e:
+                    print('ERROR {}: Fetching {} candles from {}'.format(e, symbol, timestampToString(since)))
+                    break
+
+            page = [row for row in page if row[0] >= since and row[0] < until] if page else []
+            if not page:
+                break
+
+            sink(symbol, [dict(zip(OHLCV_HEADERS, row + [symbol])) for row in page])
+            last_time = page[-1][0]
+            since = last_time + self.step
+
+            if self.on_progress:
+                self.on_progress(symbol, len(page), min(1.0, (since - start) / total))
+
+        return last_time
+
+    async def run(self, starts, until, sink):
+        '''
+        starts: dict of symbol -> int, epoch ms to start paging each symbol from
+        until: int - epoch ms
+        sink: callable(symbol, rows) receiving time sorted OHLCV row dicts (time in epoch ms), one call per page
+        
+        return dict of symbol -> last candle time fetched (None if nothing new)
+        '''
+        symbols = list(starts.keys())
+        last_times = await asyncio.gather(*[self.fetchSymbol(symbol, starts[symbol], until, sink) for symbol in symbols])
+        return dict(zip(symbols, last_times))
+
+
+def backfill(exchange, starts, until, sink, **kwargs):
+    ''' Blocking entry point around BackfillEngine.run, closes the exchange when done '''
+
+    async def _run():
+        engine = BackfillEngine(exchange, **kwargs)
+        try:
+            return await engine.run(starts, until, sink)
+        finally:
+            await exchange.close()
+
+    return asyncio.run(_run())
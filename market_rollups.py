@@ -0,0 +1,70 @@
+'''
+Daily and weekly OHLCV bars rolled up from the hourly store.
+
+Rollups are incremental: only hourly candles after the last rolled period are read, and a
+period is only written once it has closed (the current time is past its end and its last
+hourly candle is in the store), so bars are never rewritten.
+'''
+
+import time
+
+import numpy as np
+
+from market_store import getMarketStore, OHLCV_COLUMNS
+
+HOUR = 60 * 60 * 1000
+DAY = 24 * HOUR
+
+# frequency -> (period length, anchor) in epoch ms - weeks start on Monday 1970-01-05
+ROLLUPS = {
+    'daily': (DAY, 0),
+    'weekly': (7 * DAY, 4 * DAY)
+}
+
+
+def aggregateBars(hourly, period, anchor, now):
+    ''' OHLCV bars for every period covered by the hourly columns that had closed by now (epoch ms) '''
+    times = np.asarray(hourly['time'])
+    if len(times) == 0:
+        return None
+
+    buckets = (times - anchor) // period
+    last_closed = min((times[-1] + HOUR - anchor) // period, (now - anchor) // period) - 1
+    closed = buckets <= last_closed
+    if not closed.any():
+        return None
+
+    buckets = buckets[closed]
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    columns = {c: np.asarray(hourly[c])[closed] for c in OHLCV_COLUMNS[1:]}
+    return {
+        'time': buckets[starts] * period + anchor,
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends],
+        'volume': np.add.reduceat(columns['volume'], starts)
+    }
+
+
+def rollupSymbol(symbol, freq, now=None):
+    period, anchor = ROLLUPS[freq]
+    rolled = getMarketStore(freq)
+
+    last_period = rolled.lastTime(symbol)
+    start = None if last_period == None else last_period + period
+    hourly = getMarketStore('hourly').read(symbol, start=start, columns=OHLCV_COLUMNS)
+
+    now = int(time.time() * 1000) if now == None else now
+    bars = aggregateBars(hourly, period, anchor, now)
+    if bars == None:
+        return 0
+    return rolled.append(symbol, bars)
+
+
+def updateRollups(symbols, freqs=('daily', 'weekly'), now=None):
+    for freq in freqs:
+        for symbol in symbols:
+            rollupSymbol(symbol, freq, now)
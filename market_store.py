@@ -0,0 +1,150 @@
+'''
+Columnar market data store partitioned by symbol.
+
+    data/market_data/<freq>/<SYMBOL>/time.bin     int64 - candle open time, epoch ms (UTC)
+                                    /open.bin     float64
+                                    /high.bin     ...
+                                    /low.bin
+                                    /close.bin
+                                    /volume.bin
+
+Each column is a raw little-endian array that new candles are appended to, so a page
+costs writes proportional to its own size. time.bin is appended last and its length is
+the partition's row count: values past it (left by a crash mid-append) are ignored on
+read and truncated before the next append.
+
+Columns are memory-mapped on read and sliced with a binary search on the time column,
+so reading one symbol's closes never touches another symbol's partition. The hourly
+store is filled by updateMarketDB, the daily and weekly stores are rolled up from it
+(see market_rollups.py).
+'''
+
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from global_vars import MARKET_DATA_PATH
+from tools import toEpochMs
+
+OHLCV_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+COLUMN_TYPES = {'time': np.dtype('<i8'), 'open': np.dtype('<f8'), 'high': np.dtype('<f8'), 'low': np.dtype('<f8'),
+                'close': np.dtype('<f8'), 'volume': np.dtype('<f8')}
+
+
+class MarketStore(object):
+
+    def __init__(self, root=MARKET_DATA_PATH / 'hourly') -> None:
+        self.root = Path(root)
+
+    def partition(self, symbol):
+        return self.root / symbol
+
+    def columnPath(self, symbol, column):
+        return self.partition(symbol) / (column + '.bin')
+
+    def symbols(self):
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / 'time.bin').exists())
+
+    def version(self, symbol):
+        ''' Changes whenever the partition is appended to - used by readers to invalidate caches '''
+        try:
+            stat = os.stat(self.columnPath(symbol, 'time'))
+            return (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def length(self, symbol):
+        ''' Committed rows: complete values in the time column '''
+        try:
+            return os.path.getsize(self.columnPath(symbol, 'time')) // COLUMN_TYPES['time'].itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _load(self, symbol, column, length=None):
+        length = self.length(symbol) if length == None else length
+        if length == 0:
+            return np.empty(0, dtype=COLUMN_TYPES[column])
+        return np.memmap(self.columnPath(symbol, column), dtype=COLUMN_TYPES[column], mode='r', shape=(length,))
+
+    def lastTime(self, symbol):
+        times = self._load(symbol, 'time')
+        return int(times[-1]) if len(times) else None
+
+    def read(self, symbol, start=None, end=None, columns=['time', 'close']):
+        '''
+        Columns of one symbol for start <= time <= end (epoch ms or date strings)
+        return dict of column -> np.ndarray (memory-mapped views)
+        '''
+        length = self.length(symbol)
+        times = self._load(symbol, 'time', length)
+        lo = 0 if start == None else int(np.searchsorted(times, toEpochMs(start)[0], side='left'))
+        hi = len(times) if end == None else int(np.searchsorted(times, toEpochMs(end)[0], side='right'))
+        return {column: (times if column == 'time' else self._load(symbol, column, length))[lo:hi] for column in columns}
+
+    def readFrame(self, symbols, start=None, end=None, column='close'):
+        ''' One column for several symbols aligned on time - DataFrame indexed by epoch ms '''
+        series = {}
+        for symbol in symbols:
+            data = self.read(symbol, start, end, columns=['time', column])
+            series[symbol] = pd.Series(np.asarray(data[column]), index=np.asarray(data['time']))
+        return pd.DataFrame(series).sort_index()
+
+    def append(self, symbol, columns):
+        '''
+        Append candles to a symbol partition, dropping rows at or before its last stored time
+        columns: dict of column -> array-like, must contain every OHLCV column
+        '''
+        new = {c: np.asarray(columns[c], dtype=COLUMN_TYPES[c]) for c in OHLCV_COLUMNS}
+        order = np.argsort(new['time'], kind='stable')
+        new = {c: v[order] for c, v in new.items()}
+
+        last_time = self.lastTime(symbol)
+        if last_time != None:
+            keep = new['time'] > last_time
+            new = {c: v[keep] for c, v in new.items()}
+
+        if len(new['time']) == 0:
+            return 0
+
+        partition = self.partition(symbol)
+        partition.mkdir(parents=True, exist_ok=True)
+
+        # Values go first and are on disk before the time column commits the rows
+        length = self.length(symbol)
+        for column in OHLCV_COLUMNS[1:] + ['time']:
+            with open(self.columnPath(symbol, column), 'ab') as outfile:
+                outfile.truncate(length * COLUMN_TYPES[column].itemsize)
+                outfile.write(new[column].tobytes())
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+        return len(new['time'])
+
+    def appendRows(self, rows):
+        ''' Append OHLCV row dicts (time as epoch ms or date string) for any number of symbols '''
+        if not rows:
+            return 0
+        return self.appendFrame(pd.DataFrame(rows))
+
+    def appendFrame(self, data):
+        data = data.assign(time=toEpochMs(data['time'].values))
+        added = 0
+        for symbol, group in data.groupby('symbol', sort=False):
+            added += self.append(symbol, {c: group[c].values for c in OHLCV_COLUMNS})
+        return added
+
+    def importCSV(self, csv_path=MARKET_DATA_PATH / 'hourly_market_data.csv'):
+        ''' One-off migration of the legacy flat CSV store into symbol partitions '''
+        return self.appendFrame(pd.read_csv(csv_path))
+
+
+_STORES = {}
+
+def getMarketStore(freq='hourly'):
+    if freq not in _STORES:
+        _STORES[freq] = MarketStore(MARKET_DATA_PATH / freq)
+    return _STORES[freq]
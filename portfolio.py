@@ -1,10 +1,15 @@
 from historical_data_manager import HistoricalDataManager
+import asyncio
 import datetime as dt
+from async_exchange import AsyncExchange
 from exchange import Exchange
 
 class Portfolio(object):
 
-    def __init__(self, mongo_portfolio) -> None:
+    def __init__(self, mongo_portfolio, client=None, limiter=None) -> None:
+        '''
+        client, limiter: optional stand-ins given to every exchange (see fake_binance_client.py)
+        '''
         self.mongo = mongo_portfolio
         self.reporting_currency = mongo_portfolio.portfolio_currency
         self.current_holdings = mongo_portfolio.current_holdings
@@ -13,7 +18,7 @@ class Portfolio(object):
         self.current_assets = mongo_portfolio.current_assets 
         self.current_holdings = mongo_portfolio.current_holdings
         self.current_allocation = mongo_portfolio.current_allocation
-        self.exchanges = [Exchange.from_mongo(mongo_exchange) for mongo_exchange in mongo_portfolio.exchanges]
+        self.exchanges = [Exchange.from_mongo(mongo_exchange, client, limiter) for mongo_exchange in mongo_portfolio.exchanges]
         self.cost_basis = {}
         
         # self.historical_data_manager = HistoricalDataManager(self.user_id, self.reporting_currency)
@@ -29,9 +34,11 @@ class Portfolio(object):
     # Portfolio update functions
     def update(self):
         # self.updateCostBasis()
-        self.updateHoldings()
-        self.updateNAV()
-        self.updateAllocation()
+        holdings, prices = asyncio.run(self.fetchHoldingsAndPrices())
+        self.updateHoldings(holdings)
+        # NAV and allocation are valued from the same bulk price snapshot
+        self.updateNAV(prices)
+        self.updateAllocation(prices)
         self.last_update_date = dt.datetime.utcnow()
         self.save()
         return
@@ -44,10 +51,19 @@ class Portfolio(object):
         self.mongo.last_update_date   =  self.last_update_date
         self.mongo.save()
 
-    def updateHoldings(self):
+    async def fetchHoldingsAndPrices(self):
+        ''' Holdings of every exchange and the default exchange's price snapshot, fetched concurrently '''
+        pref_exchange = AsyncExchange(self.getDefaultExchange())
+        holdings_tasks = [AsyncExchange(exchange).getCurrentHoldings() for exchange in self.exchanges]
+        *holdings, prices = await asyncio.gather(*holdings_tasks, pref_exchange.getPriceSnapshot())
+        return holdings, prices
+
+    def updateHoldings(self, holdings_by_exchange=None):
+        if holdings_by_exchange == None:
+            holdings_by_exchange = [exchange.getCurrentHoldings() for exchange in self.exchanges]
+
         current_holdings = {}
-        for exchange in self.exchanges:
-            exchange_holdings = exchange.getCurrentHoldings()
+        for exchange_holdings in holdings_by_exchange:
             for asset, amount in exchange_holdings.items():
 
                 # Rename coins in Earn account to their actual names
@@ -62,20 +78,20 @@ class Portfolio(object):
         self.current_assets = list(current_holdings.keys())
         self.current_holdings = current_holdings
     
-    def updateNAV(self):
+    def updateNAV(self, snapshot=None):
         # TODO(ion): Need to change this - we need to find the valid base currency e.g. (USDT vs BUSD vs USDC) plus account
         # for different currencies other than USD
         pref_exchange = self.getDefaultExchange()
-        asset_prices = pref_exchange.getCurrentPriceForAssets(self.current_assets, self.reporting_currency)
+        asset_prices = pref_exchange.getCurrentPriceForAssets(self.current_assets, self.reporting_currency, snapshot)
         total = 0.0
         for asset in self.current_assets:
             total += (asset_prices[asset] * self.current_holdings[asset])
         
         self.portfolio_nav = total
     
-    def updateAllocation(self):
+    def updateAllocation(self, snapshot=None):
         pref_exchange = self.getDefaultExchange()
-        prices = pref_exchange.getCurrentPriceForAssets(self.current_assets, self.reporting_currency)
+        prices = pref_exchange.getCurrentPriceForAssets(self.current_assets, self.reporting_currency, snapshot)
         allocation = {a_name: (prices[a_name] * a_holding) / self.portfolio_nav for a_name, a_holding in self.current_holdings.items()}
         self.current_allocation = allocation
 
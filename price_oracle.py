@@ -0,0 +1,79 @@
+'''
+Process-wide price oracle for the hourly market data store.
+
+Close prices are loaded once per symbol from the columnar market store and kept in
+memory. Lookups are a binary search on the time axis followed by a linear interpolation
+between the two surrounding hourly closes. A symbol is reloaded when its partition
+changes on disk.
+'''
+
+import time as _time
+import threading
+
+import numpy as np
+
+from market_store import getMarketStore
+from tools import toEpochMs
+
+
+class PriceOracle(object):
+
+    def __init__(self, store=None, check_interval=1.0) -> None:
+        self.store = store if store != None else getMarketStore()
+        self.check_interval = check_interval
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _getSeries(self, symbol):
+        now = _time.monotonic()
+        cached = self._series.get(symbol, None)
+        if cached != None and now - cached[0] < self.check_interval:
+            return cached[2]
+
+        version = self.store.version(symbol)
+        if cached != None and cached[1] == version:
+            self._series[symbol] = (now, version, cached[2])
+            return cached[2]
+
+        with self._lock:
+            data = self.store.read(symbol, columns=['time', 'close'])
+            series = (np.array(data['time']), np.array(data['close']))
+            self._series[symbol] = (now, version, series)
+        return series
+
+    def refresh(self):
+        self._series = {}
+
+    def prices_at(self, symbols, times):
+        '''
+        Interpolated prices for paired sequences of symbols and times. NaN for unknown symbols
+        and for times outside the symbol's stored candles, which are never extrapolated.
+        '''
+        symbols = np.atleast_1d(np.asarray(symbols))
+        times = toEpochMs(times)
+        if len(times) == 1 and len(symbols) > 1:
+            times = np.repeat(times, len(symbols))
+
+        prices = np.full(len(symbols), np.nan)
+        unique_symbols, inverse = np.unique(symbols, return_inverse=True)
+
+        for i, symbol in enumerate(unique_symbols):
+            series_times, series_closes = self._getSeries(str(symbol))
+            if len(series_times) == 0:
+                continue
+            mask = (inverse == i) & (times >= series_times[0]) & (times <= series_times[-1])
+            prices[mask] = np.interp(times[mask], series_times, series_closes)
+
+        return prices
+
+    def price_at(self, symbol, time):
+        return float(self.prices_at([symbol], [time])[0])
+
+
+_ORACLE = None
+
+def getPriceOracle():
+    global _ORACLE
+    if _ORACLE is None:
+        _ORACLE = PriceOracle()
+    return _ORACLE
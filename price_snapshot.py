@@ -0,0 +1,57 @@
+'''
+Short lived snapshot of every spot price on the exchange.
+
+One bulk ticker request replaces a request per symbol. Snapshots are cached for a few
+seconds and shared by every portfolio updated in the same run, so NAV and allocation are
+always valued at the same prices.
+'''
+
+import threading
+import time
+
+SNAPSHOT_TTL = 30
+
+
+class PriceSnapshot(object):
+
+    def __init__(self, prices, taken_at=None) -> None:
+        self.prices = prices
+        self.taken_at = taken_at if taken_at != None else time.time()
+
+    @classmethod
+    def fromClient(cls, client):
+        return cls({ticker['symbol']: float(ticker['price']) for ticker in client.get_all_tickers()})
+
+    def isExpired(self, ttl=SNAPSHOT_TTL):
+        return time.time() - self.taken_at > ttl
+
+    def getPrice(self, symbol):
+        return self.prices.get(symbol, None)
+
+    def getPricesForAssets(self, assets, base_currency):
+        ''' Price of each asset in base_currency, stable coins are mapped to USDT '''
+        out_dict = {}
+        for asset in assets:
+            symbol = (asset if asset != 'BUSD' else 'USDT') + base_currency
+            if asset == base_currency:
+                continue
+            price = self.getPrice(symbol)
+            if price == None:
+                print('Warning symbol {} not valid - skipping!'.format(symbol))
+                continue
+            out_dict[asset] = price
+
+        out_dict.update({base_currency: 1.0})
+        return out_dict
+
+
+_SNAPSHOTS = {}
+_SNAPSHOT_LOCK = threading.Lock()
+
+def getPriceSnapshot(exchange_code, client, ttl=SNAPSHOT_TTL):
+    with _SNAPSHOT_LOCK:
+        snapshot = _SNAPSHOTS.get(exchange_code, None)
+        if snapshot == None or snapshot.isExpired(ttl):
+            snapshot = PriceSnapshot.fromClient(client)
+            _SNAPSHOTS[exchange_code] = snapshot
+        return snapshot
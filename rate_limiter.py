@@ -0,0 +1,150 @@
+'''
+Weight-aware token bucket shared by every Binance request on the machine.
+
+The bucket state lives in a small JSON file guarded by an advisory lock, so threads and
+worker processes draw from the same request-weight budget. After each call the bucket is
+corrected from the used-weight headers Binance returns, and a 418/429 response blocks
+every caller until its Retry-After has passed.
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RATE_LIMIT_STATE = Path('data/binance_rate_limit.json')
+WEIGHT_HEADERS = ['x-mbx-used-weight-1m', 'x-sapi-used-ip-weight-1m']
+MAX_RETRIES = 5
+DEFAULT_WEIGHT = 1
+
+# Request weight of each python-binance Client method, see the Binance API docs
+ENDPOINT_WEIGHTS = {
+    'get_my_trades':                    20,
+    'get_account':                      20,
+    'get_exchange_info':                20,
+    'get_all_tickers':                  4,
+    'get_symbol_ticker':                4,
+    'get_avg_price':                    2,
+    'get_deposit_history':              1,
+    'get_withdraw_history':             1,
+    'get_fiat_deposit_withdraw_history': 1,
+    'get_dust_log':                     1,
+    'get_asset_dividend_history':       10,
+    'get_conversion_history':           1,
+}
+
+
+class RateLimiter(object):
+
+    def __init__(self, capacity=1200, period=60.0, state_path=RATE_LIMIT_STATE) -> None:
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.state_path = Path(state_path)
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _state(self):
+        ''' Exclusive access to the shared bucket state, written back on exit '''
+        with self._thread_lock:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_path, 'a+') as state_file:
+                if fcntl:
+                    fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read())
+                    except ValueError:
+                        state = {'tokens': self.capacity, 'updated': time.time(), 'blocked_until': 0.0}
+
+                    now = time.time()
+                    state['tokens'] = min(self.capacity, state['tokens'] + (now - state['updated']) * self.rate)
+                    state['updated'] = now
+                    yield state
+
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(json.dumps(state))
+                    state_file.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def acquire(self, weight=DEFAULT_WEIGHT):
+        weight = min(weight, self.capacity)
+        while True:
+            with self._state() as state:
+                wait = state['blocked_until'] - state['updated']
+                if wait <= 0:
+                    if state['tokens'] >= weight:
+                        state['tokens'] -= weight
+                        return
+                    wait = (weight - state['tokens']) / self.rate
+            time.sleep(wait)
+
+    def observe(self, used_weight):
+        ''' Align the bucket with the weight the exchange reports as used in the current window '''
+        with self._state() as state:
+            state['tokens'] = min(state['tokens'], self.capacity - used_weight)
+
+    def block(self, seconds):
+        with self._state() as state:
+            state['blocked_until'] = max(state['blocked_until'], time.time() + seconds)
+            state['tokens'] = 0.0
+
+
+class RateLimitedClient(object):
+    ''' Drop-in proxy for binance.client.Client that routes every method call through a RateLimiter '''
+
+    def __init__(self, client, limiter=None) -> None:
+        self._client = client
+        self._limiter = limiter if limiter != None else getRateLimiter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        weight = ENDPOINT_WEIGHTS.get(name, DEFAULT_WEIGHT)
+
+        def limited(*args, **kwargs):
+            for attempt in range(MAX_RETRIES):
+                self._limiter.acquire(weight)
+                try:
+                    result = attr(*args, **kwargs)
+                except Exception as e:
+                    if getattr(e, 'status_code', None) in [418, 429]:
+                        headers = getattr(getattr(e, 'response', None), 'headers', {}) or {}
+                        self._limiter.block(int(headers.get('Retry-After', 60)))
+                        continue
+                    raise
+                self._observe()
+                return result
+            raise Exception('Binance rate limit still exceeded after {} retries of {}'.format(MAX_RETRIES, name))
+
+        return limited
+
+    def _observe(self):
+        response = getattr(self._client, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if not headers:
+            return
+        used = [int(headers[h]) for h in WEIGHT_HEADERS if headers.get(h, None) != None]
+        if used:
+            self._limiter.observe(max(used))
+
+
+_LIMITER = None
+
+def getRateLimiter():
+    global _LIMITER
+    if _LIMITER is None:
+        _LIMITER = RateLimiter(capacity=int(os.environ.get('BINANCE_WEIGHT_PER_MINUTE', 1200)))
+    return _LIMITER
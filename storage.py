@@ -0,0 +1,514 @@
+'''
+Pluggable storage behind dbRead / dbReadChunks / addRowsToDB / dumpToDB / upsertRowsToDB /
+getDBInfo / updateDBInfo.
+
+A table is addressed by its path without suffix (e.g. data/user_data/<user>/historical_data/
+historical_trades) and every backend implements the same methods:
+
+    CSVStorage    - <table>.csv with a <table>.json descriptor, a <table>.offsets.json day
+                    index for range reads and a <table>.keys.npy natural key index
+    SQLiteStorage - every table of a directory in one <directory>/storage.sqlite (WAL mode),
+                    indexed on (time), (asset, time) and (symbol, time), natural key hashes in
+                    a <table>_keys table and descriptors in its descriptors table
+
+Whole-file CSV writes go through a temp file and a rename, appends hold the table's
+advisory lock; SQLite relies on its own transactions.
+
+The backend is picked by STORAGE_BACKEND in global_vars (or the STORAGE_BACKEND environment
+variable). copyTable moves a table between backends, so the CSV files remain available as
+an export format.
+'''
+
+import bisect
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from global_vars import STORAGE_BACKEND
+from tools import HistoricalDataPackage, toEpochMs, fileLock, atomicWrite
+
+_STORAGES = {}
+
+
+def rowKeys(rows, key_columns, exchange_code):
+    '''
+    64 bit hashes of each row's natural key: the exchange code plus the key columns, taken as
+    the text the csv writer stores so rows hash the same before and after a round trip
+    '''
+    keys = []
+    for row in rows:
+        key = '\x1f'.join([exchange_code] + ['' if row.get(column, None) == None else str(row[column]) for column in key_columns])
+        keys.append(int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little'))
+    return np.array(keys, dtype=np.uint64)
+
+def newKeys(keys, index):
+    ''' Mask of keys that are neither in index nor repeated earlier in keys '''
+    _, first = np.unique(keys, return_index=True)
+    is_new = np.zeros(len(keys), dtype=bool)
+    is_new[first] = True
+    return is_new & ~np.isin(keys, index)
+
+
+class CSVStorage(object):
+
+    def getInfo(self, db):
+        db = Path(db).with_suffix('.json')
+        with open(db) as infile:
+            info = json.load(infile)
+        return info
+
+    def updateInfo(self, db, out_dict):
+        db = Path(db).with_suffix('.json')
+        with atomicWrite(db) as outfile:
+            json.dump(out_dict, outfile, indent=4)
+
+    def header(self, db):
+        csv_path = Path(db).with_suffix('.csv')
+        if not csv_path.exists():
+            return []
+        with open(csv_path, newline='') as infile:
+            return next(csv.reader(infile), [])
+
+    def scan(self, db_name, start_date, end_date, columns=None, filters=[], dtypes={}, chunk_size=50000):
+        '''
+        Yields time indexed DataFrame chunks holding only the rows in [start_date, end_date] that
+        match every equality filter. Only the time column, columns and the filter columns are
+        parsed (columns=None parses all), with dtypes given up front instead of inferred, and each
+        chunk is filtered as soon as it is parsed.
+        '''
+        directory = Path(db_name).with_suffix('.csv')
+        if not directory.exists():
+            return
+
+        offsets = self.timeRangeOffsets(db_name, start_date, end_date)
+        if offsets != None and offsets[1] == offsets[2]:
+            return
+
+        with open(directory, 'rb') as infile:
+            header_line = infile.readline()
+            names = next(csv.reader([header_line.decode()]), [])
+            if not names or (offsets == None and infile.peek(1) == b''):
+                return
+            if offsets != None:
+                infile.seek(offsets[1])
+
+            time_column = names[0]
+            wanted = None if columns == None else set(columns) | set(column for filt in filters for column in filt)
+            usecols = None if wanted == None else [time_column] + [name for name in names[1:] if name in wanted]
+            dtype = {name: column_type for name, column_type in dtypes.items() if usecols == None or name in usecols}
+            dtype[time_column] = str
+
+            reader = pd.read_csv(infile, header=None, names=names, usecols=usecols, dtype=dtype,
+                                 index_col=time_column, chunksize=chunk_size)
+            for data in reader:
+                past_end = offsets != None and data.index[-1] > end_date
+                # A sorted chunk wholly inside the range needs no per-row time comparison
+                if offsets != None and data.index[0] >= start_date and not past_end:
+                    mask = np.ones(len(data), dtype=bool)
+                else:
+                    mask = (data.index >= start_date) & (data.index <= end_date)
+                for filt in filters:
+                    for column, value in filt.items():
+                        mask &= (data[column] == value).values
+                data = data[mask]
+                if not data.empty:
+                    yield data
+                # An indexed table is sorted, nothing after this chunk is in range
+                if past_end:
+                    break
+
+    def read(self, db_name, start_date, end_date, combine_dates=False, headers=[], fill_values=0, filters=[], dtypes={}):
+        chunks = list(self.scan(db_name, start_date, end_date, headers or None, filters, dtypes))
+        if chunks:
+            data = pd.concat(chunks)
+        else:
+            names = self.header(db_name)
+            data = pd.DataFrame(columns=names[1:], index=pd.Index([], name=names[0] if names else None))
+
+        if headers:
+            data = data.reindex(headers, axis=1)
+
+        data = data.fillna(fill_values)
+
+        if combine_dates:
+            data.insert(0, 'time', data.index)
+
+        assets = list(data.columns)
+        out_data = data.to_dict('records')
+
+        data_packet = HistoricalDataPackage(list(data.index), out_data, assets)
+        return data_packet
+
+    def readChunks(self, db_name, start_date, end_date, combine_dates=False, fill_values=0, chunk_size=10000, epoch_times=False):
+        for data in self.scan(db_name, start_date, end_date, chunk_size=chunk_size):
+            data = data.astype(object).where(data.notna(), None) if fill_values is None else data.fillna(fill_values)
+            if combine_dates:
+                data.insert(0, 'time', toEpochMs(data.index.values) if epoch_times else data.index)
+            yield data.to_dict('records')
+
+    def loadOffsetIndex(self, db):
+        index_path = Path(db).with_suffix('.offsets.json')
+        if not index_path.exists():
+            return None
+        with open(index_path) as infile:
+            return json.load(infile)
+
+    def saveOffsetIndex(self, db, index):
+        index_path = Path(db).with_suffix('.offsets.json')
+        tmp_path = Path(db).with_suffix('.offsets.tmp')
+        with open(tmp_path, 'w') as outfile:
+            json.dump(index, outfile)
+        os.replace(tmp_path, index_path)
+
+    def scanOffsets(self, csv_path, index):
+        '''
+        Extends a table's offset index with the rows written after index['size']: the byte offset of
+        the first row of every day, and whether the rows are still in time order
+        '''
+        with open(csv_path, 'rb') as infile:
+            if index['header_end'] == 0:
+                index['header_end'] = index['size'] = len(infile.readline())
+            infile.seek(index['size'])
+            position = index['size']
+            buckets = index['buckets']
+            for line in infile:
+                time = line.split(b',', 1)[0].decode()
+                if time < index['last_time']:
+                    index['sorted'] = False
+                if not buckets or time[:10] > buckets[-1][0]:
+                    buckets.append([time[:10], position])
+                index['last_time'] = max(index['last_time'], time)
+                position += len(line)
+        index['size'] = position
+        return index
+
+    def rebuildOffsetIndex(self, db):
+        index = {'header_end': 0, 'size': 0, 'last_time': '', 'sorted': True, 'buckets': []}
+        self.saveOffsetIndex(db, self.scanOffsets(Path(db).with_suffix('.csv'), index))
+
+    def timeRangeOffsets(self, db, start_date, end_date):
+        '''
+        (header end, first byte, end byte) of the rows between start_date and end_date (day
+        granularity) from the table's offset index, None when the index is missing, stale or the
+        table is out of time order
+        '''
+        index = self.loadOffsetIndex(db)
+        csv_path = Path(db).with_suffix('.csv')
+        if index == None or not index['sorted'] or not csv_path.exists() or index['size'] != os.path.getsize(csv_path):
+            return None
+
+        days = [day for day, _ in index['buckets']]
+        first = bisect.bisect_left(days, start_date[:10])
+        last = bisect.bisect_right(days, end_date[:10])
+        start = index['buckets'][first][1] if first < len(days) else index['size']
+        end = index['buckets'][last][1] if last < len(days) else index['size']
+        return index['header_end'], start, max(start, end)
+
+    def append(self, db, rows, headers):
+        db = Path(db).with_suffix('.csv')
+        rows = sorted(rows, key=lambda d: d['time'])
+        # Appends and their index update are serialized on the table lock
+        with fileLock(db):
+            index = self.loadOffsetIndex(db)
+            previous_size = os.path.getsize(db) if db.exists() else 0
+            with open(db, 'a', newline='') as output_file:
+                dict_writer = csv.DictWriter(output_file, headers)
+                dict_writer.writerows(rows)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+
+            # Only the appended bytes are scanned unless the index no longer matches the file
+            if index != None and index['size'] == previous_size:
+                self.saveOffsetIndex(db, self.scanOffsets(db, index))
+            else:
+                self.rebuildOffsetIndex(db)
+
+    def dump(self, db, data, headers):
+        db = Path(db).with_suffix('.csv')
+        data = sorted(data, key=lambda d: d['time'])
+        with fileLock(db):
+            with atomicWrite(db, newline='') as output_file:
+                dict_writer = csv.DictWriter(output_file, headers)
+                dict_writer.writeheader()
+                dict_writer.writerows(data)
+            self.rebuildOffsetIndex(db)
+
+        print('Dumped data to db {}!'.format(db))
+
+    def loadKeyIndex(self, db):
+        index_path = Path(db).with_suffix('.keys.npy')
+        if not index_path.exists():
+            return np.empty(0, dtype=np.uint64)
+        return np.load(index_path)
+
+    def saveKeyIndex(self, db, index):
+        index_path = Path(db).with_suffix('.keys.npy')
+        tmp_path = Path(db).with_suffix('.keys.tmp.npy')
+        np.save(tmp_path, index)
+        os.replace(tmp_path, index_path)
+
+    def upsert(self, db, rows, headers, key_columns, exchange_code):
+        '''
+        Rows whose natural key is already in the table's persistent key index (<db>.keys.npy,
+        sorted uint64 hashes) are dropped without reading the table, the rest are written and
+        added to the index. History records never change once made, so an existing key is
+        simply kept. Returns the rows that were written.
+        '''
+        csv_path = Path(db).with_suffix('.csv')
+        keys = rowKeys(rows, key_columns, exchange_code)
+
+        # The key check, the write and the index update happen under one table lock
+        with fileLock(csv_path):
+            is_empty = not csv_path.exists() or os.path.getsize(csv_path) == 0
+            index = np.empty(0, dtype=np.uint64) if is_empty else self.loadKeyIndex(db)
+
+            is_new = newKeys(keys, index)
+            new_rows = [row for row, new in zip(rows, is_new) if new]
+
+            if is_empty:
+                self.dump(db, new_rows, headers)
+            elif new_rows:
+                self.append(db, new_rows, headers)
+
+            self.saveKeyIndex(db, np.union1d(index, keys[is_new]))
+        return new_rows
+
+    def compact(self, db, headers, key_columns, exchange_codes):
+        '''
+        Drops duplicate rows (same key columns) from an existing table, rewrites it sorted by time
+        and rebuilds its key index. Rows do not record their exchange so their keys are registered
+        for every exchange in exchange_codes. Returns the number of rows removed.
+        '''
+        csv_path = Path(db).with_suffix('.csv')
+        if not csv_path.exists() or os.path.getsize(csv_path) == 0:
+            return 0
+
+        with fileLock(csv_path):
+            data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+            compacted = data.drop_duplicates(subset=key_columns)
+            rows = compacted.to_dict('records')
+            self.dump(db, rows, headers)
+
+            index = np.unique(np.concatenate([rowKeys(rows, key_columns, code) for code in exchange_codes] + [np.empty(0, dtype=np.uint64)]))
+            self.saveKeyIndex(db, index)
+        return len(data) - len(compacted)
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteStorage(object):
+
+    def __init__(self, file_name='storage.sqlite') -> None:
+        self.file_name = file_name
+        self.connections = {}
+        # One connection per database file is shared by the sync threads, statements are serialized
+        self.lock = threading.RLock()
+
+    def databasePath(self, db):
+        # Absolute, so a connection opened before a chdir is never reused for another directory
+        return Path(os.path.abspath(Path(db).parent / self.file_name))
+
+    def connect(self, db):
+        ''' (connection, table name) for a table path '''
+        path = self.databasePath(db)
+        connection = self.connections.get(path, None)
+        if connection == None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Other processes (market job, other users' syncs) may hold the write lock, wait for it
+            connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS descriptors (name TEXT PRIMARY KEY, info TEXT NOT NULL)')
+            self.connections[path] = connection
+        return connection, Path(db).with_suffix('').name
+
+    def columns(self, connection, table):
+        return [row[1] for row in connection.execute('PRAGMA table_info({})'.format(quote(table)))]
+
+    def keyTable(self, table):
+        return quote(table + '_keys')
+
+    def ensureTable(self, connection, table, headers):
+        existing = self.columns(connection, table)
+        if not existing:
+            columns = ', '.join(quote(h) + (' TEXT' if h == 'time' else '') for h in headers)
+            connection.execute('CREATE TABLE {} ({})'.format(quote(table), columns))
+            # Natural key hashes of the stored rows, one per (row, exchange) like the CSV key index
+            connection.execute('CREATE TABLE IF NOT EXISTS {} (key INTEGER PRIMARY KEY)'.format(self.keyTable(table)))
+            connection.execute('CREATE INDEX {} ON {} (time)'.format(quote(table + '_time'), quote(table)))
+            for column in ['asset', 'symbol']:
+                if column in headers:
+                    connection.execute('CREATE INDEX {} ON {} ({}, time)'.format(quote(table + '_' + column + '_time'), quote(table), quote(column)))
+        else:
+            for header in headers:
+                if header not in existing:
+                    connection.execute('ALTER TABLE {} ADD COLUMN {}'.format(quote(table), quote(header)))
+
+    def insert(self, connection, table, rows, headers):
+        statement = 'INSERT INTO {} ({}) VALUES ({})'.format(quote(table), ', '.join(quote(c) for c in headers), ', '.join('?' * len(headers)))
+        connection.executemany(statement, [tuple(row.get(h, None) for h in headers) for row in rows])
+
+    def insertKeys(self, connection, table, keys):
+        connection.executemany('INSERT OR IGNORE INTO {} (key) VALUES (?)'.format(self.keyTable(table)), [(int(key),) for key in keys])
+
+    def getInfo(self, db):
+        with self.lock:
+            connection, table = self.connect(db)
+            row = connection.execute('SELECT info FROM descriptors WHERE name = ?', (table,)).fetchone()
+        if row == None:
+            raise FileNotFoundError('No descriptor for table {}'.format(table))
+        return json.loads(row[0])
+
+    def updateInfo(self, db, out_dict):
+        with self.lock:
+            connection, table = self.connect(db)
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO descriptors (name, info) VALUES (?, ?)', (table, json.dumps(out_dict)))
+
+    def query(self, table, start_date, end_date, filters=[], columns=None):
+        '''
+        Range (and equality filter) select of the time column plus columns (None for all),
+        answered from the time / (asset, time) / (symbol, time) indexes
+        '''
+        conditions, params = ['time >= ?', 'time <= ?'], [start_date, end_date]
+        for filt in filters:
+            for column, value in filt.items():
+                conditions.append('{} = ?'.format(quote(column)))
+                params.append(value)
+        selected = '*' if columns == None else ', '.join(['time'] + [quote(c) for c in columns])
+        statement = 'SELECT {} FROM {} WHERE {} ORDER BY time'.format(selected, quote(table), ' AND '.join(conditions))
+        return statement, params
+
+    def read(self, db_name, start_date, end_date, combine_dates=False, headers=[], fill_values=0, filters=[], dtypes={}):
+        with self.lock:
+            connection, table = self.connect(db_name)
+            existing = self.columns(connection, table)
+            if existing:
+                columns = [h for h in headers if h in existing and h != 'time'] if headers else None
+                statement, params = self.query(table, start_date, end_date, filters, columns)
+                data = pd.read_sql_query(statement, connection, params=params, index_col='time')
+            else:
+                # A table nobody has written yet reads as empty, as a missing CSV does
+                data = pd.DataFrame(index=pd.Index([], name='time'))
+
+        data = data.astype({column: column_type for column, column_type in dtypes.items() if column in data.columns})
+
+        if headers:
+            data = data.reindex(headers, axis=1)
+
+        data = data.fillna(fill_values)
+
+        if combine_dates:
+            data.insert(0, 'time', data.index)
+
+        return HistoricalDataPackage(list(data.index), data.to_dict('records'), list(data.columns))
+
+    def readChunks(self, db_name, start_date, end_date, combine_dates=False, fill_values=0, chunk_size=10000, epoch_times=False):
+        with self.lock:
+            connection, table = self.connect(db_name)
+            if not self.columns(connection, table):
+                return
+
+        # A separate connection streams the rows, WAL lets it read while the shared one writes
+        reader = sqlite3.connect(self.databasePath(db_name), timeout=30)
+        try:
+            statement, params = self.query(table, start_date, end_date)
+            for data in pd.read_sql_query(statement, reader, params=params, index_col='time', chunksize=chunk_size):
+                if data.empty:
+                    continue
+                data = data.astype(object).where(data.notna(), None) if fill_values is None else data.fillna(fill_values)
+                if combine_dates:
+                    data.insert(0, 'time', toEpochMs(data.index.values) if epoch_times else data.index)
+                yield data.to_dict('records')
+        finally:
+            reader.close()
+
+    def append(self, db, rows, headers):
+        with self.lock:
+            connection, table = self.connect(db)
+            with connection:
+                self.ensureTable(connection, table, headers)
+                self.insert(connection, table, rows, headers)
+
+    def dump(self, db, data, headers):
+        with self.lock:
+            connection, table = self.connect(db)
+            with connection:
+                connection.execute('DROP TABLE IF EXISTS {}'.format(quote(table)))
+                connection.execute('DROP TABLE IF EXISTS {}'.format(self.keyTable(table)))
+                self.ensureTable(connection, table, headers)
+                self.insert(connection, table, sorted(data, key=lambda d: d['time']), headers)
+
+        print('Dumped data to db {}!'.format(table))
+
+    def upsert(self, db, rows, headers, key_columns, exchange_code):
+        ''' Rows whose natural key hash is already in the table's <table>_keys table are skipped '''
+        keys = rowKeys(rows, key_columns, exchange_code).astype(np.int64)
+        with self.lock:
+            connection, table = self.connect(db)
+            with connection:
+                self.ensureTable(connection, table, headers)
+                existing = []
+                for i in range(0, len(keys), 500):
+                    batch = [int(key) for key in keys[i:i + 500]]
+                    existing.extend(row[0] for row in connection.execute(
+                        'SELECT key FROM {} WHERE key IN ({})'.format(self.keyTable(table), ', '.join('?' * len(batch))), batch))
+
+                is_new = newKeys(keys, np.array(existing, dtype=np.int64))
+                new_rows = [row for row, new in zip(rows, is_new) if new]
+                self.insert(connection, table, new_rows, headers)
+                self.insertKeys(connection, table, keys[is_new])
+        return new_rows
+
+    def compact(self, db, headers, key_columns, exchange_codes):
+        '''
+        Drops duplicate rows (same key columns) keeping the first stored and rebuilds the key table.
+        Rows do not record their exchange so their keys are registered for every exchange in
+        exchange_codes. Returns the number of rows removed.
+        '''
+        with self.lock:
+            connection, table = self.connect(db)
+            if not self.columns(connection, table):
+                return 0
+            with connection:
+                removed = connection.execute('DELETE FROM {0} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {0} GROUP BY {1})'.format(
+                    quote(table), ', '.join(quote(c) for c in key_columns))).rowcount
+
+                stored = connection.execute('SELECT {} FROM {}'.format(', '.join(quote(c) for c in key_columns), quote(table))).fetchall()
+                rows = [dict(zip(key_columns, row)) for row in stored]
+                connection.execute('CREATE TABLE IF NOT EXISTS {} (key INTEGER PRIMARY KEY)'.format(self.keyTable(table)))
+                connection.execute('DELETE FROM {}'.format(self.keyTable(table)))
+                for code in exchange_codes:
+                    self.insertKeys(connection, table, rowKeys(rows, key_columns, code).astype(np.int64))
+        return removed
+
+
+def copyTable(db, source, target, chunk_size=10000):
+    ''' Copies a table and its descriptor between backends, e.g. CSV -> SQLite to migrate or back to export '''
+    info = source.getInfo(db)
+    headers = info['headers']
+    target.dump(db, [], headers)
+    for rows in source.readChunks(db, '', '9999', combine_dates=True, fill_values=None, chunk_size=chunk_size):
+        target.append(db, rows, headers)
+    target.updateInfo(db, info)
+
+
+def getStorage(backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', STORAGE_BACKEND)
+    if backend not in _STORAGES:
+        if backend == 'csv':
+            _STORAGES[backend] = CSVStorage()
+        elif backend == 'sqlite':
+            _STORAGES[backend] = SQLiteStorage()
+        else:
+            raise Exception('Unknown storage backend {}'.format(backend))
+    return _STORAGES[backend]
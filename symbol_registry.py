@@ -0,0 +1,117 @@
+'''
+Process-wide registry of the symbols traded on Binance.
+
+Built once from the exchange info endpoint and persisted to disk so new processes only hit
+the API when the cached copy is older than its TTL. Every Exchange in the process shares
+the same registry.
+'''
+
+import json
+import threading
+import time
+
+from global_vars import MARKET_DATA_PATH
+from tools import atomicWrite
+
+REGISTRY_PATH = MARKET_DATA_PATH / 'binance_symbols.json'
+REGISTRY_TTL = 24 * 60 * 60
+
+
+class BinanceSymbol():
+    def __init__(self, symbol, q_curr, b_curr):
+        self.symbol = symbol
+        self.q_curr = q_curr
+        self.b_curr = b_curr
+        pass
+    
+    @classmethod
+    def fromSymbol(cls, symbol, base_coins):
+        ob = cls.__new__(cls)
+        ob.symbol = symbol
+
+        for base in base_coins:
+            symbol_split = symbol.split(base)
+            if len(symbol_split) > 1 and symbol_split[0] != '':
+                ob.b_curr = base
+                ob.q_curr = symbol_split[0]
+
+        return ob
+
+
+class SymbolRegistry(object):
+
+    def __init__(self, symbols, updated=None) -> None:
+        '''
+        symbols: list of dicts with symbol, baseAsset and quoteAsset as returned by exchange info
+        '''
+        self.raw_symbols = symbols
+        self.updated = updated if updated != None else time.time()
+        self.by_symbol = {}
+        self.by_pair = {}
+        self.pairs_by_asset = {}
+
+        for s in symbols:
+            symbol = BinanceSymbol(s['symbol'], s['baseAsset'], s['quoteAsset'])
+            self.by_symbol[symbol.symbol] = symbol
+            self.by_pair[(symbol.q_curr, symbol.b_curr)] = symbol
+            self.pairs_by_asset.setdefault(symbol.q_curr, []).append(symbol)
+
+    @classmethod
+    def fromClient(cls, client):
+        symbols = [{k: s[k] for k in ['symbol', 'baseAsset', 'quoteAsset']} for s in client.get_exchange_info()['symbols']]
+        return cls(symbols)
+
+    @classmethod
+    def fromFile(cls, path=REGISTRY_PATH):
+        with open(path) as infile:
+            data = json.load(infile)
+        return cls(data['symbols'], data['updated'])
+
+    def save(self, path=REGISTRY_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Other processes load the cache on startup, they must never see a half written file
+        with atomicWrite(path) as outfile:
+            json.dump({'updated': self.updated, 'symbols': self.raw_symbols}, outfile)
+
+    def isExpired(self, ttl=REGISTRY_TTL):
+        return time.time() - self.updated > ttl
+
+    def isValid(self, symbol):
+        return symbol in self.by_symbol
+
+    def getSymbol(self, symbol):
+        return self.by_symbol.get(symbol, None)
+
+    def getPair(self, q_curr, b_curr):
+        return self.by_pair.get((q_curr, b_curr), None)
+
+    def getPairsForAsset(self, asset):
+        ''' Every tradable symbol where asset is the traded (quote) coin '''
+        return self.pairs_by_asset.get(asset, [])
+
+    def allSymbols(self):
+        return list(self.by_symbol.values())
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+def getSymbolRegistry(client, ttl=REGISTRY_TTL):
+    ''' Shared registry - in memory first, then the on disk copy, then the exchange '''
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY != None and not _REGISTRY.isExpired(ttl):
+            return _REGISTRY
+
+        if REGISTRY_PATH.exists():
+            try:
+                registry = SymbolRegistry.fromFile()
+                if not registry.isExpired(ttl):
+                    _REGISTRY = registry
+                    return _REGISTRY
+            except (OSError, ValueError, KeyError) as e:
+                print('ERROR {}: Reading symbol registry {}'.format(e, REGISTRY_PATH))
+
+        _REGISTRY = SymbolRegistry.fromClient(client)
+        _REGISTRY.save()
+        return _REGISTRY
@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    ''' Runs the test from an empty directory, so the relative data/ paths land in tmp_path '''
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
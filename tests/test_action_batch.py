@@ -0,0 +1,54 @@
+import numpy as np
+
+from action_batch import ActionBatch, DailyMovements
+from exchange_actions import ExchangeAccountAction, TradeAction
+
+DAY = 24 * 60 * 60 * 1000
+
+
+def trade(time, asset, amount, price=2.0):
+    return TradeAction({'time': time, 'asset': asset, 'symbol': asset + 'USDT', 'amount': abs(amount), 'price': price, 'isBuyer': amount > 0,
+                        'fee': 0.1, 'feeAsset': 'BNB', 'id': time}, re_key=False, resolve_prices=False)
+
+
+def test_from_actions_builds_columns():
+    actions = [trade(0, 'BTC', 1.0), ExchangeAccountAction('USDT', -2.0, 5, 'trading activity'), trade(DAY, 'ETH', 3.0)]
+    batch = ActionBatch.fromActions(actions)
+
+    assert len(batch) == 3
+    assert list(batch.time) == [0, 5, DAY]
+    assert list(batch.numeric['amount']) == [1.0, -2.0, 3.0]
+    # Fields an action does not have, or left unresolved, are NaN
+    assert batch.numeric['price'][0] == 2.0 and np.isnan(batch.numeric['price'][1])
+    assert np.isnan(batch.numeric['feeAssetPrice'][0])
+
+    assert batch.categories['asset'] == ['BTC', 'USDT', 'ETH']
+    assert list(batch.codes['asset']) == [0, 1, 2]
+    assert list(batch.codes['symbol']) == [0, -1, 1]
+    assert batch.categories['kind'] == ['TradeAction', 'ExchangeAccountAction']
+
+
+def test_net_amounts_by_day():
+    actions = [trade(DAY, 'BTC', 1.0), trade(DAY + 1, 'BTC', -0.25), trade(3 * DAY, 'ETH', 2.0), trade(3 * DAY + 5, 'BTC', 1.0)]
+    first_day, movements, assets = ActionBatch.fromActions(actions).netAmountsByDay()
+
+    assert first_day == 1
+    assert assets == ['BTC', 'ETH']
+    assert movements.tolist() == [[0.75, 0.0], [0.0, 0.0], [1.0, 2.0]]
+
+
+def test_actions_without_an_asset_are_left_out():
+    actions = [trade(0, 'BTC', 1.0), ExchangeAccountAction(None, 5.0, 0, 'deposit activity'), trade(0, 'ETH', 2.0)]
+    _, movements, assets = ActionBatch.fromActions(actions).netAmountsByDay()
+    assert assets == ['BTC', 'ETH']
+    assert movements.tolist() == [[1.0, 2.0]]
+
+
+def test_daily_movements_merge_batches():
+    movements = DailyMovements()
+    movements.add(ActionBatch.fromActions([trade(2 * DAY, 'BTC', 1.0)]))
+    movements.add(ActionBatch.fromActions([trade(0, 'ETH', 2.0), trade(2 * DAY, 'BTC', 1.0)]))
+
+    assert movements.first_day == 0
+    assert movements.assets == ['BTC', 'ETH']
+    assert movements.movements.tolist() == [[0.0, 2.0], [0.0, 0.0], [2.0, 0.0]]
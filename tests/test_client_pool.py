@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import client_pool
+from global_vars import SETUP_DIR
+from update_user_data import main
+
+
+class FakeSession(object):
+
+    def __init__(self) -> None:
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PooledClient(object):
+
+    def __init__(self) -> None:
+        self.session = FakeSession()
+
+
+def test_close_clients_closes_and_empties_the_pool(monkeypatch):
+    clients = {('a', 'a'): PooledClient(), ('b', 'b'): PooledClient()}
+    monkeypatch.setattr(client_pool, '_CLIENTS', dict(clients))
+
+    client_pool.closeClients()
+    assert all(client.session.closed for client in clients.values())
+    assert client_pool._CLIENTS == {}
+
+
+def test_sync_entry_point_closes_the_pool_even_when_a_user_fails(workdir, monkeypatch):
+    # The user's exchange entry is incomplete, so building its Exchange fails
+    SETUP_DIR.parent.mkdir()
+    SETUP_DIR.write_text(json.dumps({'total': 1, 'users': {'0001': {'user_exchanges': [{'code': 'e0001'}]}}}))
+    monkeypatch.setattr('tools._APP_SETUP', None)
+    client = PooledClient()
+    monkeypatch.setattr(client_pool, '_CLIENTS', {('a', 'a'): client})
+
+    with pytest.raises(KeyError):
+        main()
+    assert client.session.closed
+    assert client_pool._CLIENTS == {}
@@ -0,0 +1,69 @@
+import pytest
+
+from exchange import BinanceExchange
+from fake_binance_client import SyntheticClient
+from rate_limiter import RateLimiter
+
+START = '2019-12-31 00:00:00'
+END = '2030-01-01 00:00:00'
+
+
+class PagingClient(SyntheticClient):
+    ''' Records the fromId of every trades page requested '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.from_ids = []
+
+    def get_my_trades(self, symbol, fromId=None, limit=500, startTime=None, endTime=None):
+        page = super().get_my_trades(symbol, fromId=fromId, limit=limit, startTime=startTime, endTime=endTime)
+        self.from_ids.append((fromId, len(page)))
+        return page
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(capacity=10 ** 9, state_path=tmp_path / 'rate_limit.json')
+
+
+def test_trades_are_paged_forward_from_the_cursor(limiter):
+    # One symbol with 2500 trades: two full pages of 1000 and a short last page
+    client = PagingClient(1, 2500)
+    exchange = BinanceExchange(None, None, client=client, limiter=limiter)
+    cursors = {}
+
+    trades = exchange.getTrades(['SYN0'], START, END, cursors)
+
+    assert client.from_ids == [(0, 1000), (1000, 1000), (2000, 500)]
+    ids = [trade['id'] for trade in trades]
+    assert ids == list(range(2500))
+    assert cursors == {'SYN0USDT': 2499}
+
+
+def test_trades_resume_after_the_stored_cursor(limiter):
+    client = PagingClient(1, 2500)
+    exchange = BinanceExchange(None, None, client=client, limiter=limiter)
+    cursors = {'SYN0USDT': 1499}
+
+    trades = exchange.getTrades(['SYN0'], START, END, cursors)
+    assert [trade['id'] for trade in trades] == list(range(1500, 2500))
+    # The last page was full, so one more (empty) page is asked for
+    assert client.from_ids == [(1500, 1000), (2500, 0)]
+
+    # Nothing new: one empty page, the cursor stays put
+    client.from_ids = []
+    assert exchange.getTrades(['SYN0'], START, END, cursors) == []
+    assert client.from_ids == [(2500, 0)]
+    assert cursors == {'SYN0USDT': 2499}
+
+
+def test_trades_after_the_end_date_are_left_for_the_next_sync(limiter):
+    client = PagingClient(1, 2500)
+    exchange = BinanceExchange(None, None, client=client, limiter=limiter)
+    cursors = {}
+    # Trades are an hour apart from 2020-01-01 01:00, so the first 1200 end on 2020-02-20 00:00
+    trades = exchange.getTrades(['SYN0'], START, '2020-02-20 00:00:00', cursors)
+
+    assert [trade['id'] for trade in trades] == list(range(1200))
+    assert cursors == {'SYN0USDT': 1199}
+    assert [trade['id'] for trade in exchange.getTrades(['SYN0'], START, END, cursors)] == list(range(1200, 2500))
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from exchange_actions import re_key_input, rekeyRecords
+from global_vars import KEY_MAPS
+
+TIME_KEYS = {'time'}
+
+
+def value(rng, key_map, exchange_key, i):
+    if rng.random() < 0.1:
+        return None
+    if key_map[exchange_key] in TIME_KEYS:
+        return 1600000000000 + rng.randrange(10 ** 9)
+    return '{}-{}'.format(exchange_key, i)
+
+
+def record(rng, key_map, i, keys=None):
+    '''
+    A record carrying keys (a random subset of the map's keys when None), some of them null,
+    plus keys the map does not know
+    '''
+    keys = [key for key in key_map if rng.random() < 0.7] if keys == None else keys
+    out = {exchange_key: value(rng, key_map, exchange_key, i) for exchange_key in keys}
+    out['unmappedField'] = i
+    out['anotherExtra'] = 'extra'
+    return out
+
+
+@pytest.mark.parametrize('exchange_code', sorted(KEY_MAPS))
+def test_compiled_plan_matches_re_key_input(exchange_code, monkeypatch):
+    key_map = KEY_MAPS[exchange_code]
+    monkeypatch.setattr('exchange_actions.BINANCE_KEY_MAP', key_map)
+    rng = random.Random(0)
+
+    for endpoint in range(20):
+        # Records of one endpoint carry the same keys...
+        keys = [key for key in key_map if rng.random() < 0.7]
+        records = [record(rng, key_map, i, keys) for i in range(50)]
+        # ...but some leave keys out, so the batch's columns are missing for some records
+        records += [record(rng, key_map, i) for i in range(50)]
+
+        rekeyed = rekeyRecords(records, 'endpoint{}'.format(endpoint), exchange_code)
+        assert len(rekeyed) == len(records)
+        for original, new in zip(records, rekeyed):
+            # Keys the old path leaves out (missing or null) come back as None from the batch path
+            assert {key: value for key, value in new.items() if value is not None} == re_key_input(original)
+            assert set(new) <= set(key_map.values())
+
+
+def test_string_times_are_parsed_to_epoch_ms():
+    records = [{'applyTime': '2021-01-01 00:00:00', 'coin': 'BTC', 'amount': '1'}]
+    assert rekeyRecords(records, 'withdrawals')[0]['time'] == 1609459200000
+
+
+def test_keep_copies_exchange_keys_through():
+    records = [{'fromAsset': 'BTC', 'toAsset': 'ETH', 'toAmount': '2', 'createTime': 1}]
+    rekeyed = rekeyRecords(records, 'conversions', keep=['fromAsset'])[0]
+    # toAsset comes later in the key map so it wins the asset column, fromAsset is kept as is
+    assert rekeyed == dict(re_key_input(records[0]), fromAsset='BTC')
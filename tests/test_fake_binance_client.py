@@ -0,0 +1,27 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_binance_client import RecordingClient, ReplayClient, SyntheticClient, benchmark
+
+
+def test_recording_from_many_threads_replays_every_record(tmp_path):
+    live = SyntheticClient(8, 400)
+    fixture = tmp_path / 'fixture.json'
+    recorder = RecordingClient(live, fixture)
+
+    symbols = [s['symbol'] for s in live.data['exchange_info']['symbols']]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda symbol: recorder.get_my_trades(symbol=symbol, fromId=0, limit=1000), symbols * 3))
+
+    recorded = json.loads(fixture.read_text())
+    assert {symbol: len(trades) for symbol, trades in recorded['trades'].items()} == \
+        {symbol: len(trades) for symbol, trades in live.data['trades'].items()}
+    assert list(tmp_path.iterdir()) == [fixture]
+
+    replay = ReplayClient(fixture)
+    assert replay.get_my_trades(symbol=symbols[0], fromId=0) == live.get_my_trades(symbol=symbols[0], fromId=0)
+
+
+def test_benchmark_covers_sync_and_portfolio_update():
+    timings = benchmark(SyntheticClient(3, 200))
+    assert {'trades', 'loadAllDataFromExchange', 'Portfolio.update'} <= set(timings)
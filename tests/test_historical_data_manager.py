@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from exchange import Exchange
+from fake_binance_client import SyntheticClient
+from global_vars import USER_DATA_PATH
+from historical_data_manager import HistoricalDataManager
+from rate_limiter import RateLimiter
+from tools import createJsonDescriptors
+from update_user_data import createHistoricalUserData
+
+
+@pytest.fixture
+def manager(workdir):
+    user_dir = USER_DATA_PATH / '0001' / 'historical_data'
+    user_dir.mkdir(parents=True)
+    createJsonDescriptors(user_dir)
+
+    limiter = RateLimiter(capacity=10 ** 9, state_path=workdir / 'rate_limit.json')
+    exchange = Exchange('e0001', 'fake', 'fake', True, client=SyntheticClient(3, 300), limiter=limiter)
+    createHistoricalUserData('0001', exchange)
+    return HistoricalDataManager('0001', 'USDT')
+
+
+def test_holdings_are_read_as_floats(manager):
+    holdings = manager.getHistoricalHoldings('2020-01-01', '2020-02-01')
+    assert holdings.dates[0] == '2020-01-01'
+    assert set(holdings.assets) == {'USDT', 'SYN0', 'SYN1', 'SYN2'}
+    assert all(isinstance(row[asset], float) for row in holdings.data for asset in holdings.assets)
+
+    usdt = manager.getHistoricalHoldings('2020-01-01', '2020-02-01', asset='USDT')
+    assert usdt.assets == ['USDT']
+    assert [row['USDT'] for row in usdt.data] == [row['USDT'] for row in holdings.data]
+
+
+def test_trades_are_filtered_and_typed(manager):
+    trades = manager.getHistoricalTrades('2020-01-01 00:00:00', '2021-01-01 00:00:00', asset='SYN1')
+    assert trades.data and all(trade['asset'] == 'SYN1' for trade in trades.data)
+    assert all(isinstance(trade['amount'], float) and isinstance(trade['id'], int) for trade in trades.data)
+    assert np.all(np.diff([trade['id'] for trade in trades.data]) > 0)
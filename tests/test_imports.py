@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import REPO_ROOT
+
+# CLI startup budget: the entry points import in tens of milliseconds
+IMPORT_TIME_CEILING = 0.05
+# Only loaded once a command actually runs
+DEFERRED_MODULES = {'pandas', 'numpy', 'requests', 'sqlite3', 'asyncio', 'ccxt', 'binance',
+                    'mongoengine', 'passlib', 'colorama'}
+
+PROBE = '''
+import json, socket, sys, time
+
+def refuse(*args, **kwargs):
+    raise AssertionError('network access at import time')
+
+socket.socket.connect = refuse
+socket.create_connection = refuse
+
+start = time.perf_counter()
+import update_market_data, update_user_data, user, main
+elapsed = time.perf_counter() - start
+
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(set(name.split('.')[0] for name in sys.modules))}))
+'''
+
+
+def test_entry_points_import_without_side_effects(tmp_path):
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    assert sorted(DEFERRED_MODULES & set(probe['modules'])) == []
+    assert probe['elapsed'] < IMPORT_TIME_CEILING
+    # No data/ directory, setup file or lock file is created just by importing
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,45 @@
+from market_backfill import CannedExchange, RateBudget, backfill, TIMEFRAME_MS
+
+HOUR = TIMEFRAME_MS['1h']
+
+
+def candles(n, first=0):
+    return [[(first + i) * HOUR, 1.0, 2.0, 0.5, 1.5 + i, 10.0] for i in range(n)]
+
+
+def collect(exchange, starts, until, **kwargs):
+    pages = {}
+
+    def sink(symbol, rows):
+        pages.setdefault(symbol, []).append(rows)
+
+    last_times = backfill(exchange, starts, until, sink, budget=RateBudget(10 ** 6), **kwargs)
+    return last_times, pages
+
+
+def test_pages_every_symbol_in_time_order():
+    exchange = CannedExchange({'BTC/USDT': candles(2500), 'ETH/USDT': candles(700)}, page_limit=1000)
+    last_times, pages = collect(exchange, {'BTC/USDT': 0, 'ETH/USDT': 0}, 10 ** 6 * HOUR)
+
+    assert last_times == {'BTC/USDT': 2499 * HOUR, 'ETH/USDT': 699 * HOUR}
+    assert [len(page) for page in pages['BTC/USDT']] == [1000, 1000, 500]
+    times = [row['time'] for page in pages['BTC/USDT'] for row in page]
+    assert times == [i * HOUR for i in range(2500)]
+    assert pages['ETH/USDT'][0][0] == {'time': 0, 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': 1.5, 'volume': 10.0, 'symbol': 'ETH/USDT'}
+
+
+def test_stops_at_until_and_resumes_from_start():
+    exchange = CannedExchange({'BTC/USDT': candles(100)}, page_limit=30)
+    last_times, pages = collect(exchange, {'BTC/USDT': 40 * HOUR}, 75 * HOUR)
+
+    times = [row['time'] for page in pages['BTC/USDT'] for row in page]
+    assert times == [i * HOUR for i in range(40, 75)]
+    assert last_times['BTC/USDT'] == 74 * HOUR
+
+
+def test_symbol_without_new_candles_reports_none():
+    exchange = CannedExchange({'BTC/USDT': candles(10)})
+    last_times, pages = collect(exchange, {'BTC/USDT': 10 * HOUR, 'XRP/USDT': 0}, 100 * HOUR)
+
+    assert last_times == {'BTC/USDT': None, 'XRP/USDT': None}
+    assert pages == {}
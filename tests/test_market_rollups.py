@@ -0,0 +1,60 @@
+import numpy as np
+
+from market_rollups import DAY, HOUR, ROLLUPS, aggregateBars, rollupSymbol
+from market_store import getMarketStore, OHLCV_COLUMNS
+
+
+def hourly(first_hour, n):
+    times = (first_hour + np.arange(n)) * HOUR
+    values = np.arange(n, dtype=np.float64)
+    return {'time': times, 'open': values, 'high': values + 1, 'low': values - 1, 'close': values + 0.5, 'volume': np.ones(n)}
+
+
+def test_daily_bars_only_cover_closed_days():
+    bars = aggregateBars(hourly(0, 60), *ROLLUPS['daily'], 60 * HOUR)
+
+    assert list(bars['time']) == [0, DAY]
+    assert list(bars['open']) == [0.0, 24.0]
+    assert list(bars['high']) == [24.0, 48.0]
+    assert list(bars['low']) == [-1.0, 23.0]
+    assert list(bars['close']) == [23.5, 47.5]
+    assert list(bars['volume']) == [24.0, 24.0]
+
+
+def test_weekly_bars_start_on_monday():
+    # 1970-01-01 was a Thursday, the first full week starts on Monday 1970-01-05
+    bars = aggregateBars(hourly(0, 24 * 12), *ROLLUPS['weekly'], 24 * 12 * HOUR)
+    assert list(bars['time']) == [-3 * DAY, 4 * DAY]
+    assert bars['volume'][0] == 24 * 4
+
+
+def test_period_is_open_until_now_passes_its_end():
+    # A candle for the last hour of day 1 exists, but that hour is still running
+    bars = aggregateBars(hourly(0, 48), *ROLLUPS['daily'], 47 * HOUR + HOUR // 2)
+    assert list(bars['time']) == [0]
+    assert aggregateBars(hourly(0, 24), *ROLLUPS['daily'], 23 * HOUR) == None
+
+
+def test_rollup_is_incremental(workdir):
+    store = getMarketStore('hourly')
+    store.append('BTCUSDT', hourly(0, 30))
+    assert rollupSymbol('BTCUSDT', 'daily', now=72 * HOUR) == 1
+
+    store.append('BTCUSDT', {c: v[30:] for c, v in hourly(0, 72).items()})
+    assert rollupSymbol('BTCUSDT', 'daily', now=72 * HOUR) == 2
+    assert rollupSymbol('BTCUSDT', 'daily', now=72 * HOUR) == 0
+
+    daily = getMarketStore('daily').read('BTCUSDT', columns=OHLCV_COLUMNS)
+    assert list(daily['time']) == [0, DAY, 2 * DAY]
+    assert list(daily['close']) == [23.5, 47.5, 71.5]
+
+
+def test_day_whose_last_hour_is_still_open_is_not_rolled_up(workdir):
+    # The 23:00 candle of day 1 is stored but its hour has not closed yet
+    store = getMarketStore('hourly')
+    store.append('BTCUSDT', hourly(0, 48))
+    assert rollupSymbol('BTCUSDT', 'daily', now=47 * HOUR + HOUR // 2) == 1
+
+    # The day is only written once the hour has closed
+    assert rollupSymbol('BTCUSDT', 'daily', now=48 * HOUR) == 1
+    assert list(getMarketStore('daily').read('BTCUSDT', columns=['time'])['time']) == [0, DAY]
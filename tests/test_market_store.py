@@ -0,0 +1,56 @@
+import numpy as np
+
+from market_store import MarketStore, OHLCV_COLUMNS
+
+HOUR = 60 * 60 * 1000
+
+
+def page(first, n):
+    times = (first + np.arange(n)) * HOUR
+    return dict({'time': times}, **{column: times / HOUR for column in OHLCV_COLUMNS[1:]})
+
+
+def assertAligned(store, symbol):
+    data = store.read(symbol, columns=OHLCV_COLUMNS)
+    for column in OHLCV_COLUMNS[1:]:
+        assert np.array_equal(data[column], data['time'] / HOUR)
+    return data
+
+
+def test_append_drops_rows_already_stored(tmp_path):
+    store = MarketStore(tmp_path)
+    assert store.append('BTCUSDT', page(0, 10)) == 10
+    assert store.append('BTCUSDT', page(5, 10)) == 5
+
+    assert store.symbols() == ['BTCUSDT']
+    assert store.lastTime('BTCUSDT') == 14 * HOUR
+    assert list(assertAligned(store, 'BTCUSDT')['time']) == [i * HOUR for i in range(15)]
+
+
+def test_range_read(tmp_path):
+    store = MarketStore(tmp_path)
+    store.append('BTCUSDT', page(0, 100))
+
+    data = store.read('BTCUSDT', start=10 * HOUR, end=12 * HOUR, columns=['time', 'close'])
+    assert list(data['close']) == [10.0, 11.0, 12.0]
+    assert store.read('ETHUSDT')['close'].size == 0
+
+
+def test_crashed_append_is_ignored_and_truncated(tmp_path):
+    store = MarketStore(tmp_path)
+    store.append('BTCUSDT', page(0, 10))
+    version = store.version('BTCUSDT')
+
+    # A crash after the value columns were appended but before time committed the rows
+    for column in OHLCV_COLUMNS[1:]:
+        with open(store.columnPath('BTCUSDT', column), 'ab') as outfile:
+            outfile.write(np.full(7, -1.0).tobytes())
+    with open(store.columnPath('BTCUSDT', 'time'), 'ab') as outfile:
+        outfile.write(b'\x00\x01\x02')
+
+    assert store.length('BTCUSDT') == 10
+    assert store.version('BTCUSDT') != version
+    assertAligned(store, 'BTCUSDT')
+
+    store.append('BTCUSDT', page(10, 5))
+    assert len(assertAligned(store, 'BTCUSDT')['time']) == 15
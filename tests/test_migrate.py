@@ -0,0 +1,61 @@
+import json
+
+import pandas as pd
+
+from exchange import Exchange
+from fake_binance_client import SyntheticClient
+from global_vars import MARKET_DATA_PATH, SETUP_DIR, USER_DATA_PATH
+from history_streams import HISTORY_STREAMS
+from market_store import getMarketStore
+from rate_limiter import RateLimiter
+from storage import getStorage
+from tools import createJsonDescriptors, updateDBInfo
+from update_user_data import createHistoricalUserData, migrate
+
+
+def test_migrate_copies_user_tables_between_backends(workdir, monkeypatch):
+    # The account is synced into CSV tables whatever backend the suite runs with
+    monkeypatch.setenv('STORAGE_BACKEND', 'csv')
+    SETUP_DIR.parent.mkdir()
+    SETUP_DIR.write_text(json.dumps({'total': 1, 'users': {'0001': {}}}))
+    user_dir = USER_DATA_PATH / '0001' / 'historical_data'
+    user_dir.mkdir(parents=True)
+    createJsonDescriptors(user_dir)
+    for stream in HISTORY_STREAMS:
+        updateDBInfo(stream.db('0001'), dict(stream.descriptor(), e0001=stream.newExchangeState()))
+
+    limiter = RateLimiter(capacity=10 ** 9, state_path=workdir / 'rate_limit.json')
+    client = SyntheticClient(3, 300)
+    createHistoricalUserData('0001', Exchange('e0001', 'fake', 'fake', True, client=client, limiter=limiter))
+
+    migrate('csv', 'sqlite')
+
+    csv, sqlite = getStorage('csv'), getStorage('sqlite')
+    for name in ['historical_trades', 'historical_deposits', 'historical_movements', 'historical_holdings']:
+        db = user_dir / name
+        assert sqlite.getInfo(db) == csv.getInfo(db)
+        assert len(sqlite.read(db, '', '9999').data) == len(csv.read(db, '', '9999').data) > 0
+
+    # Migrated rows are keyed, a re-sync of the same records writes nothing
+    trades = HISTORY_STREAMS[0]
+    stored = csv.read(trades.db('0001'), '', '9999', combine_dates=True).data
+    assert sqlite.upsert(trades.db('0001'), stored, trades.headers, trades.key_columns, 'e0001') == []
+
+
+def test_migrate_imports_the_legacy_market_csv(workdir):
+    SETUP_DIR.parent.mkdir()
+    SETUP_DIR.write_text(json.dumps({'total': 0, 'users': {}}))
+    MARKET_DATA_PATH.mkdir(parents=True)
+    times = pd.date_range('2021-01-01', periods=72, freq='h').strftime('%Y-%m-%d %H:%M:%S')
+    legacy = pd.DataFrame({'time': list(times) * 2, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 2.0, 'volume': 1.0,
+                           'symbol': ['BTCUSDT'] * 72 + ['ETHUSDT'] * 72})
+    legacy.to_csv(MARKET_DATA_PATH / 'hourly_market_data.csv', index=False)
+
+    migrate('csv', 'csv')
+    assert getMarketStore().symbols() == ['BTCUSDT', 'ETHUSDT']
+    assert getMarketStore().length('BTCUSDT') == 72
+    assert getMarketStore('daily').length('ETHUSDT') == 3
+
+    # A second run leaves the store alone
+    migrate('csv', 'csv')
+    assert getMarketStore().length('BTCUSDT') == 72
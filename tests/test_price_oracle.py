@@ -0,0 +1,53 @@
+import numpy as np
+
+from exchange_actions import WithdrawlAction, enrichPrices
+from history_streams import HISTORY_STREAMS
+from market_store import MarketStore, getMarketStore
+from price_oracle import PriceOracle, getPriceOracle
+from tools import upsertRowsToDB, stringToTimeStamp
+
+HOUR = 60 * 60 * 1000
+START = stringToTimeStamp('2021-01-01 00:00:00')
+
+
+def candles(n, first=START):
+    times = first + np.arange(n) * HOUR
+    closes = 100.0 + np.arange(n)
+    return {'time': times, 'open': closes, 'high': closes, 'low': closes, 'close': closes, 'volume': np.ones(n)}
+
+
+def withdrawal(time, asset='BNB'):
+    return {'time': time, 'network': 'BSC', 'address': 'x', 'status': 6, 'fee': 0.01, 'id': str(time), 'asset': asset, 'amount': 1.0}
+
+
+def test_prices_are_interpolated_and_never_extrapolated(tmp_path):
+    store = MarketStore(tmp_path)
+    store.append('BNBUSDT', candles(10))
+    oracle = PriceOracle(store)
+
+    prices = oracle.prices_at(['BNBUSDT', 'BNBUSDT', 'BNBUSDT', 'XYZUSDT'],
+                              [START + HOUR // 2, START - 1, START + 9 * HOUR + 1, START])
+    assert prices[0] == 100.5
+    assert np.isnan(prices[1:]).all()
+
+
+def test_unresolved_prices_are_reported_and_left_empty(workdir, capsys):
+    getPriceOracle().refresh()
+    actions = enrichPrices([WithdrawlAction(withdrawal(START), re_key=False, resolve_prices=False)])
+
+    assert actions[0].feeAssetPrice == None
+    assert actions[0].toDict()['feeAssetPrice'] == None
+    assert 'BNBUSDT at 2021-01-01 00:00:00' in capsys.readouterr().out
+
+
+def test_stored_unresolved_prices_resolve_once_market_data_arrives(workdir):
+    stream = next(stream for stream in HISTORY_STREAMS if stream.name == 'historical_withdrawals')
+    getPriceOracle().refresh()
+
+    rows = [WithdrawlAction(withdrawal(START + HOUR), re_key=False, resolve_prices=False).toDict()]
+    upsertRowsToDB(stream.db('0001'), rows, stream.headers, stream.key_columns, 'e0001')
+    assert [action.feeAssetPrice for action in stream.iterActions('0001', '', '9999')] == [None]
+
+    getMarketStore().append('BNBUSDT', candles(5))
+    getPriceOracle().refresh()
+    assert [action.feeAssetPrice for action in stream.iterActions('0001', '', '9999')] == [101.0]
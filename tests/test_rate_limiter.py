@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from fake_binance_client import SyntheticClient
+from market_backfill import SharedRateBudget
+from rate_limiter import RateLimiter, RateLimitedClient, ENDPOINT_WEIGHTS
+
+
+def tokens(limiter):
+    with open(limiter.state_path) as infile:
+        return json.load(infile)['tokens']
+
+
+def test_limiters_on_one_state_file_share_the_budget(tmp_path):
+    # Two processes (or a user sync and the market job) each build their own limiter on the same file
+    first = RateLimiter(capacity=100, period=1.0, state_path=tmp_path / 'rl.json')
+    second = RateLimiter(capacity=100, period=1.0, state_path=tmp_path / 'rl.json')
+
+    first.acquire(60)
+    start = time.monotonic()
+    second.acquire(45)
+    # The 5 missing tokens refill at 100 per second
+    assert time.monotonic() - start >= 0.04
+
+
+def test_observed_weight_caps_the_bucket(tmp_path):
+    limiter = RateLimiter(capacity=1200, state_path=tmp_path / 'rl.json')
+    limiter.observe(1100)
+    assert tokens(limiter) <= 100
+
+
+def test_client_calls_draw_their_endpoint_weight(tmp_path):
+    limiter = RateLimiter(capacity=10 ** 6, period=10 ** 12, state_path=tmp_path / 'rl.json')
+    client = RateLimitedClient(SyntheticClient(2, 10), limiter)
+
+    client.get_account()
+    client.get_all_tickers()
+    assert 10 ** 6 - tokens(limiter) == pytest.approx(ENDPOINT_WEIGHTS['get_account'] + ENDPOINT_WEIGHTS['get_all_tickers'])
+
+
+def test_rate_limited_call_is_retried_after_the_block(tmp_path):
+    limiter = RateLimiter(capacity=10 ** 6, state_path=tmp_path / 'rl.json')
+    fake = SyntheticClient(2, 10, rate_limit_every=2)
+    client = RateLimitedClient(fake, limiter)
+
+    client.get_all_tickers()
+    start = time.monotonic()
+    assert client.get_all_tickers()
+    # The 429 blocked every caller for its Retry-After before the retry went out
+    assert time.monotonic() - start >= 0.9
+    assert fake.calls['get_all_tickers'] == 3
+
+
+def test_backfill_budget_draws_from_the_shared_limiter(tmp_path):
+    limiter = RateLimiter(capacity=1000, period=10 ** 6, state_path=tmp_path / 'rl.json')
+    budget = SharedRateBudget(limiter)
+
+    async def run():
+        await asyncio.gather(*[budget.acquire(2) for _ in range(50)])
+
+    asyncio.run(run())
+    assert tokens(limiter) < 901
@@ -0,0 +1,162 @@
+import pytest
+
+from storage import CSVStorage, SQLiteStorage, copyTable
+
+HEADERS = ['time', 'id', 'asset', 'amount']
+
+
+def rows(ids, day='2021-01-01'):
+    return [{'time': '{} {:02d}:00:00'.format(day, i % 24), 'id': i, 'asset': 'BTC' if i % 2 else 'ETH', 'amount': float(i)} for i in ids]
+
+
+def readAll(storage, db):
+    return storage.read(db, '', '9999', combine_dates=True).data
+
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def storage(request):
+    return CSVStorage() if request.param == 'csv' else SQLiteStorage()
+
+
+@pytest.fixture
+def csv_storage():
+    return CSVStorage()
+
+
+def test_upsert_skips_stored_keys(storage, tmp_path):
+    db = tmp_path / 'historical_deposits'
+    assert len(storage.upsert(db, rows(range(10)), HEADERS, ['id'], 'e0001')) == 10
+
+    # An overlapping re-sync only writes the records it has not seen, repeats within a batch are dropped too
+    written = storage.upsert(db, rows(range(5, 15)) + rows([14]), HEADERS, ['id'], 'e0001')
+    assert [row['id'] for row in written] == list(range(10, 15))
+    assert storage.upsert(db, rows(range(15)), HEADERS, ['id'], 'e0001') == []
+
+    assert sorted(row['id'] for row in readAll(storage, db)) == list(range(15))
+
+
+def test_upsert_keys_are_per_exchange(storage, tmp_path):
+    db = tmp_path / 'historical_deposits'
+    storage.upsert(db, rows(range(3)), HEADERS, ['id'], 'e0001')
+    assert len(storage.upsert(db, rows(range(3)), HEADERS, ['id'], 'e0002')) == 3
+
+
+def test_compact_removes_duplicates_and_rebuilds_keys(storage, tmp_path):
+    db = tmp_path / 'historical_deposits'
+    storage.dump(db, rows(range(5)), HEADERS)
+    storage.append(db, rows(range(3, 8)), HEADERS)
+
+    assert storage.compact(db, HEADERS, ['id'], ['e0001']) == 2
+    assert sorted(row['id'] for row in readAll(storage, db)) == list(range(8))
+    assert [row['id'] for row in storage.upsert(db, rows(range(10)), HEADERS, ['id'], 'e0001')] == [8, 9]
+
+
+def test_compacted_rows_of_two_exchanges_are_keyed_for_both(storage, tmp_path):
+    # Rows migrated from another backend carry no keys, the table holds both exchanges' records
+    db = tmp_path / 'historical_deposits'
+    storage.dump(db, rows(range(4)), HEADERS)
+
+    assert storage.compact(db, HEADERS, ['id'], ['e0001', 'e0002']) == 0
+    assert storage.upsert(db, rows(range(2)), HEADERS, ['id'], 'e0001') == []
+    assert storage.upsert(db, rows(range(2, 4)), HEADERS, ['id'], 'e0002') == []
+    assert len(readAll(storage, db)) == 4
+
+
+def test_missing_table_reads_empty(storage, tmp_path):
+    db = tmp_path / 'historical_deposits'
+    data = storage.read(db, '', '9999', combine_dates=True, headers=['id', 'amount'])
+    assert data.data == [] and data.assets == ['time', 'id', 'amount']
+    assert list(storage.readChunks(db, '', '9999')) == []
+
+
+def daily_rows(days, per_day=24):
+    return [{'time': '2021-01-{:02d} {:02d}:00:00'.format(day, hour), 'id': day * 100 + hour, 'asset': 'BTC', 'amount': 1.0}
+            for day in days for hour in range(per_day)]
+
+
+def test_range_read_seeks_with_offset_index(csv_storage, tmp_path):
+    storage = csv_storage
+    db = tmp_path / 'historical_trades'
+    storage.dump(db, daily_rows(range(1, 6)), HEADERS)
+    storage.append(db, daily_rows(range(6, 11)), HEADERS)
+
+    header_end, start, end = storage.timeRangeOffsets(db, '2021-01-03 00:00:00', '2021-01-04 23:59:59')
+    with open(db.with_suffix('.csv'), 'rb') as infile:
+        infile.seek(start)
+        assert infile.readline().startswith(b'2021-01-03 00:00:00')
+        infile.seek(end)
+        assert infile.readline().startswith(b'2021-01-05 00:00:00')
+
+    data = storage.read(db, '2021-01-03 12:00:00', '2021-01-07 05:00:00')
+    assert data.dates[0] == '2021-01-03 12:00:00' and data.dates[-1] == '2021-01-07 05:00:00'
+    assert len(data.dates) == 12 + 24 * 3 + 6
+    assert storage.read(db, '2022-01-01 00:00:00', '2022-02-01 00:00:00').dates == []
+
+
+def test_stale_or_unsorted_index_falls_back_to_a_full_scan(csv_storage, tmp_path):
+    storage = csv_storage
+    db = tmp_path / 'historical_trades'
+    storage.dump(db, daily_rows(range(5, 8)), HEADERS)
+
+    # Written behind the index's back, the size no longer matches
+    with open(db.with_suffix('.csv'), 'a') as outfile:
+        outfile.write('2021-01-09 00:00:00,1,BTC,1.0\n')
+    assert storage.timeRangeOffsets(db, '2021-01-01 00:00:00', '2021-01-31 00:00:00') == None
+    assert len(storage.read(db, '2021-01-09 00:00:00', '2021-01-31 00:00:00').dates) == 1
+
+    # Appending older rows marks the table unsorted, range reads still find them
+    storage.append(db, daily_rows([1]), HEADERS)
+    assert storage.loadOffsetIndex(db)['sorted'] == False
+    assert len(storage.read(db, '2021-01-01 00:00:00', '2021-01-01 23:59:59').dates) == 24
+
+
+def test_read_filters_projects_and_types(storage, tmp_path):
+    db = tmp_path / 'historical_trades'
+    storage.dump(db, rows(range(10)), HEADERS)
+
+    data = storage.read(db, '2021-01-01 02:00:00', '2021-01-01 07:00:00', headers=['amount'], filters=[{'asset': 'BTC'}], dtypes={'amount': 'float64'})
+    assert data.assets == ['amount']
+    assert data.dates == ['2021-01-01 03:00:00', '2021-01-01 05:00:00', '2021-01-01 07:00:00']
+    assert [row['amount'] for row in data.data] == [3.0, 5.0, 7.0]
+
+    empty = storage.read(db, '2022-01-01 00:00:00', '2022-01-02 00:00:00', headers=['amount'])
+    assert empty.dates == [] and empty.assets == ['amount']
+
+
+def test_read_chunks_in_time_order(storage, tmp_path):
+    db = tmp_path / 'historical_trades'
+    storage.dump(db, daily_rows(range(1, 4)), HEADERS)
+
+    chunks = list(storage.readChunks(db, '', '9999', combine_dates=True, chunk_size=10, epoch_times=True))
+    times = [row['time'] for chunk in chunks for row in chunk]
+    assert len(times) == 72 and times == sorted(times)
+    assert times[0] == 1609459200000
+
+
+def test_copy_table_between_backends(tmp_path):
+    csv_storage, sqlite_storage = CSVStorage(), SQLiteStorage()
+    db = tmp_path / 'historical_trades'
+    csv_storage.dump(db, daily_rows(range(1, 4)), HEADERS)
+    csv_storage.updateInfo(db, {'last_update_date': '2021-01-04 00:00:00', 'headers': HEADERS})
+
+    copyTable(db, csv_storage, sqlite_storage)
+    assert sqlite_storage.getInfo(db) == csv_storage.getInfo(db)
+    assert readAll(sqlite_storage, db) == readAll(csv_storage, db)
+
+
+@pytest.mark.parametrize('source, target', [('csv', 'sqlite'), ('sqlite', 'csv')])
+def test_migrated_two_exchange_table_resyncs_without_duplicates(source, target, tmp_path):
+    backends = {'csv': CSVStorage(), 'sqlite': SQLiteStorage()}
+    source, target = backends[source], backends[target]
+    db = tmp_path / 'historical_deposits'
+    source.upsert(db, rows(range(3)), HEADERS, ['id'], 'e0001')
+    source.upsert(db, rows(range(3, 6)), HEADERS, ['id'], 'e0002')
+    source.updateInfo(db, {'headers': HEADERS})
+
+    # As migrateUser does: copy, then rebuild the keys for every exchange in the table
+    copyTable(db, source, target)
+    target.compact(db, HEADERS, ['id'], ['e0001', 'e0002'])
+
+    assert target.upsert(db, rows(range(3)), HEADERS, ['id'], 'e0001') == []
+    assert target.upsert(db, rows(range(3, 6)), HEADERS, ['id'], 'e0002') == []
+    assert sorted(row['id'] for row in readAll(target, db)) == list(range(6))
@@ -0,0 +1,30 @@
+import pytest
+
+from symbol_registry import SymbolRegistry
+
+SYMBOLS = [{'symbol': 'BTCUSDT', 'baseAsset': 'BTC', 'quoteAsset': 'USDT'},
+           {'symbol': 'ETHBTC', 'baseAsset': 'ETH', 'quoteAsset': 'BTC'}]
+
+
+def test_registry_round_trips_through_its_cache(tmp_path):
+    path = tmp_path / 'binance_symbols.json'
+    SymbolRegistry(SYMBOLS, updated=100.0).save(path)
+
+    registry = SymbolRegistry.fromFile(path)
+    assert registry.updated == 100.0
+    assert registry.getPair('BTC', 'USDT').symbol == 'BTCUSDT'
+    assert [symbol.symbol for symbol in registry.getPairsForAsset('ETH')] == ['ETHBTC']
+
+
+def test_failed_save_keeps_the_previous_cache(tmp_path):
+    path = tmp_path / 'binance_symbols.json'
+    SymbolRegistry(SYMBOLS, updated=100.0).save(path)
+
+    # The second symbol cannot be serialized, so the write fails half way through
+    broken = SymbolRegistry(SYMBOLS[:1], updated=200.0)
+    broken.raw_symbols = SYMBOLS[:1] + [{'symbol': object()}]
+    with pytest.raises(TypeError):
+        broken.save(path)
+
+    assert SymbolRegistry.fromFile(path).updated == 100.0
+    assert list(tmp_path.iterdir()) == [path]
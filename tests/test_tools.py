@@ -0,0 +1,33 @@
+import threading
+
+from tools import fetchDateWindows, stringToTimeStamp
+
+DAY = 24 * 60 * 60 * 1000
+
+
+def test_date_windows_cover_the_range_and_merge_in_time_order():
+    windows = []
+    lock = threading.Lock()
+
+    def fetch(start, end):
+        with lock:
+            windows.append((start, end))
+        # Each window hands back its records newest first
+        return [{'insertTime': end}, {'insertTime': start}]
+
+    records = fetchDateWindows(fetch, '2021-01-01 00:00:00', '2021-12-31 00:00:00', freq=90, time_key='insertTime')
+
+    windows.sort()
+    start, end = stringToTimeStamp('2021-01-01 00:00:00'), stringToTimeStamp('2021-12-31 00:00:00')
+    assert windows[0][0] == start
+    assert windows[-1][1] == end
+    # Contiguous: every ms of [start, end] is in exactly one window
+    assert all(later[0] == earlier[1] + 1 for earlier, later in zip(windows, windows[1:]))
+    assert all(window_start <= window_end for window_start, window_end in windows)
+    assert sum(window_end - window_start + 1 for window_start, window_end in windows) == end - start + 1
+    assert all(window_end - window_start <= 90 * DAY for window_start, window_end in windows)
+    assert [record['insertTime'] for record in records] == sorted(time for window in windows for time in window)
+
+
+def test_date_windows_skip_failed_or_empty_windows():
+    assert fetchDateWindows(lambda start, end: None, '2021-01-01 00:00:00', '2021-02-01 00:00:00') == []
@@ -0,0 +1,77 @@
+from global_vars import MARKET_DATA_PATH
+from market_backfill import CannedExchange, TIMEFRAME_MS
+from market_store import getMarketStore
+from tools import getDBInfo, updateDBInfo, stringToTimeStamp
+from update_market_data import updateMarketDB
+
+HOUR = TIMEFRAME_MS['1h']
+INITIAL_DATE = '2020-01-01 00:00:00'
+DB = MARKET_DATA_PATH / 'hourly_market_data'
+
+
+class FlakyExchange(CannedExchange):
+    ''' Fails every request after the first fail_after ones, like a run cut short '''
+
+    def __init__(self, candles, fail_after, **kwargs) -> None:
+        super().__init__(candles, **kwargs)
+        self.fail_after = fail_after
+
+    async def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None):
+        if self.calls >= self.fail_after:
+            self.calls += 1
+            raise ConnectionError('connection reset')
+        return await super().fetch_ohlcv(symbol, timeframe, since, limit)
+
+
+def candles(n):
+    first = stringToTimeStamp(INITIAL_DATE)
+    return [[first + i * HOUR, 1.0, 2.0, 0.5, float(i), 10.0] for i in range(n)]
+
+
+def test_interrupted_backfill_resumes_from_its_checkpoints(workdir):
+    (workdir / MARKET_DATA_PATH).mkdir(parents=True)
+    updateDBInfo(DB, {'initial_date': INITIAL_DATE, 'last_update_date': '', 'current_assets': ['BTCUSDT', 'ETHUSDT'],
+                      'headers': ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']})
+    data = {'BTCUSDT': candles(250), 'ETHUSDT': candles(120)}
+
+    updateMarketDB(exchange=FlakyExchange(data, fail_after=3, page_limit=100))
+    store = getMarketStore()
+    interrupted = {symbol: store.length(symbol) for symbol in data}
+    assert 0 < sum(interrupted.values()) < 370
+    # Each symbol's watermark is its last stored candle
+    watermarks = getDBInfo(DB)['watermarks']
+    assert {symbol: stringToTimeStamp(mark) for symbol, mark in watermarks.items()} == \
+        {symbol: store.lastTime(symbol) for symbol, n in interrupted.items() if n}
+
+    exchange = CannedExchange(data, page_limit=100)
+    updateMarketDB(exchange=exchange)
+
+    for symbol, rows in data.items():
+        stored = store.read(symbol, columns=['time', 'close'])
+        assert list(stored['time']) == [row[0] for row in rows]
+        assert list(stored['close']) == [row[4] for row in rows]
+
+    # Stored pages were not fetched again
+    assert exchange.calls < 3 + 2 + 2
+    info = getDBInfo(DB)
+    assert info['watermarks']['BTCUSDT'] == '2020-01-11 09:00:00'
+    assert info['last_update_date'] == '2020-01-05 23:00:00'
+    # The last, incomplete day is not rolled up yet
+    assert getMarketStore('daily').length('BTCUSDT') == 10
+
+
+def test_open_hour_is_not_stored(workdir):
+    (workdir / MARKET_DATA_PATH).mkdir(parents=True)
+    updateDBInfo(DB, {'initial_date': INITIAL_DATE, 'last_update_date': '', 'current_assets': ['BTCUSDT'],
+                      'headers': ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']})
+    first = stringToTimeStamp(INITIAL_DATE)
+    data = {'BTCUSDT': candles(30)}
+    store = getMarketStore()
+
+    # Half way through hour 20 the exchange already serves its partial candle
+    updateMarketDB(exchange=CannedExchange(data), now=first + 20 * HOUR + HOUR // 2)
+    assert store.lastTime('BTCUSDT') == first + 19 * HOUR
+
+    # Once it has closed the next run picks it up
+    updateMarketDB(exchange=CannedExchange(data), now=first + 21 * HOUR)
+    assert list(store.read('BTCUSDT', columns=['time'])['time']) == [first + i * HOUR for i in range(21)]
@@ -0,0 +1,44 @@
+import pytest
+
+from exchange import Exchange
+from fake_binance_client import SyntheticClient
+from global_vars import USER_DATA_PATH
+from history_streams import HISTORY_STREAMS
+from rate_limiter import RateLimiter
+from tools import createJsonDescriptors, dbRead, getDBInfo, upsertRowsToDB
+from update_user_data import createHistoricalUserData, updateUser
+
+USER_DIR = USER_DATA_PATH / '0001' / 'historical_data'
+
+
+def readAll(name):
+    return dbRead(USER_DIR / name, '2017-01-01 00:00:00', '9999-01-01 00:00:00', combine_dates=True).data
+
+
+def test_update_picks_up_records_timed_before_the_last_export(workdir):
+    USER_DIR.mkdir(parents=True)
+    createJsonDescriptors(USER_DIR)
+    limiter = RateLimiter(capacity=10 ** 9, state_path=workdir / 'rate_limit.json')
+    createHistoricalUserData('0001', Exchange('e0001', 'fake', 'fake', True, client=SyntheticClient(3, 300), limiter=limiter))
+    movements = readAll('historical_movements')
+    holdings = readAll('historical_holdings')
+    assert getDBInfo(USER_DIR / 'historical_movements')['last_update_date'] > '2020-01-05 00:00:00'
+
+    # The exchange reports a deposit late, it is timed well before the movements were last exported
+    deposits = HISTORY_STREAMS[1]
+    late = {'time': '2020-01-05 00:00:00', 'network': 'TRX', 'address': 'synthetic', 'status': 1,
+            'id': 'late0', 'asset': 'SYN0', 'amount': 5.0, 'description': 'deposit activity'}
+    upsertRowsToDB(deposits.db('0001'), [late], deposits.headers, deposits.key_columns, 'e0001')
+
+    updateUser('0001', [])
+
+    updated = readAll('historical_movements')
+    assert len(updated) == len(movements) + 1
+    assert {'time': late['time'], 'asset': 'SYN0', 'amount': 5.0, 'description': 'deposit activity'} in updated
+
+    # Holdings come from the same pass, from the deposit's day on they hold 5 more SYN0
+    updated_holdings = readAll('historical_holdings')
+    assert len(updated_holdings) == len(holdings)
+    for before, after in zip(holdings, updated_holdings):
+        expected = before['SYN0'] + (5.0 if before['time'] >= '2020-01-05' else 0.0)
+        assert after['SYN0'] == pytest.approx(expected)
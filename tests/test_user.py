@@ -0,0 +1,28 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from global_vars import SETUP_DIR
+
+
+def createUser(user_name):
+    from user import User
+    return User({'user_name': user_name, 'reporting_currency': 'USD'}).user_id
+
+
+def test_concurrent_user_creation_allocates_distinct_ids(workdir):
+    SETUP_DIR.parent.mkdir()
+    SETUP_DIR.write_text(json.dumps({'total': 0, 'users': {}}))
+
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        user_ids = list(pool.map(createUser, ['user{}'.format(i) for i in range(8)]))
+
+    setup = json.loads(SETUP_DIR.read_text())
+    assert sorted(user_ids) == ['{:04d}'.format(i) for i in range(1, 9)]
+    assert setup['total'] == 8
+    assert sorted(setup['users']) == sorted(user_ids)
+    assert all(setup['users'][user_id]['user_name'] == 'user{}'.format(i) for i, user_id in enumerate(user_ids))
+
+    with pytest.raises(Exception, match='already in use'):
+        createUser('user3')
@@ -2,11 +2,22 @@
 from pathlib import Path
 import datetime as dt
 import os
+import time
 import json
-import csv
-import pandas as pd
+import threading
+from contextlib import contextmanager
 
- 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from global_vars import SETUP_DIR, USER_DATA_PATH
+
+_APP_SETUP = None
+EPOCH = dt.datetime(1970, 1, 1)
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
 
 class HistoricalDataPackage(object):
     def __init__ (self, dates, data, assets):
@@ -35,129 +46,214 @@ def createFileInDirectory(directory):
         print('ERROR {}: Creating directory {}. '.format(e, directory))
 
 def createJsonDescriptors(directory):
+    # History table schemas are declared with their streams
+    from history_streams import HISTORY_STREAMS
 
-    files_to_create = [
-        "historical_trades.json", 
-        "historical_deposits.json", 
-        "historical_withdrawals.json",
-        "historical_dust_activities.json", 
-        "historical_fiat_movements.json", 
-        "historical_dividends.json", 
-        "historical_movements.json",  
-        "historical_holdings.json",
-        "historical_conversions.json"
-    ]
-
-    for f in files_to_create:
-        
-        file_name = f.split('.')[0]
-        
-        if file_name == 'historical_trades':
-            out_dict = {"headers": ["time","symbol","price","base",
-                                    "basePrice","fee","feeAsset","id","feeAssetPrice",
-                                    "asset","amount","description","type"]}
-        
-        elif file_name == 'historical_deposits':
-            out_dict = {"headers": ["time","network","address","status","id","asset",
-                                    "amount","description"]}
-
-        elif file_name == 'historical_withdrawals':
-            out_dict = {"headers": ["time","network","address","status","fee",
-                                    "feeAsset","feeAssetPrice","id","asset",
-                                    "amount","description"]}
-
-        elif file_name == 'historical_dust_activities':
-            out_dict = {"headers": ["time","fee","feeAsset","feeAssetPrice",
-                                    "transferedAmount","transferedAsset","id",
-                                    "asset","amount","description"]}
-
-        elif file_name == 'historical_fiat_movements':
-            out_dict = {"headers": ["time","fee","feeAsset","feeAssetPrice",
-                                    "id","asset","amount","description"]}
-
-        elif file_name == 'historical_dividends':
-            out_dict = {"headers": ["time","asset","amount","description"]}
-        
-        elif file_name == 'historical_conversions':
-            out_dict = {"headers":['time', 'price', 'asset', 'base', 'amount', 'description']}
+    descriptors = {stream.name: stream.descriptor() for stream in HISTORY_STREAMS}
+    descriptors['historical_holdings'] = {"last_update_date": "", "headers":[]}
+    descriptors['historical_movements'] = {"last_update_date": "", "headers": ["time","asset","amount",
+                                                                               "description"]}
 
-        elif file_name == 'historical_holdings':
-            out_dict = {"last_update_date": "", "headers":[]}
+    for file_name, out_dict in descriptors.items():
+        updateDBInfo(directory / file_name, out_dict)
         
-        elif file_name == 'historical_movements':
-            out_dict = {"last_update_date": "", "headers": ["time","asset","amount",
-                                                            "description"]}
 
-        with open(directory / f, 'w') as outfile:
-            json.dump(out_dict, outfile, indent=4)
-        
+class FileLock(object):
+    '''
+    Advisory lock on <path>.lock: an RLock between threads and an exclusive flock between
+    processes, taken once by the outermost holder so a thread can nest it
+    '''
+
+    def __init__(self, path) -> None:
+        self.lock_path = Path(str(path) + '.lock')
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            self.lock_file = open(self.lock_path, 'a')
+            if fcntl:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+def fileLock(path):
+    ''' The process-wide FileLock of a file, so every caller locking the same file shares it '''
+    key = os.path.abspath(path)
+    with _FILE_LOCKS_GUARD:
+        if key not in _FILE_LOCKS:
+            _FILE_LOCKS[key] = FileLock(path)
+        return _FILE_LOCKS[key]
+
+def userLock(user):
+    ''' Scope for jobs that read-modify-write a user's tables, different users never contend '''
+    return fileLock(USER_DATA_PATH / user / 'user')
+
+@contextmanager
+def atomicWrite(path, mode='w', newline=None):
+    '''
+    Opens a temp file next to path and renames it over path once the block completes, so
+    readers and crashes only ever see the old or the new file
+    '''
+    path = Path(path)
+    tmp_path = path.with_name('{}.{}.{}.tmp'.format(path.name, os.getpid(), threading.get_ident()))
+    try:
+        with open(tmp_path, mode, newline=newline) as outfile:
+            yield outfile
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+
+def getAppSetup(reload=False):
+    ''' App setup is read on first use and shared by every module afterwards '''
+    global _APP_SETUP
+    if _APP_SETUP is None or reload:
+        with open(SETUP_DIR) as infile:
+            _APP_SETUP = json.load(infile)
+    return _APP_SETUP
+
+def saveAppSetup(setup):
+    global _APP_SETUP
+    _APP_SETUP = setup
+    with fileLock(SETUP_DIR):
+        with atomicWrite(SETUP_DIR) as outfile:
+            json.dump(setup, outfile, indent=4)
+
+def updateAppSetup(update):
+    '''
+    Applies update(setup) to the setup on disk under the setup lock, so concurrent processes
+    saving different users do not overwrite each other
+    '''
+    with fileLock(SETUP_DIR):
+        setup = getAppSetup(reload=True)
+        update(setup)
+        saveAppSetup(setup)
+    return setup
 
+# Inside the pipeline time is an int UTC epoch ms, these strings are only for storage and display
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 def toTimeStamp(date):
-    return int(dt.datetime.timestamp(date)*1000)
+    ''' datetime -> UTC epoch ms, naive datetimes are UTC '''
+    if date.tzinfo == None:
+        date = date.replace(tzinfo=dt.timezone.utc)
+    return int(date.timestamp() * 1000)
 
 def toDate(timestamp):
-    return dt.datetime.fromtimestamp(int(timestamp/1000))
+    ''' UTC epoch ms -> naive UTC datetime '''
+    return EPOCH + dt.timedelta(milliseconds=int(timestamp))
 
 def dateToString(date):
-    return date.strftime('%Y-%m-%d %H:%M:%S')
+    return date.strftime(TIME_FORMAT)
 
 def stringToDate(date):
-    return dt.datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+    return dt.datetime.fromisoformat(date)
 
 def timestampToString(ts):
-    return dateToString(toDate(ts))
+    return time.strftime(TIME_FORMAT, time.gmtime(int(ts) // 1000))
 
 def stringToTimeStamp(date):
     return toTimeStamp(stringToDate(date))
 
+def asTimeStamp(value):
+    ''' UTC epoch ms of a time given either as epoch ms or as a time string '''
+    return stringToTimeStamp(value) if isinstance(value, str) else int(value)
 
-def dbRead(db_name, start_date, end_date, combine_dates=False, headers=[], fill_values=0, filters=[]):
-    directory = Path(db_name).with_suffix('.csv')
+def toEpochMs(times):
+    ''' Convert a scalar or sequence of date strings / datetimes / epoch ms to an int64 array of UTC ms '''
+    import numpy as np
+    import pandas as pd
 
-    data = pd.read_csv(directory, index_col=0)
-    
-    if filters:
-        for filt in filters:
-            data = data[data[[*filt][0]] == filt[[*filt][0]]]
+    times = np.atleast_1d(np.asarray(times))
+    if np.issubdtype(times.dtype, np.number):
+        return times.astype(np.int64)
+    try:
+        dates = pd.to_datetime(times, format=TIME_FORMAT)
+    except ValueError:
+        dates = pd.to_datetime(times)
+    return dates.values.astype('datetime64[ms]').astype(np.int64)
 
-    if headers:
-        data = data.reindex(headers, axis=1)
+def epochMsToStrings(times):
+    ''' int64 array of UTC ms -> list of time strings, formatted for the whole column at once '''
+    import numpy as np
+    import pandas as pd
 
-    start_date = start_date if start_date > data.index[0] else data.index[0]    
-    end_date = end_date if end_date < data.index[-1] else data.index[-1]
+    return list(pd.to_datetime(np.asarray(times, dtype=np.int64), unit='ms').strftime(TIME_FORMAT))
 
-    data = data.loc[start_date:end_date, :].fillna(fill_values)
-    
-    if combine_dates:
-        data.insert(0, 'time', data.index)
 
-    assets = list(data.columns)
-    out_data = data.to_dict('records')
-    
-    data_packet = HistoricalDataPackage(list(data.index), out_data, assets)
-    return data_packet
+def dbRead(db_name, start_date, end_date, combine_dates=False, headers=[], fill_values=0, filters=[], dtypes={}):
+    '''
+    headers: columns to return, only these (and the filter columns) are parsed
+    filters: list of {column: value} equality filters, applied while the rows are read
+    dtypes: {column: type} given to the parser instead of inferring them
+    '''
+    return storage().read(db_name, start_date, end_date, combine_dates, headers, fill_values, filters, dtypes)
+
+def dbReadChunks(db_name, start_date, end_date, combine_dates=False, fill_values=0, chunk_size=10000, epoch_times=False):
+    '''
+    Same rows as dbRead but yielded as lists of records, one chunk at a time, so the whole
+    table is never loaded. Missing tables yield nothing.
+    epoch_times: the combined time column is given as UTC epoch ms, parsed per chunk
+    '''
+    return storage().readChunks(db_name, start_date, end_date, combine_dates, fill_values, chunk_size, epoch_times)
+
+def iterChunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def constructHistoricalHoldingsFromActions(actions, chunk_size=10000):
+    '''
+    actions: ActionBatch or any iterable of actions, consumed chunk_size actions at a time
+    Daily cumulative holdings per asset from the first action until today
+    '''
+    from action_batch import ActionBatch, DailyMovements
 
-def constructHistoricalHoldingsFromActions(actions):
+    movements = DailyMovements()
+    if isinstance(actions, ActionBatch):
+        movements.add(actions)
+    else:
+        for chunk in iterChunks(actions, chunk_size):
+            movements.add(ActionBatch.fromActions(chunk))
 
-    now_date = dateToString(dt.datetime.utcnow())[:10]
-    
-    actioned_assets = list(set([action.asset for action in actions]))
-    all_actions_dicts = [action.toBaseDict() for action in actions]
+    return holdingsFromMovements(movements)
 
-    all_actions_df = pd.DataFrame(all_actions_dicts).set_index('time')
-    all_actions_df['date'] = all_actions_df.index.str.slice(0,10)
-    dates = list(all_actions_df['date']) + [now_date]
-    
-    new_index = pd.to_datetime(pd.unique(dates))
-    historical_positioning = pd.DataFrame(data=0.0, index = new_index, columns=actioned_assets).resample('D').bfill()
-    historical_positioning.index = historical_positioning.index.strftime("%Y-%m-%d")
-    
-    for asset in actioned_assets:
-        coin_movements = all_actions_df[all_actions_df['asset']==asset].groupby('date').sum().rename({'amount': asset}, axis=1)
-        historical_positioning.loc[coin_movements.index, asset] = coin_movements[asset]
-    
-    historical_positioning = historical_positioning.cumsum()
+def holdingsFromMovements(movements):
+    ''' movements: DailyMovements, padded to today and accumulated into daily holdings '''
+    import numpy as np
+    import pandas as pd
+
+    day_ms = 24 * 60 * 60 * 1000
+
+    first_day, daily_movements, actioned_assets = movements.first_day, movements.movements, movements.assets
+    today = toTimeStamp(dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)) // day_ms
+    if first_day == None:
+        first_day = today
+    if today >= first_day + len(daily_movements):
+        daily_movements = np.vstack([daily_movements, np.zeros((today - first_day - len(daily_movements) + 1, len(actioned_assets)))])
+
+    historical_positioning = pd.DataFrame(daily_movements.cumsum(axis=0), columns=actioned_assets,
+                                          index=pd.to_datetime((first_day + np.arange(len(daily_movements))) * day_ms, unit='ms').strftime("%Y-%m-%d"))
     historical_positioning.insert(0, 'time', historical_positioning.index)
 
     out_dates = list(historical_positioning.index)
@@ -171,13 +267,13 @@ def gen_date_pairs(start_date, end_date=None, freq=90, out_type='string'):
     start_date: str
     end_date: str
 
-    return list of out_type
+    return list of out_type - contiguous windows, each starting 1 ms after the previous one ends
     '''
     dates = []
     s_date = stringToDate(start_date)
 
     if end_date == None:
-        final_date = dt.datetime.today()
+        final_date = dt.datetime.utcnow()
     else:
         final_date = stringToDate(end_date)
     while(True):
@@ -187,7 +283,7 @@ def gen_date_pairs(start_date, end_date=None, freq=90, out_type='string'):
             break
         else:
             dates.append((s_date, e_date))
-            s_date = s_date + dt.timedelta(days=freq + 1)
+            s_date = e_date + dt.timedelta(milliseconds=1)
 
     if out_type == 'timestamp':
         dates = [(toTimeStamp(a_date), toTimeStamp(b_date)) for a_date, b_date in dates]
@@ -197,35 +293,56 @@ def gen_date_pairs(start_date, end_date=None, freq=90, out_type='string'):
     
     return dates
 
+def fetchDateWindows(fetch, start_date, end_date=None, freq=90, time_key=None, max_workers=4):
+    '''
+    fetch: callable(start_ts, end_ts) -> list of records for one window
+    time_key: str - record field used to merge the windows in time order
+
+    Windows are independent so they are requested concurrently (the client's rate limiter
+    paces the actual requests). Incremental syncs pass their stream's last update date as
+    start_date, so windows already covered are never generated.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    date_pairs = gen_date_pairs(start_date, end_date, freq=freq, out_type='timestamp')
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(date_pairs))) as pool:
+        windows = list(pool.map(lambda pair: fetch(*pair) or [], date_pairs))
+
+    records = [record for window in windows for record in window]
+    if time_key:
+        records.sort(key=lambda record: record[time_key])
+
+    return records
+
+def storage():
+    # storage.py builds on this module, so the backend is looked up on first use
+    from storage import getStorage
+    return getStorage()
+
 def getDBInfo(db):
-    db = db.with_suffix('.json')
-    with open(db) as infile:
-        info = json.load(infile)
-    return info
+    return storage().getInfo(db)
 
 def updateDBInfo(db, out_dict):
-    db = db.with_suffix('.json')
-    with open(db, 'w') as outfile:
-        json.dump(out_dict, outfile, indent=4)
+    storage().updateInfo(db, out_dict)
 
 def addRowsToDB(db, rows, headers):
-    db = db.with_suffix('.csv')
-    rows = sorted(rows, key=lambda d: d['time']) 
-    with open(db, 'a', newline='') as output_file:
-        dict_writer = csv.DictWriter(output_file, headers)
-        dict_writer.writerows(rows)
-    return
+    storage().append(db, rows, headers)
+
+def upsertRowsToDB(db, rows, headers, key_columns, exchange_code):
+    '''
+    Idempotent addRowsToDB: rows whose natural key (exchange code plus key_columns) is already
+    stored are skipped, checked against the table's key index without reading the table.
+    Returns the rows that were written.
+    '''
+    return storage().upsert(db, rows, headers, key_columns, exchange_code)
+
+def compactDB(db, headers, key_columns, exchange_codes):
+    ''' Drops duplicate rows (same key columns) and rebuilds the key index, returns the number removed '''
+    return storage().compact(db, headers, key_columns, exchange_codes)
 
 def dumpToDB(db, data, headers):
-    db = db.with_suffix('.csv')
-    data = sorted(data, key=lambda d: d['time']) 
-    with open(db, 'w', newline='') as output_file:
-        dict_writer = csv.DictWriter(output_file, headers)
-        dict_writer.writeheader()
-        dict_writer.writerows(data)
-    
-    print('Dumped data to db {}!'.format(db))
-    return
+    storage().dump(db, data, headers)
 
 def printProgressBar(iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '█', printEnd = "\r"):
     """
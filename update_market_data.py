@@ -1,81 +1,98 @@
-import ccxt
 from global_vars import *
-from tools import stringToTimeStamp, timestampToString, getDBInfo, dumpToDB, toTimeStamp, updateDBInfo, addRowsToDB
+from tools import stringToTimeStamp, timestampToString, getDBInfo, toTimeStamp, updateDBInfo, fileLock
 import datetime as dt
 
-exchange = ccxt.binance({
-    'enableRateLimit': True
-})
+# The backfill engine and the market store pull in asyncio, numpy and pandas, so they are
+# imported by the functions that run them to keep importing this module cheap.
 
 msec = 1000
 minute = 60 * msec
 hour = 60 * minute
 
-now = exchange.milliseconds()
-
-def getMarketData(symbol, from_timestamp, limit, timeframe):
-    if isinstance(from_timestamp, str):
-        from_timestamp = stringToTimeStamp(from_timestamp)
-    try:
-        market_data = exchange.fetch_ohlcv( 
-            symbol=symbol, 
-            timeframe=timeframe,
-            limit=limit, 
-            since=from_timestamp
-        )
-
-        for data in market_data:
-            data[0] = timestampToString(data[0])
-        headers = ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']
-        
-        out_data = []
-        for data_point in market_data:
-            data_point.append(symbol)
-            out_data.append({k:v for k,v in zip(headers, data_point)})
-        
-        return out_data
-
-    except Exception as e:
-        print(e)
-
-def updateMarketDB(assets=[]):
-    end_date = toTimeStamp(dt.datetime.utcnow())
-    db_name = db = MARKET_DATA_PATH / 'hourly_market_data'
-    db_info = getDBInfo(db_name)
-    initial_date = db_info['initial_date']
-    headers = db_info['headers']
-
-    limit = 1000
-    timeframe = '1h'
-    current_assets = db_info['current_assets']
-    full_dump = False
-
-    assets_to_update = current_assets if assets == [] else assets
-    
-    start_date = initial_date if db_info['last_update_date'] == '' else db_info['last_update_date']
-    full_dump = True if db_info['last_update_date'] == '' else False
-    
-    starting_timestamp = stringToTimeStamp(start_date)
-    market_data = []
-
-    for symbol in assets_to_update:
-        from_timestamp = starting_timestamp
-        while (from_timestamp < end_date):
-            data_for_symbol = getMarketData(symbol, from_timestamp, limit, timeframe)
-            if data_for_symbol:
-                from_timestamp = stringToTimeStamp(data_for_symbol[-1]['time']) + minute
-                market_data.extend(data_for_symbol)
-            else:
-                from_timestamp += hour * 1000
-
-    if full_dump:
-        dumpToDB(db, market_data, headers)
-    else:
-        addRowsToDB(db, market_data, headers)
-    
-    db_info = {'initial_date': initial_date, 'last_update_date': market_data[-1]['time'], "current_assets": current_assets, 'headers': headers}
-        
-    updateDBInfo(db, db_info)
-
-updateMarketDB()
+def getSymbolStart(symbol, watermarks, initial_date, store):
+    ''' Resume from the later of the symbol's checkpoint and its last stored candle, new symbols start at initial_date '''
+    last_times = [stringToTimeStamp(watermarks[symbol])] if watermarks.get(symbol, '') != '' else []
+    if store.lastTime(symbol) != None:
+        last_times.append(store.lastTime(symbol))
+
+    return max(last_times) + hour if last_times else stringToTimeStamp(initial_date)
+
+def updateMarketDB(assets=[], exchange=None, now=None):
+    '''
+    exchange: async ccxt-like exchange to page candles from (see market_backfill.py), Binance when None
+    now: int - epoch ms, the current time when None
+    '''
+    from market_backfill import backfill
+    from market_store import getMarketStore
+    from market_rollups import updateRollups
+
+    now = toTimeStamp(dt.datetime.utcnow()) if now == None else now
+    # Only closed candles are stored, the hour still open is fetched by the next run
+    end_date = now // hour * hour
+    db = MARKET_DATA_PATH / 'hourly_market_data'
+
+    # One market job at a time, user syncs never touch these files so they run alongside it
+    with fileLock(db):
+        db_info = getDBInfo(db)
+        initial_date = db_info['initial_date']
+        current_assets = db_info['current_assets']
+        watermarks = db_info.get('watermarks', {})
+        store = getMarketStore()
+
+        limit = 1000
+        timeframe = '1h'
+
+        assets_to_update = current_assets if assets == [] else assets
+        starts = {symbol: getSymbolStart(symbol, watermarks, initial_date, store) for symbol in assets_to_update}
+
+        def checkpoint(symbol, rows):
+            # Every page is persisted with its symbol's watermark so an interrupted run resumes from here
+            store.appendRows(rows)
+            watermarks[symbol] = timestampToString(rows[-1]['time'])
+            tracked = [watermarks[s] for s in current_assets if watermarks.get(s, '') != '']
+            db_info['watermarks'] = watermarks
+            db_info['last_update_date'] = min(tracked) if len(tracked) == len(current_assets) else ''
+            updateDBInfo(db, db_info)
+
+        def progress(symbol, n_rows, fraction):
+            print('{}: {} candles ({:.0%})'.format(symbol, n_rows, fraction))
+
+        if exchange == None:
+            import ccxt.async_support as ccxt_async
+            exchange = ccxt_async.binance({'enableRateLimit': False})
+
+        last_times = backfill(exchange, starts, end_date, checkpoint,
+                              timeframe=timeframe, limit=limit, on_progress=progress)
+
+        updated_symbols = [symbol for symbol, last_time in last_times.items() if last_time != None]
+        if not updated_symbols:
+            print('No new market data to add!')
+            return
+
+        updateRollups(updated_symbols, now=now)
+
+def importLegacyMarketData():
+    '''
+    One-off import of the legacy flat hourly_market_data.csv into the partitioned store, so an
+    upgraded install does not download its history again. Skipped once the store has data.
+    '''
+    from market_store import getMarketStore
+    from market_rollups import updateRollups
+
+    db = MARKET_DATA_PATH / 'hourly_market_data'
+    csv_path = db.with_suffix('.csv')
+
+    with fileLock(db):
+        store = getMarketStore()
+        if not csv_path.exists() or store.symbols():
+            return 0
+
+        added = store.importCSV(csv_path)
+        updateRollups(store.symbols())
+
+    print('Imported {} hourly candles from {}'.format(added, csv_path))
+    return added
+
+if __name__ == '__main__':
+    updateMarketDB()
 
@@ -8,188 +8,25 @@ layout of this service
 Must be able to run hourly (hourly market data), run upon new user creation, run overnight
 '''
 
-import json
 import datetime as dt
+import sys
 
-from exchange import Exchange
-from exchange_actions import *
 from global_vars import *
-from tools import getDBInfo, dumpToDB, updateDBInfo, addRowsToDB, dbRead, constructHistoricalHoldingsFromActions
+from tools import getDBInfo, dumpToDB, updateDBInfo, addRowsToDB, iterChunks, constructHistoricalHoldingsFromActions, holdingsFromMovements, getAppSetup, userLock, fileLock, dateToString
+from update_market_data import importLegacyMarketData
 
-with open(SETUP_DIR) as infile:
-    SETUP = json.load(infile)
+# The exchange clients, the history streams and the storage backends pull in requests,
+# asyncio, sqlite3, numpy and pandas, so they are imported by the functions that use them.
 
 
 def loadAllDataFromExchange(user, exchange):
-    end_date = dt.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Update trades
-    db = USER_DATA_PATH / (user + '/historical_data/historical_trades') 
-
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    assets_traded = db_info[exchange.code]['assets_traded']
-    full_download = False
-
-    # TODO(): User may have created an account but not traded which will force an update here and will take very long! must fix!
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-    else:    
-        current_assets = exchange.getCurrentHoldings().keys()    
-        new_assets = [asset for asset in current_assets if asset not in assets_traded]
-        assets_traded.extend(new_assets)
-    
-    new_trades = exchange.getTrades(start_date, end_date, assets_traded)
-
-    if not assets_traded:
-        assets_traded = list(set([trade['asset'] for trade in new_trades]))
-
-    if full_download:
-        dumpToDB(db, new_trades, headers)
-    else:
-        addRowsToDB(db, new_trades, headers)
-    
-    out_dict = {exchange.code: {'last_update_date': end_date, 'assets_traded': assets_traded}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-    
-    # Update deposits
-    db = USER_DATA_PATH / (user + '/historical_data/historical_deposits')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-    
-    new_deposits = exchange.getDeposits(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_deposits, headers)
-    else:
-        addRowsToDB(db, new_deposits, headers)
-
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    # Update withdrawals
-    db = USER_DATA_PATH / (user + '/historical_data/historical_withdrawals')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-
-    new_withdrawals = exchange.getWithdrawals(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_withdrawals, headers)
-    else:
-        addRowsToDB(db, new_withdrawals, headers)
-
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    # Update fiat
-    db = USER_DATA_PATH / (user + '/historical_data/historical_fiat_movements')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-    
-    new_fiat = exchange.getFiatTransactions(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_fiat, headers)
-    else:
-        addRowsToDB(db, new_fiat, headers)
-    
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    # Update dust
-    db = USER_DATA_PATH / (user + '/historical_data/historical_dust_activities')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-
-    new_dust = exchange.getAccountDust(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_dust, headers)
-    else:
-        addRowsToDB(db, new_dust, headers)
-
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    # Update dividends
-    db = USER_DATA_PATH / (user + '/historical_data/historical_dividends')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-
-    new_dividends = exchange.getAccountDividends(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_dividends, headers)
-    else:
-        addRowsToDB(db, new_dividends, headers)
-
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    # Update conversions
-    db = USER_DATA_PATH / (user + '/historical_data/historical_conversions')
-    db_info = getDBInfo(db)
-    start_date = db_info[exchange.code]['last_update_date']
-    headers = db_info['headers']
-    full_download = False
-
-    if start_date == "":
-        start_date = "2017-01-01 00:00:00"
-        full_download = True
-        
-    new_conversions = exchange.getAccountConversions(start_date, end_date)
-
-    if full_download:
-        dumpToDB(db, new_conversions, headers)
-    else:
-        addRowsToDB(db, new_conversions, headers)
-
-    out_dict = {exchange.code: {'last_update_date': end_date}, 'headers': headers}
-
-    updateDBInfo(db, out_dict)
-
-    return
+    from history_streams import syncUserHistory
+    syncUserHistory(user, [exchange])
 
 def createHistoricalUserActions(user, all_actions=False):
+    ''' Lazy, time ordered stream of the user's actions (with derived fee and opposite legs) '''
+    from history_streams import iterUserActions
+
     end_date = dateToString(dt.datetime.utcnow())
     db_name = USER_DATA_PATH / (user + '/historical_data/historical_movements')
     db_info = getDBInfo(db_name)
@@ -198,61 +35,47 @@ def createHistoricalUserActions(user, all_actions=False):
     if start_date == ''or all_actions == True:
         start_date = '2017-01-01 00:00:00'
 
-    # Compile all the moves that the user has performed in the 
-    db = USER_DATA_PATH / (user + '/historical_data/historical_trades') 
-    trades = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_deposits')
-    deposits = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_fiat_movements')
-    fiat = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_withdrawals')    
-    withdrawals = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_dust_activities')
-    dust = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_dividends')
-    dividends = dbRead(db, start_date, end_date, combine_dates=True)
-    db = USER_DATA_PATH / (user + '/historical_data/historical_conversions')
-    conversions = dbRead(db, start_date, end_date, combine_dates=True)
-
-    actions = []
-    trades = [TradeAction(ta, re_key=False) for ta in trades.data]
-    deposits = [DepositAction(da, re_key=False) for da in deposits.data]
-    fiat = [FiatDepositAction(fa, re_key=False) for fa in fiat.data]
-    withdrawals = [WithdrawlAction(wa, re_key=False) for wa in withdrawals.data]
-    dust = [DustSweepAction(du, re_key=False) for du in dust.data]
-    dividends = [DividendAction(da, re_key=False) for da in dividends.data]
-    conversions = [ConversionAction(ca, re_key=False) for ca in conversions.data]
-
-    actions.extend(trades + deposits + fiat + withdrawals + dust + dividends + conversions)
-    actions = getAdditionalInformation(actions)
-
-    return actions
-
-def exportActions(user, all_actions, full_download):
+    return iterUserActions(user, start_date, end_date)
+
+def exportActions(user, all_actions, full_download, chunk_size=10000):
+    '''
+    all_actions: any iterable of actions, written chunk_size actions at a time
+    Returns the DailyMovements of everything written so holdings need no second pass
+    '''
+    from action_batch import ActionBatch, DailyMovements
 
     end_date = dateToString(dt.datetime.utcnow())
     db_name = USER_DATA_PATH / (user + '/historical_data/historical_movements')
     db_info = getDBInfo(db_name)
     headers = db_info['headers']
 
-    out_data = [action.toBaseDict() for action in all_actions]
+    movements = DailyMovements()
+    for i, chunk in enumerate(iterChunks(all_actions, chunk_size)):
+        out_data = [action.toBaseDict() for action in chunk]
+        if full_download and i == 0:
+            dumpToDB(db_name, out_data, headers)
+        else:
+            addRowsToDB(db_name, out_data, headers)
+        movements.add(ActionBatch.fromActions(chunk))
 
-    if full_download:
-        dumpToDB(db_name, out_data, headers)
-    else:
-        addRowsToDB(db_name, out_data, headers)
+    if full_download and movements.first_day == None:
+        dumpToDB(db_name, [], headers)
 
     out_dict = {'last_update_date': end_date, 'headers': headers}
     updateDBInfo(db_name, out_dict)
+    return movements
 
-def createHistoricalUserHoldings(user, actions=[]):
+def createHistoricalUserHoldings(user, actions=[], movements=None):
+    '''
+    actions: iterable of actions, all stored actions are streamed when empty
+    movements: DailyMovements already accumulated (e.g. by exportActions), used instead of actions
+    '''
     end_date = dateToString(dt.datetime.utcnow())
-    if actions:
-        all_actions = actions
+    if movements != None:
+        historical_holdings = holdingsFromMovements(movements)
     else:
-        all_actions = createHistoricalUserActions(user, all_actions=True)
-    
-    historical_holdings = constructHistoricalHoldingsFromActions(all_actions)
+        all_actions = actions if actions else createHistoricalUserActions(user, all_actions=True)
+        historical_holdings = constructHistoricalHoldingsFromActions(all_actions)
     
     db_name = USER_DATA_PATH / (user + '/historical_data/historical_holdings')
     headers = historical_holdings.assets
@@ -265,31 +88,109 @@ def createHistoricalUserHoldings(user, actions=[]):
     return
 
 def createHistoricalUserData(user, exchange):
-    loadAllDataFromExchange(user, exchange)
-    user_actions = createHistoricalUserActions(user, all_actions=True)
-    exportActions(user, user_actions, full_download=True)
-    createHistoricalUserHoldings(user, actions=user_actions)
+    with userLock(user):
+        loadAllDataFromExchange(user, exchange)
+        # One pass: actions stream from storage into the movements export and the holdings aggregation
+        movements = exportActions(user, createHistoricalUserActions(user, all_actions=True), full_download=True)
+        createHistoricalUserHoldings(user, movements=movements)
     return
 
+def updateUser(user, exchanges):
+    # Holds the user's lock so another job cannot interleave with this user's tables, other users run freely
+    from history_streams import syncUserHistory
 
-def main():
-    # TODO: Check how to avoid creating the new actions if there are no new actions in any exchange. Look at most up to date holdings compared to getCurrentHoldings()
-    for user in SETUP['users']:
-        # Update the data from each of the respective exchanges that
-        # the user has signed up to. 
-        for ex in SETUP['users'][user]['user_exchanges']:
-            current_exchange = Exchange.from_dict(ex)
-
-            loadAllDataFromExchange(user, current_exchange)
-
-        user_actions = createHistoricalUserActions(user)
-        if user_actions:
-            exportActions(user, user_actions, full_download=True)
-            createHistoricalUserHoldings(user, actions=user_actions)
-
-
-createHistoricalUserHoldings('0001')
-
+    with userLock(user):
+        syncUserHistory(user, exchanges)
 
+        # Records can land anywhere in the stored history (late reports, rows timed before the last
+        # export), so movements and holdings are rebuilt together from one pass over all of it
+        movements = exportActions(user, createHistoricalUserActions(user, all_actions=True), full_download=True)
+        createHistoricalUserHoldings(user, movements=movements)
 
 
+def main(users=[]):
+    # TODO: Check how to avoid creating the new actions if there are no new actions in any exchange. Look at most up to date holdings compared to getCurrentHoldings()
+    from exchange import Exchange
+    from client_pool import closeClients
+
+    setup = getAppSetup()
+    try:
+        for user in users or setup['users']:
+            # Update the data from each of the respective exchanges that
+            # the user has signed up to. 
+            exchanges = [Exchange.from_dict(ex) for ex in setup['users'][user]['user_exchanges']]
+            updateUser(user, exchanges)
+    finally:
+        # The users' exchanges share the pooled sessions, they are closed once every user is synced
+        closeClients()
+
+
+def compact(users=[]):
+    ''' Removes duplicate history rows left by earlier syncs (all users when none are given) '''
+    from history_streams import compactUserHistory
+
+    setup = getAppSetup()
+    for user in users or setup['users']:
+        with userLock(user):
+            compactUserHistory(user)
+
+
+def migrateTable(db, source, target):
+    from storage import copyTable
+
+    try:
+        copyTable(db, source, target)
+    except FileNotFoundError:
+        print('No table {} to migrate - skipping!'.format(db))
+        return False
+    return True
+
+def migrateUser(user, source, target):
+    ''' Copies a user's history, movements and holdings tables, rebuilding the target's key indexes '''
+    from history_streams import HISTORY_STREAMS
+
+    for stream in HISTORY_STREAMS:
+        db = stream.db(user)
+        if migrateTable(db, source, target):
+            exchange_codes = [code for code in target.getInfo(db).keys() if code in EXCHANGE_CODES.values()]
+            target.compact(db, stream.headers, stream.key_columns, exchange_codes)
+
+    for name in ['historical_movements', 'historical_holdings']:
+        migrateTable(USER_DATA_PATH / (user + '/historical_data/' + name), source, target)
+
+def migrate(source, target, users=[]):
+    '''
+    Upgrade path for existing installs: imports the legacy hourly market CSV into the market
+    store, then copies every user's tables and the market descriptor from the source storage
+    backend to the target one. Run it before switching STORAGE_BACKEND.
+    '''
+    from storage import getStorage
+
+    importLegacyMarketData()
+    if source == target:
+        return
+
+    source, target = getStorage(source), getStorage(target)
+    market_db = MARKET_DATA_PATH / 'hourly_market_data'
+    with fileLock(market_db):
+        try:
+            target.updateInfo(market_db, source.getInfo(market_db))
+        except FileNotFoundError:
+            print('No market data descriptor to migrate - skipping!')
+
+    setup = getAppSetup()
+    for user in users or setup['users']:
+        with userLock(user):
+            migrateUser(user, source, target)
+
+
+if __name__ == '__main__':
+    # python update_user_data.py [user ...]          - sync the given users (all when none given)
+    # python update_user_data.py compact [user ...]
+    # python update_user_data.py migrate <source backend> <target backend> [user ...]
+    if len(sys.argv) > 1 and sys.argv[1] == 'compact':
+        compact(sys.argv[2:])
+    elif len(sys.argv) > 3 and sys.argv[1] == 'migrate':
+        migrate(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        main(sys.argv[1:])
@@ -1,40 +1,38 @@
 
-from pandas.core.indexes import base
 from global_vars import USER_DATA_PATH, EXCHANGE_CODES
-from portfolio import Portfolio
-from tools import createFileInDirectory, createJsonDescriptors
-from exchange import Exchange
+from tools import createFileInDirectory, createJsonDescriptors, getAppSetup, updateAppSetup, getDBInfo, updateDBInfo, userLock
 from update_user_data import createHistoricalUserData
 
-import json
-from pathlib import Path
 import datetime as dt
-import os
 
-# When App starts
-SETUP_DIR = Path('data/app_setup.json')
-with open(SETUP_DIR) as infile:
-    SETUP = json.load(infile)
+# Portfolio, Exchange and the history streams pull in the exchange clients, asyncio and
+# pandas, so they are imported by the methods that need them.
 
 DEFAULT_PORTFOLIO = {'portfolio_name': 'Untitled', 'update_date':'2017-01-01'}
 
 class User(object):
     def __init__(self, survey) -> None:
         
-        max_id = SETUP['total']
-        all_users = User.getAllUsers()
-        user_name = survey['user_name']
+        self.user_name = survey['user_name']
+        self.reporting_currency = survey['reporting_currency']
+        self.user_portfolios = []
+        self.user_exchanges = []
+
+        # The name check and the id allocation happen in one locked setup update, so two
+        # processes creating users never get the same id
+        def register(setup):
+            if self.user_name in [user['user_name'] for user in setup['users'].values()]:
+                return
+            setup['total'] += 1
+            self.user_id = str(setup['total']).zfill(4)
+            setup['users'][self.user_id] = self.toDict()
+
+        updateAppSetup(register)
 
-        if user_name in all_users:
+        if not hasattr(self, 'user_id'):
             raise Exception('ERROR! - Username already in use please log in!')
 
         else:
-            self.user_id = str(max_id + 1).zfill(4)
-            self.user_name = user_name
-            self.reporting_currency = survey['reporting_currency']
-            self.user_portfolios = []
-            self.user_exchanges = []
-
             # Must create all the data files for the user here
             files_to_create = [ 
                 "historical_trades.csv",
@@ -53,21 +51,21 @@ class User(object):
             createFileInDirectory(full_dirs)
             createJsonDescriptors(base_directory)
 
-            SETUP['total'] += 1
             self.save()
     
     @staticmethod
     def getAllUsers():
-        return[SETUP['users'][user] for user in SETUP['users'].keys()]
+        setup = getAppSetup()
+        return[setup['users'][user] for user in setup['users'].keys()]
 
     @classmethod
     def from_user_id(cls, id):
+        from exchange import Exchange
+        from portfolio import Portfolio
 
         ob = cls.__new__(cls)
 
-        with open(SETUP_DIR) as infile:
-            setup = json.load(infile)
-        
+        setup = getAppSetup(reload=True)
         user_config = setup['users'][id]
 
         ob.user_id = id
@@ -82,6 +80,9 @@ class User(object):
         return ob
 
     def addExchange(self, exchange_data):
+        from exchange import Exchange
+        from history_streams import HISTORY_STREAMS
+
         exchange_code = EXCHANGE_CODES[exchange_data['exchange_name']]
 
         for exchange in self.user_exchanges:
@@ -91,24 +92,12 @@ class User(object):
 
         self.user_exchanges.append(Exchange(exchange_code, exchange_data['api_public'], exchange_data['api_secret'], exchange_data['is_default']))
     
-        base_directory = USER_DATA_PATH / (self.user_id + '/historical_data/')
-
-        for f in os.listdir(base_directory):
-            if f.endswith(".json"):
-                with open(base_directory / f) as infile:
-                    my_dict = json.load(infile)
-                
-                file_name = f.split('.')[0]
-
-                if file_name == "historical_movements" or file_name == "historical_holdings":
-                    continue
-                elif file_name  == 'historical_trades':
-                    my_dict.update({exchange_code:{"last_update_date": "", "assets_traded":[]}})
-                else:
-                    my_dict.update({exchange_code:{"last_update_date": ""}})
-
-                with open(base_directory / f, 'w') as outfile:
-                    json.dump(my_dict, outfile, indent=4)
+        with userLock(self.user_id):
+            for stream in HISTORY_STREAMS:
+                db = stream.db(self.user_id)
+                db_info = getDBInfo(db)
+                db_info.update({exchange_code: stream.newExchangeState()})
+                updateDBInfo(db, db_info)
 
         self.updatePortfolios()
         self.save()
@@ -128,22 +117,20 @@ class User(object):
                 raise Warning('A portfolio named {} was not found please try again!'.format(portfolio_name))
 
     def save(self):
-        existing_ids = SETUP['users'].keys()
-        
-        if self.user_id in existing_ids:
-            SETUP['users'][self.user_id] = self.toDict()
-        else:
-            SETUP['users'].update({self.user_id: self.toDict()})
+        user_dict = self.toDict()
+
+        # Only this user's entry is replaced in the setup on disk, other processes' users are kept
+        def update(setup):
+            if self.user_id not in setup['users']:
+                setup['total'] = max(setup['total'], int(self.user_id))
+            setup['users'][self.user_id] = user_dict
 
-        with open(SETUP_DIR, 'w') as outfile:
-            json.dump(SETUP, outfile, indent=4)
+        updateAppSetup(update)
         
         return
     
     def deleteUser(self):
-        SETUP['users'].pop(self.user_id, None)
-        with open(SETUP_DIR, 'w') as outfile:
-            json.dump(SETUP, outfile, indent=4)
+        updateAppSetup(lambda setup: setup['users'].pop(self.user_id, None))
 
     def toDict(self):
         outdict = {}
@@ -164,6 +151,8 @@ class User(object):
         return outdict
     
     def createPortfolio(self, port_settings):
+        from portfolio import Portfolio
+
         port_settings['user_id'] = self.user_id
         port_settings['reporting_currency'] = self.reporting_currency
         port_settings['current_holdings'] = {}